@@ -3,6 +3,10 @@ import os
 from rich import print, pretty
 
 from smauto.language import build_model
+from smauto.lib.profiler import Profiler
+from smauto.lib.runner import ModelRunner
+from smauto.lib.sharding import SHARDING_MODES, ShardedExecutor
+from smauto.lib.simulation import Simulation
 from smauto.transformations import model_to_vnodes, smauto_m2t
 from smauto.transformations import model_to_vent
 
@@ -25,7 +29,7 @@ def cli(ctx):
 @click.pass_context
 @click.argument("model_path")
 def validate(ctx, model_path):
-    model = build_model(model_path)
+    build_model(model_path)
     print("[*] Model validation success!!")
 
 
@@ -70,5 +74,82 @@ def generate_vent(ctx, model_path: str, merged: bool):
             print(f"[CLI] Compiled virtual Entity: [bold]{filepath}")
 
 
+@cli.command("run", help="Run the Automations of a model")
+@click.pass_context
+@click.argument("model_path")
+@click.option(
+    "--reload",
+    "-r",
+    is_flag=True,
+    help="Reload the model whenever its file is modified",
+)
+@click.option(
+    "--profile",
+    "-p",
+    "profile_path",
+    default=None,
+    help="File to dump the Automation profile to on exit",
+)
+@click.option(
+    "--shards",
+    "-s",
+    type=int,
+    default=1,
+    help="Number of processes to run the Automations in",
+)
+@click.option(
+    "--sharding",
+    type=click.Choice(SHARDING_MODES),
+    default="balanced",
+    help="How to partition the Automations",
+)
+def run(ctx, model_path, reload, profile_path, shards, sharding):
+    model = build_model(model_path)
+    if shards > 1:
+        if reload:
+            raise click.UsageError("--reload is not supported with --shards")
+        executor = ShardedExecutor(model, shards, sharding, profile_path=profile_path)
+        executor.run()
+        return
+    runner = ModelRunner(model, profile_path=profile_path)
+    runner.run(reload=reload)
+
+
+@cli.command("profile", help="Summarize an Automation profile dump")
+@click.pass_context
+@click.argument("profile_path")
+def profile(ctx, profile_path):
+    profiler = Profiler.load(profile_path)
+    profiler.print_summary()
+
+
+@cli.command("simulate", help="Replay recorded Entity messages in virtual time")
+@click.pass_context
+@click.argument("model_path")
+@click.argument("messages_path")
+@click.option(
+    "--duration",
+    "-d",
+    type=float,
+    required=True,
+    help="Seconds of virtual time to simulate",
+)
+@click.option(
+    "--output",
+    "-o",
+    default=None,
+    help="File to write the action messages to",
+)
+def simulate(ctx, model_path, messages_path, duration, output):
+    model = build_model(model_path)
+    simulation = Simulation(model)
+    simulation.load(messages_path)
+    published = simulation.run(duration)
+    print(f"[CLI] Simulated {duration}s, {len(published)} action messages")
+    if output is not None:
+        simulation.dump(output)
+        print(f"[CLI] Action messages: [bold]{output}")
+
+
 def main():
     cli(prog_name="smauto")
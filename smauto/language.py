@@ -1,4 +1,3 @@
-import os
 from os.path import join
 from textx import (
     language,
@@ -9,8 +8,7 @@ from textx import (
 )
 import pathlib
 import textx.scoping.providers as scoping_providers
-from rich import print
-from textx.scoping import ModelRepository, GlobalModelRepository
+from textx.scoping import GlobalModelRepository
 from smauto.definitions import MODEL_REPO_PATH, BUILTIN_MODELS
 
 from smauto.lib.automation import (
@@ -21,7 +19,7 @@ from smauto.lib.automation import (
     IntAction,
     StringAction,
 )
-from smauto.lib.types import Dict, List, Time, Date
+from smauto.lib.types import Dict, List, Time, Date, Duration
 from smauto.lib.broker import (
     AMQPBroker,
     Broker,
@@ -53,6 +51,11 @@ from smauto.lib.condition import (
     DictCondition,
     InRangeCondition,
     ListCondition,
+    MathExpression,
+    MathGroup,
+    MathTerm,
+    MathFactor,
+    MathOperand,
 )
 
 
@@ -72,6 +75,11 @@ CUSTOM_CLASSES = [
     DictCondition,
     TimeCondition,
     InRangeCondition,
+    MathExpression,
+    MathGroup,
+    MathTerm,
+    MathFactor,
+    MathOperand,
     Attribute,
     IntAttribute,
     FloatAttribute,
@@ -94,6 +102,7 @@ CUSTOM_CLASSES = [
     Dict,
     Time,
     Date,
+    Duration,
 ]
 
 
@@ -183,11 +192,42 @@ def verify_automation_names(model):
         _ids.append(a.name)
 
 
+def verify_conditions(model):
+    autos = get_children_of_type("Automation", model)
+    for a in autos:
+        a.condition.type_check()
+
+
+def verify_outbox(model):
+    outbox = getattr(model, "outbox", None)
+    if outbox is None:
+        return
+    for name in ("capacity", "batch"):
+        value = getattr(outbox, name)
+        if value is not None and value < 1:
+            raise TextXSemanticError(
+                f"Outbox {name} must be at least 1", **get_location(outbox)
+            )
+
+
+def verify_checkpoint(model):
+    checkpoint = getattr(model, "checkpoint", None)
+    if checkpoint is None:
+        return
+    if checkpoint.interval is not None and checkpoint.interval.to_seconds() <= 0:
+        raise TextXSemanticError(
+            "Checkpoint interval must be positive", **get_location(checkpoint)
+        )
+
+
 def model_proc(model, metamodel):
     process_time_class(model)
     verify_entity_names(model)
     verify_automation_names(model)
     verify_broker_names(model)
+    verify_conditions(model)
+    verify_outbox(model)
+    verify_checkpoint(model)
 
 
 def get_metamodel(debug: bool = False, global_repo: bool = False):
@@ -210,16 +250,20 @@ def get_scope_providers():
     sp = {"*.*": scoping_providers.FQNImportURI(importAs=True)}
     if BUILTIN_MODELS:
         sp["brokers*"] = scoping_providers.FQNGlobalRepo(
-            join(BUILTIN_MODELS, "broker", "*.br"))
+            join(BUILTIN_MODELS, "broker", "*.br")
+        )
         sp["entities*"] = scoping_providers.FQNGlobalRepo(
-            join(BUILTIN_MODELS, "entity", "*.ent"))
+            join(BUILTIN_MODELS, "entity", "*.ent")
+        )
         # sp["automations*"] = scoping_providers.FQNGlobalRepo(
         #     join(BUILTIN_MODELS, "automations", "*.smauto"))
     if MODEL_REPO_PATH:
         sp["brokers*"] = scoping_providers.FQNGlobalRepo(
-            join(MODEL_REPO_PATH, "broker", "*.br"))
+            join(MODEL_REPO_PATH, "broker", "*.br")
+        )
         sp["entities*"] = scoping_providers.FQNGlobalRepo(
-            join(MODEL_REPO_PATH, "entity", "*.ent"))
+            join(MODEL_REPO_PATH, "entity", "*.ent")
+        )
         # sp["automations*"] = scoping_providers.FQNGlobalRepo(
         #     join(BUILTIN_MODELS, "automations", "*.smauto"))
     return sp
@@ -0,0 +1,491 @@
+import math
+from abc import ABC, abstractmethod
+from collections import deque
+
+import numpy as np
+
+# Samples between two exact recomputations of the running sums of the mean
+# aggregates, at least the window size, bounding their float drift
+RESUM_SAMPLES = 1024
+
+
+def to_sample(value):
+    """
+    Returns a value as a window sample, or None if it is not a finite
+    number, e.g. None or a string.
+    """
+    try:
+        sample = float(value)
+    except (TypeError, ValueError):
+        return None
+    return sample if math.isfinite(sample) else None
+
+
+class RingBuffer:
+    """
+    Fixed capacity ring buffer of numeric samples backed by a NumPy array.
+    Every sample is written twice, at i and i + capacity, so that the last n
+    samples are always a contiguous slice that can be returned as a
+    zero-copy view.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = np.zeros(2 * capacity)
+        # Next write position, in [0, capacity)
+        self.index = 0
+        # Number of samples appended so far
+        self.count = 0
+        # Returned for windows that have not been filled yet
+        self.zeros = np.zeros(capacity)
+
+    def reserve(self, capacity):
+        """
+        Grows the buffer to hold at least capacity samples, keeping the
+        most recent ones.
+        """
+        if capacity <= self.capacity:
+            return
+        kept = self.last(min(self.count, self.capacity)).copy()
+        self.capacity = capacity
+        self.data = np.zeros(2 * capacity)
+        self.index = 0
+        self.count = 0
+        self.zeros = np.zeros(capacity)
+        for sample in kept:
+            self.append(sample)
+
+    def append(self, sample):
+        self.data[self.index] = sample
+        self.data[self.index + self.capacity] = sample
+        self.index = (self.index + 1) % self.capacity
+        self.count += 1
+
+    def last(self, n):
+        """Returns a view of the last n samples, oldest first."""
+        end = self.index + self.capacity
+        return self.data[end - n : end]
+
+    def window(self, n):
+        """
+        Returns a view of the last n samples, or zeros until n samples
+        have been appended.
+        """
+        if self.count < n:
+            return self.zeros[:n]
+        return self.last(n)
+
+    def evicted(self, n):
+        """
+        Returns the sample that just left a window of the last n samples,
+        or None if no sample has left it yet.
+        """
+        if self.count <= n:
+            return None
+        return float(self.data[self.index + self.capacity - n - 1])
+
+
+class TimedRingBuffer:
+    """
+    Growable ring buffer of timestamped numeric samples backed by NumPy
+    arrays. Samples are addressed by their sequence number. Every reader
+    (a DurationAggregate) keeps the number of the oldest sample in its
+    window, and samples older than all of them are released, so each sample
+    is appended and evicted once.
+    """
+
+    def __init__(self, capacity=16):
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.values = np.zeros(capacity)
+        # Sequence numbers of the oldest sample kept and of the next one
+        self.start = 0
+        self.end = 0
+        self.readers = []
+
+    def grow(self):
+        seqs = np.arange(self.start, self.end)
+        times = self.times[seqs % self.capacity]
+        values = self.values[seqs % self.capacity]
+        self.capacity *= 2
+        self.times = np.zeros(self.capacity)
+        self.values = np.zeros(self.capacity)
+        self.times[seqs % self.capacity] = times
+        self.values[seqs % self.capacity] = values
+
+    def append(self, now, sample):
+        if self.end - self.start == self.capacity:
+            self.grow()
+        self.times[self.end % self.capacity] = now
+        self.values[self.end % self.capacity] = sample
+        self.end += 1
+
+    def time(self, seq):
+        return self.times[seq % self.capacity]
+
+    def value(self, seq):
+        return float(self.values[seq % self.capacity])
+
+    def release(self):
+        """Drops the samples that have left the windows of all readers."""
+        if len(self.readers) > 0:
+            self.start = max(self.start, min(reader.head for reader in self.readers))
+
+
+class Aggregate(ABC):
+    """
+    Base class of the window aggregates. Its values can be sampled by other
+    aggregates (sinks), e.g. the var in var(mean(x, 10), 10).
+    """
+
+    def __init__(self):
+        self.value = 0
+        self.sinks = []
+        # Buffers of the aggregate values, created for the sinks
+        self.buffer = None
+        self.timed_buffer = None
+
+    def add_sink(self, func, size=None, duration=None):
+        """Creates an aggregate sampling the values of this one."""
+        if duration is not None:
+            if self.timed_buffer is None:
+                self.timed_buffer = TimedRingBuffer()
+            node = DURATION_AGGREGATES[func](duration, self.timed_buffer)
+        else:
+            if self.buffer is None:
+                self.buffer = RingBuffer(size + 1)
+            self.buffer.reserve(size + 1)
+            node = AGGREGATES[func](size, self.buffer)
+        self.sinks.append(node)
+        return node
+
+    def feed_sinks(self, now):
+        if self.buffer is not None:
+            self.buffer.append(self.value)
+        if self.timed_buffer is not None:
+            self.timed_buffer.append(now, self.value)
+        for sink in self.sinks:
+            sink.push(self.value, now)
+
+
+class WindowAggregate(Aggregate):
+    """
+    Aggregate over the last `size` samples of a RingBuffer, updated
+    incrementally on every new sample so that reading it is O(1).
+    ...
+
+    Attributes
+    ----------
+        size: int
+            Number of samples in the window
+        source: RingBuffer
+            Buffer holding the sampled values, shared by all aggregates
+            of the same attribute
+        value: float
+            Current aggregate value. Zero until the window fills, matching
+            the zero-padded buffers of Entity.get_buffer()
+        sinks: list
+            Aggregates fed with every new value of this one, e.g. the var in
+            var(mean(x, 10), 10)
+    """
+
+    def __init__(self, size, source):
+        super().__init__()
+        self.size = size
+        self.source = source
+        self.count = 0
+
+    @property
+    def full(self):
+        return self.count >= self.size
+
+    @property
+    def window(self):
+        return self.source.window(self.size)
+
+    def push(self, sample, now=None):
+        """Updates the aggregate with the sample just appended to source."""
+        self.count += 1
+        self.update(sample, self.source.evicted(self.size))
+        if self.full:
+            self.value = self.result()
+        self.feed_sinks(now)
+
+    @abstractmethod
+    def update(self, sample, evicted):
+        """Adds a sample to the window and removes the evicted one, or None."""
+
+    @abstractmethod
+    def result(self):
+        """Returns the aggregate value of the full window."""
+
+
+class MeanAggregate(WindowAggregate):
+    """
+    Sliding window mean, using Welford's update. The running sums are
+    recomputed from the window every RESUM_SAMPLES samples.
+    """
+
+    def __init__(self, size, source):
+        super().__init__(size, source)
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, sample, evicted):
+        if self.count % max(self.size, RESUM_SAMPLES) == 0:
+            self.source_sums(self.source.last(self.size))
+        elif evicted is None:
+            # Window still filling, plain Welford step
+            delta = sample - self.mean
+            self.mean += delta / min(self.count, self.size)
+            self.m2 += delta * (sample - self.mean)
+        else:
+            # Fixed size window, replace the evicted sample
+            mean = self.mean + (sample - evicted) / self.size
+            self.m2 += (sample - evicted) * (sample - mean + evicted - self.mean)
+            self.mean = mean
+
+    def source_sums(self, samples):
+        """Recomputes the running sums from the samples in the window."""
+        self.mean = float(samples.mean())
+        self.m2 = float(((samples - self.mean) ** 2).sum())
+
+    def result(self):
+        return self.mean
+
+
+class VarAggregate(MeanAggregate):
+    """Sliding window sample variance, as statistics.variance()."""
+
+    def result(self):
+        if self.size < 2:
+            return 0.0
+        # Guard against negative values due to rounding
+        return max(self.m2, 0.0) / (self.size - 1)
+
+
+class StdAggregate(VarAggregate):
+    """Sliding window sample standard deviation, as statistics.stdev()."""
+
+    def result(self):
+        return math.sqrt(super().result())
+
+
+class MaxAggregate(WindowAggregate):
+    """Sliding window maximum, using a monotonic deque."""
+
+    def __init__(self, size, source):
+        super().__init__(size, source)
+        # (sample index, sample) pairs with decreasing samples
+        self.candidates = deque()
+
+    def dominates(self, new, old):
+        return new >= old
+
+    def update(self, sample, evicted):
+        while self.candidates and self.dominates(sample, self.candidates[-1][1]):
+            self.candidates.pop()
+        self.candidates.append((self.count, sample))
+        if self.candidates[0][0] <= self.count - self.size:
+            self.candidates.popleft()
+
+    def result(self):
+        return self.candidates[0][1]
+
+
+class MinAggregate(MaxAggregate):
+    """Sliding window minimum, using a monotonic deque."""
+
+    def dominates(self, new, old):
+        return new <= old
+
+
+# Aggregate classes by the function name used in conditions
+AGGREGATES = {
+    "mean": MeanAggregate,
+    "var": VarAggregate,
+    "std": StdAggregate,
+    "min": MinAggregate,
+    "max": MaxAggregate,
+}
+
+
+class DurationAggregate(Aggregate):
+    """
+    Aggregate over the samples of the last `duration` seconds of a
+    TimedRingBuffer. On every new sample the ones that have left the window
+    are evicted from the head of the buffer, in amortized O(1).
+    ...
+
+    Attributes
+    ----------
+        duration: float
+            Length of the window in seconds
+        source: TimedRingBuffer
+            Buffer holding the timestamped samples, shared by all duration
+            aggregates of the same attribute
+        head: int
+            Sequence number of the oldest sample in the window
+        count: int
+            Number of samples in the window
+    """
+
+    # Samples needed for the aggregate to have a value
+    min_count = 1
+
+    def __init__(self, duration, source):
+        super().__init__()
+        self.duration = duration
+        self.source = source
+        self.head = source.end
+        self.count = 0
+        source.readers.append(self)
+
+    def push(self, sample, now):
+        """Updates the aggregate with the sample just appended to source."""
+        newest = self.source.end - 1
+        while self.head < newest and self.source.time(self.head) <= now - self.duration:
+            self.remove(self.source.value(self.head))
+            self.head += 1
+            self.count -= 1
+        self.count += 1
+        self.add(sample, newest)
+        self.value = self.result() if self.count >= self.min_count else 0
+        self.source.release()
+        self.feed_sinks(now)
+
+    def expire(self, now):
+        """
+        Evicts the samples that have left the window by now, without a new
+        sample. Returns True if the value changed. The values of the sinks
+        are only sampled on new samples.
+        """
+        value = self.value
+        evicted = False
+        while self.count > 0 and self.source.time(self.head) <= now - self.duration:
+            self.remove(self.source.value(self.head))
+            self.head += 1
+            self.count -= 1
+            evicted = True
+        if not evicted:
+            return False
+        self.value = self.result() if self.count >= self.min_count else 0
+        self.source.release()
+        return self.value != value
+
+    def next_expiry(self):
+        """Returns the time the oldest sample leaves the window, or None."""
+        if self.count == 0:
+            return None
+        return self.source.time(self.head) + self.duration
+
+    @abstractmethod
+    def add(self, sample, seq):
+        """Adds the sample with sequence number seq to the window."""
+
+    @abstractmethod
+    def remove(self, sample):
+        """Removes sample, the oldest one, from the window."""
+
+    @abstractmethod
+    def result(self):
+        """Returns the aggregate value of the samples in the window."""
+
+
+class DurationMeanAggregate(DurationAggregate):
+    """
+    Duration window mean, using Welford's update and its inverse. The
+    running sums are recomputed from the window every RESUM_SAMPLES
+    samples, or more if the window holds more.
+    """
+
+    def __init__(self, duration, source):
+        super().__init__(duration, source)
+        self.mean = 0.0
+        self.m2 = 0.0
+        # Samples added since the last recomputation
+        self.added = 0
+
+    def add(self, sample, seq):
+        self.added += 1
+        if self.added >= max(self.count, RESUM_SAMPLES):
+            self.added = 0
+            seqs = np.arange(self.head, seq + 1) % self.source.capacity
+            samples = self.source.values[seqs]
+            self.mean = float(samples.mean())
+            self.m2 = float(((samples - self.mean) ** 2).sum())
+            return
+        delta = sample - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (sample - self.mean)
+
+    def remove(self, sample):
+        if self.count == 1:
+            self.mean = 0.0
+            self.m2 = 0.0
+            return
+        mean = (self.count * self.mean - sample) / (self.count - 1)
+        self.m2 -= (sample - self.mean) * (sample - mean)
+        self.mean = mean
+
+    def result(self):
+        return self.mean
+
+
+class DurationVarAggregate(DurationMeanAggregate):
+    """Duration window sample variance, as statistics.variance()."""
+
+    min_count = 2
+
+    def result(self):
+        # Guard against negative values due to rounding
+        return max(self.m2, 0.0) / (self.count - 1)
+
+
+class DurationStdAggregate(DurationVarAggregate):
+    """Duration window sample standard deviation, as statistics.stdev()."""
+
+    def result(self):
+        return math.sqrt(super().result())
+
+
+class DurationMaxAggregate(DurationAggregate):
+    """Duration window maximum, using a monotonic deque."""
+
+    def __init__(self, duration, source):
+        super().__init__(duration, source)
+        # (sequence number, sample) pairs with decreasing samples
+        self.candidates = deque()
+
+    def dominates(self, new, old):
+        return new >= old
+
+    def add(self, sample, seq):
+        while self.candidates and self.dominates(sample, self.candidates[-1][1]):
+            self.candidates.pop()
+        self.candidates.append((seq, sample))
+
+    def remove(self, sample):
+        pass
+
+    def result(self):
+        while self.candidates[0][0] < self.head:
+            self.candidates.popleft()
+        return self.candidates[0][1]
+
+
+class DurationMinAggregate(DurationMaxAggregate):
+    """Duration window minimum, using a monotonic deque."""
+
+    def dominates(self, new, old):
+        return new <= old
+
+
+# Duration aggregate classes by the function name used in conditions
+DURATION_AGGREGATES = {
+    "mean": DurationMeanAggregate,
+    "var": DurationVarAggregate,
+    "std": DurationStdAggregate,
+    "min": DurationMinAggregate,
+    "max": DurationMaxAggregate,
+}
@@ -1,8 +1,11 @@
-from textx import textx_isinstance, get_metamodel
 import time
 from rich import print, pretty
-from concurrent.futures import ThreadPoolExecutor
 from smauto.lib.types import List, Dict
+from smauto.lib.network import ConditionNetwork
+from smauto.lib.profiler import Profiler
+from smauto.lib.outbox import ActionOutbox
+from smauto.lib.scheduler import AutomationScheduler
+from smauto.lib.timer import TimeScheduler
 
 pretty.install()
 
@@ -16,8 +19,192 @@ class AutomationState:
     EXITED_FAILURE = 3
 
 
+class AutomationRuntime:
+    """
+    Runtime behaviour of an Automation on an AutomationScheduler: stepping,
+    edge triggering, after dependencies and enabling. Shared by the
+    Automation of the model and the Automation of the generated executor,
+    which provide evaluate_condition() and trigger_actions(), and whose
+    after, starts and stops are Automations. log() reports the steps.
+    ...
+
+    Attributes
+    ----------
+        condition: object
+            Condition with read_entities, cond_lambda and last_truth, the
+            truth of the last evaluation for edge triggering
+        scheduler: AutomationScheduler
+            Scheduler running the Automation, see step()
+        clock: callable
+            Clock of the scheduler, timing the re-arming
+        timer: PeriodicTimer
+            Paces the evaluations in poll mode, set by the scheduler
+        profile: AutomationProfile
+            Evaluation and action statistics, or None
+        dependents: list
+            Automations waiting for this one to finish, see wait_for_after()
+        errors: dict
+            Number of errors raised by the steps and the condition per
+            error type, see report_error()
+    """
+
+    def is_rising_edge(self, triggered):
+        """
+        Filters condition evaluations of edge-triggered Automations, so that
+        actions only run when the condition turns from false to true, or
+        when re-armed after rearm seconds.
+        """
+        rising = triggered and not self.condition.last_truth
+        self.condition.last_truth = triggered
+        if not rising and triggered and type(self.rearm) in (int, float):
+            rising = self.clock() - self.fired_at >= self.rearm
+        if rising:
+            self.fired_at = self.clock()
+        return rising
+
+    def notify(self):
+        """Wakes up an event-driven Automation to re-evaluate its condition.
+        Called by the Entities its condition reads on state changes."""
+        if self.scheduler is not None:
+            self.scheduler.notify(self)
+
+    def expiry_delay(self):
+        """
+        Returns the seconds until a sample leaves a duration window the
+        condition reads, or until a numeric rearm re-arms the edge trigger
+        while the condition holds, or None. Event-driven Automations run
+        again then, as the window aggregates and the re-arming change
+        without an update.
+        """
+        delays = []
+        if (
+            self.trigger == "edge"
+            and type(self.rearm) in (int, float)
+            and self.condition.last_truth
+        ):
+            delays.append(self.fired_at + self.rearm - self.clock())
+        for entity in self.condition.read_entities:
+            expiry = entity.next_expiry()
+            if expiry is not None:
+                delays.append(expiry - entity.clock())
+        if len(delays) == 0:
+            return None
+        return max(min(delays), 0)
+
+    def report_error(self, error):
+        """
+        Counts an error raised by a step or the condition. Only the first
+        error of each type is logged, as it may recur on every step.
+        """
+        key = type(error).__name__
+        if key in self.errors:
+            self.errors[key] += 1
+            return
+        self.errors[key] = 1
+        self.log(f"[ERROR] {error}. Further {key} errors are only counted.")
+
+    def set_state(self, state):
+        """
+        Sets the state of the Automation. When it stops running, the
+        Automations waiting for it are notified.
+        """
+        was_running = self.state == AutomationState.RUNNING
+        self.state = state
+        if was_running and state != AutomationState.RUNNING:
+            for automation in self.dependents:
+                automation.notify()
+
+    def wait_for_after(self):
+        """
+        Returns True if any of the after dependencies is running. The
+        Automation then subscribes to them and is notified when they finish,
+        instead of polling their state.
+        """
+        wait_for = [
+            dep.name for dep in self.after if dep.state == AutomationState.RUNNING
+        ]
+        self.waiting = len(wait_for) > 0
+        if self.waiting:
+            for dep in self.after:
+                if self not in dep.dependents:
+                    dep.dependents.append(self)
+            self.log(f"Waiting for dependend automations to finish: {wait_for}")
+        return self.waiting
+
+    def step(self):
+        """
+        Runs one iteration of the Automation without blocking: checks its
+        after dependencies, evaluates its condition and runs its actions.
+        Returns the seconds until it should run again, or None if it waits
+        for a notify().
+        """
+        if self.state != AutomationState.RUNNING:
+            self.set_state(AutomationState.IDLE)
+            if self.wait_for_after():
+                # Start a new period when the dependencies finish
+                self.timer.reset()
+                return None
+            self.set_state(AutomationState.RUNNING)
+        # Duration windows change as time passes, not only on updates
+        for entity in self.condition.read_entities:
+            entity.expire()
+        triggered, msg = self.evaluate_condition()
+        if self.trigger == "edge":
+            triggered = self.is_rising_edge(triggered)
+        if triggered:
+            self.log(f"Automation <{self.name}> Triggered!")
+            self.log(f"Condition met: {self.condition.cond_lambda}")
+            # If automation triggered run its actions
+            self.trigger_actions()
+            self.set_state(AutomationState.EXITED_SUCCESS)
+            for automation in self.starts:
+                automation.enable()
+            for automation in self.stops:
+                automation.disable()
+        if self.checkOnce:
+            self.disable()
+            self.set_state(AutomationState.EXITED_SUCCESS)
+        if self.mode == "poll":
+            delay = self.timer.next_delay()
+            if self.profile is not None:
+                self.profile.record_timer(self.timer)
+            return delay
+        return self.expiry_delay()
+
+    def snapshot(self):
+        """
+        Returns the runtime flags of the Automation changed by starts,
+        stops, continuous and checkOnce, see Checkpointer.
+        """
+        return {
+            "enabled": self.enabled,
+            "state": self.state,
+            "last_truth": self.condition.last_truth,
+        }
+
+    def restore(self, snapshot):
+        self.enabled = snapshot["enabled"]
+        self.state = snapshot["state"]
+        self.condition.last_truth = snapshot["last_truth"]
+
+    def enable(self):
+        self.enabled = True
+        # Not evaluated at once, so that an Automation starting itself runs
+        # at most once per poll period instead of on every iteration
+        if self.scheduler is not None:
+            self.scheduler.wake(self)
+        self.log(f"Enabled Automation: {self.name}")
+
+    def disable(self):
+        self.enabled = False
+        self.log(f"Disabled Automation: {self.name}")
+
+    def log(self, msg):
+        print(f"[bold yellow][*] {msg}[/bold yellow]")
+
+
 # A class representing an Automation
-class Automation(object):
+class Automation(AutomationRuntime):
     def __init__(
         self,
         parent,
@@ -32,6 +219,10 @@ class Automation(object):
         after,
         starts,
         stops,
+        mode=None,
+        trigger=None,
+        rearm=None,
+        overrun=None,
         description="",
     ):
         """
@@ -45,12 +236,26 @@ class Automation(object):
             condition evaluation
         :param continuous: Boolean variable indicating if the Automation
             should remain enabled after actions are run
+        :param mode: 'event' evaluates the condition only when an attribute
+            it reads changes, 'poll' evaluates it at freq Hz
+        :param trigger: 'level' runs the actions on every evaluation the
+            condition holds, 'edge' only when it turns from false to true
+        :param rearm: Re-arm policy of edge triggering. 'falling' re-arms
+            when the condition turns false, a number of seconds also re-arms
+            it after that time while the condition stays true
+        :param overrun: Policy of the PeriodicTimer pacing the poll mode
+            when an evaluation overruns the next deadline, 'skip' drops the
+            missed evaluations, 'catch-up' runs them back to back
         """
         enabled = True if enabled is None else enabled
         continuous = True if continuous is None else continuous
         checkOnce = False if checkOnce is None else checkOnce
         freq = 1 if freq in (None, 0) else freq
         delay = 0 if not delay else delay
+        mode = "event" if mode is None else mode
+        trigger = "level" if trigger is None else trigger
+        rearm = "falling" if rearm is None else rearm
+        overrun = "skip" if overrun is None else overrun
         self.parent = parent
         self.name = name
         self.condition = condition
@@ -66,11 +271,47 @@ class Automation(object):
         self.state = AutomationState.IDLE
         self.description = description
         self.delay = delay
+        self.mode = mode
+        self.trigger = trigger
+        self.rearm = rearm
+        self.overrun = overrun
+        # Time the actions last ran on a rising edge, on the scheduler's clock
+        self.clock = time.monotonic
+        self.fired_at = 0
+        # AutomationScheduler running the Automation, see step()
+        self.scheduler = None
+        self.schedule_seq = None
+        self.deadline = None
+        self.notified = False
+        # Result of the condition evaluated in a batch by the scheduler, and
+        # its share of the cost of the batch in ns
+        self.batch_result = None
+        self.batch_cost = 0
+        # Automations waiting for this one to finish, see wait_for_after()
+        self.dependents = []
+        self.waiting = False
+        # Number of errors per error type, see report_error()
+        self.errors = {}
+        # Evaluation and action statistics, see Profiler
+        self.profile = Profiler.of(parent).profile(name)
+        # Paces the evaluations in poll mode, set by the scheduler
+        self.timer = None
 
     # Evaluate the Automation's conditions and run the actions
     def evaluate_condition(self):
+        batch_result, self.batch_result = self.batch_result, None
         if self.enabled:
-            return self.condition.evaluate()
+            started = time.perf_counter_ns()
+            if batch_result is not None:
+                # Evaluated by the scheduler's VectorizedEvaluator, profiled
+                # at its share of the batch
+                started -= self.batch_cost
+                triggered = batch_result
+                msg = f"{self.name}: {'' if triggered else 'not '}triggered."
+            else:
+                triggered, msg = self.condition.evaluate()
+            self.profile.record_evaluation(started, triggered)
+            return triggered, msg
         else:
             return False, f"{self.name}: Automation disabled."
 
@@ -80,6 +321,7 @@ class Automation(object):
         Runs the Automation's actions.
         :return:
         """
+        started = time.perf_counter_ns()
         # If continuous is false, disable automation until it is manually re-enabled
         if not self.continuous:
             self.enabled = False
@@ -99,25 +341,40 @@ class Automation(object):
             else:
                 messages[action.attribute.parent] = {action.attribute.name: value}
 
-        # Iterate over Entities and their corresponding messages
+        # Hand the messages to the scheduler's outbox, which merges them with
+        # the messages of other Automations for the same Entities
         for entity, message in messages.items():
-            # Send message via Entity's publisher
-            entity.publisher.publish(message)
+            if self.scheduler is not None:
+                self.scheduler.outbox.put(entity, message, self.name)
+            else:
+                entity.publisher.publish(message)
+        self.profile.record_trigger(started)
 
     def build_condition(self):
         """Builds Automation Condition into Python expression string
-        so that it can later be evaluated using eval()
+        so that it can later be evaluated using eval(). Conditions made only
+        of numeric threshold comparisons are also added to the model's
+        ConditionNetwork, which maintains their truth value on updates.
         """
         self.condition.build()
+        ConditionNetwork.of(self.parent).add(self.condition)
+        TimeScheduler.of(self.parent).add(self)
 
     def print(self):
-        after = f"\n".join([f"      - {dep.name}" for dep in self.after])
-        starts = f"\n".join([f"      - {dep.name}" for dep in self.starts])
-        stops = f"\n".join([f"      - {dep.name}" for dep in self.stops])
+        after = "\n".join([f"      - {dep.name}" for dep in self.after])
+        starts = "\n".join([f"      - {dep.name}" for dep in self.starts])
+        stops = "\n".join([f"      - {dep.name}" for dep in self.stops])
+        costs = "\n".join(
+            [f"      - {line}" for line in self.condition.describe_costs()]
+        )
         print(
             f"[*] Automation <{self.name}>\n"
             f"    Condition: {self.condition.cond_lambda}\n"
+            f"    Costs:\n"
+            f"{costs}\n"
             f"    Frequency: {self.freq} Hz\n"
+            f"    Mode: {self.mode}\n"
+            f"    Trigger: {self.trigger} (rearm: {self.rearm})\n"
             f"    Continuoues: {self.continuous}\n"
             f"    CheckOnce: {self.checkOnce}\n"
             f"    Starts:\n"
@@ -129,63 +386,11 @@ class Automation(object):
         )
 
     def start(self):
-        self.state = AutomationState.IDLE
-        self.build_condition()
-        self.print()
-        print(f"[bold yellow][*] Executing Automation: {self.name}[/bold yellow]")
-        while True:
-            if len(self.after) == 0:
-                self.state = AutomationState.RUNNING
-            # Wait for dependend automations to finish
-            while self.state == AutomationState.IDLE:
-                wait_for = [
-                    dep.name
-                    for dep in self.after
-                    if dep.state == AutomationState.RUNNING
-                ]
-                if len(wait_for) == 0:
-                    self.state = AutomationState.RUNNING
-                print(
-                    f"[bold magenta]\[{self.name}] Waiting for dependend "
-                    f"automations to finish:[/bold magenta] {wait_for}"
-                )
-                time.sleep(1)
-            while self.state == AutomationState.RUNNING:
-                try:
-                    triggered, msg = self.evaluate_condition()
-                    if triggered:
-                        print(
-                            f"[bold yellow][*] Automation <{self.name}> "
-                            f"Triggered![/bold yellow]"
-                        )
-                        print(
-                            f"[bold blue][*] Condition met: "
-                            f"{self.condition.cond_lambda}"
-                        )
-                        # If automation triggered run its actions
-                        self.trigger_actions()
-                        self.state = AutomationState.EXITED_SUCCESS
-                        for automation in self.starts:
-                            automation.enable()
-                        for automation in self.stops:
-                            automation.disable()
-                    if self.checkOnce:
-                        self.disable()
-                        self.state = AutomationState.EXITED_SUCCESS
-                    time.sleep(1 / self.freq)
-                except Exception as e:
-                    print(f"[ERROR] {e}")
-                    return
-            # time.sleep(self.time_between_activations)
-            self.state = AutomationState.IDLE
-
-    def enable(self):
-        self.enabled = True
-        print(f"[bold yellow][*] Enabled Automation: {self.name}[/bold yellow]")
-
-    def disable(self):
-        self.enabled = False
-        print(f"[bold yellow][*] Disabled Automation: {self.name}[/bold yellow]")
+        """Runs the Automation alone, on its own AutomationScheduler."""
+        self.set_state(AutomationState.IDLE)
+        scheduler = AutomationScheduler(outbox=ActionOutbox.of(self.parent))
+        scheduler.add(self)
+        scheduler.run()
 
 
 class Action:
@@ -0,0 +1,285 @@
+import json
+import os
+import struct
+import time
+import zlib
+from threading import Event, Lock, Thread
+
+import numpy as np
+from rich import print
+
+
+class Checkpointer(object):
+    """
+    Periodically checkpoints the runtime state of the Entities (state,
+    attribute values and window buffers) and Automations (enabled, state,
+    edge trigger) to a local file, and restores it on startup, so that
+    windowed conditions are not blind after a restart.
+
+    The file is a log of binary records. Each checkpoint appends a record
+    only for the Entities whose version changed and the Automations whose
+    flags changed since the previous one. When the log grows past
+    compact_ratio times its last full size, it is rewritten with one record
+    per Entity and Automation, atomically. Records are checksummed, so a
+    record torn by a crash ends the log instead of corrupting the restore.
+    ...
+
+    Attributes
+    ----------
+        path: str
+            Path of the checkpoint file
+        entities: dict
+            Checkpointed Entities, by name
+        automations: dict
+            Checkpointed Automations, by name
+        interval: float
+            Seconds between checkpoints
+        max_age: float
+            Entity records older than max_age seconds are not restored, as
+            their samples are stale. None restores any record.
+        versions: dict
+            Entity versions at the last checkpoint
+        flags: dict
+            Automation snapshots at the last checkpoint
+    """
+
+    MAGIC = b"SMCK\x01"
+    # Record kind, key length, payload length and CRC32 of key and payload
+    RECORD = struct.Struct("<BHII")
+    # Wall-clock time of an Entity record and length of its JSON header
+    ENTITY_HEADER = struct.Struct("<dI")
+    ENTITY = 0
+    AUTOMATION = 1
+
+    def __init__(
+        self,
+        path,
+        entities,
+        automations,
+        interval=10.0,
+        max_age=None,
+        compact_ratio=4,
+    ):
+        self.path = path
+        self.entities = {entity.name: entity for entity in entities}
+        self.automations = {automation.name: automation for automation in automations}
+        self.interval = interval
+        self.max_age = max_age
+        self.compact_ratio = compact_ratio
+        self.versions = {}
+        self.flags = {}
+        # Size of the file after the last compaction
+        self.compacted_size = 0
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread = None
+
+    @staticmethod
+    def settings(model):
+        """
+        Returns the Checkpointer arguments configured by the model's
+        Checkpoint, or None if it has none.
+        """
+        config = getattr(model, "checkpoint", None)
+        if config is None:
+            return None
+        settings = {"path": config.path, "interval": 10.0, "max_age": None}
+        if config.interval is not None:
+            settings["interval"] = config.interval.to_seconds()
+        if config.max_age is not None:
+            settings["max_age"] = config.max_age.to_seconds()
+        return settings
+
+    def encode_entity(self, snapshot):
+        header = {
+            "state": snapshot["state"],
+            "values": snapshot["values"],
+            "buffers": {name: len(s) for name, s in snapshot["buffers"].items()},
+            "timed": {name: len(s) for name, (_, s) in snapshot["timed"].items()},
+        }
+        header = json.dumps(header).encode()
+        arrays = list(snapshot["buffers"].values())
+        for ages, samples in snapshot["timed"].values():
+            arrays += [ages, samples]
+        return b"".join(
+            [self.ENTITY_HEADER.pack(time.time(), len(header)), header]
+            + [np.ascontiguousarray(a, dtype=np.float64).tobytes() for a in arrays]
+        )
+
+    def decode_entity(self, payload):
+        """Returns the snapshot of an Entity record and its wall-clock time."""
+        saved, length = self.ENTITY_HEADER.unpack_from(payload)
+        offset = self.ENTITY_HEADER.size
+        header = json.loads(payload[offset : offset + length])
+        offset += length
+
+        def array(count):
+            nonlocal offset
+            values = np.frombuffer(
+                payload, dtype=np.float64, count=count, offset=offset
+            )
+            offset += 8 * count
+            return values
+
+        snapshot = {
+            "state": header["state"],
+            "values": header["values"],
+            "buffers": {name: array(n) for name, n in header["buffers"].items()},
+            "timed": {},
+        }
+        for name, count in header["timed"].items():
+            ages = array(count)
+            snapshot["timed"][name] = (ages, array(count))
+        return snapshot, saved
+
+    def changed_records(self, full=False):
+        """
+        Snapshots the Entities and Automations changed since the last
+        checkpoint, or all of them if full is set.
+        """
+        records = []
+        for name, entity in self.entities.items():
+            # Read the version first, so updates made while taking the
+            # snapshot are saved by the next checkpoint
+            version = entity.version
+            if full or self.versions.get(name) != version:
+                payload = self.encode_entity(entity.snapshot())
+                records.append((self.ENTITY, name, payload, version))
+        for name, automation in self.automations.items():
+            flags = automation.snapshot()
+            if full or self.flags.get(name) != flags:
+                payload = json.dumps(flags).encode()
+                records.append((self.AUTOMATION, name, payload, flags))
+        return records
+
+    def encode_records(self, records):
+        chunks = []
+        for kind, name, payload, _ in records:
+            key = name.encode()
+            crc = zlib.crc32(payload, zlib.crc32(key))
+            chunks += [
+                self.RECORD.pack(kind, len(key), len(payload), crc),
+                key,
+                payload,
+            ]
+        return b"".join(chunks)
+
+    def commit(self, records):
+        for kind, name, _, mark in records:
+            if kind == self.ENTITY:
+                self.versions[name] = mark
+            else:
+                self.flags[name] = mark
+
+    def save(self):
+        """Appends a checkpoint of what changed since the previous one."""
+        with self.lock:
+            # The first checkpoint of a run rewrites the file, which also
+            # drops a record torn by a crash
+            if not os.path.exists(self.path) or (
+                os.path.getsize(self.path) > self.compact_ratio * self.compacted_size
+            ):
+                self.compact()
+                return
+            records = self.changed_records()
+            if len(records) == 0:
+                return
+            with open(self.path, "ab") as fp:
+                fp.write(self.encode_records(records))
+                fp.flush()
+                os.fsync(fp.fileno())
+            self.commit(records)
+
+    def compact(self):
+        """Rewrites the file with a full checkpoint."""
+        records = self.changed_records(full=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as fp:
+            fp.write(self.MAGIC)
+            fp.write(self.encode_records(records))
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, self.path)
+        self.compacted_size = os.path.getsize(self.path)
+        self.commit(records)
+
+    def read(self):
+        """
+        Returns the latest payload of each Entity and Automation in the
+        file, by (kind, name). Reading stops at the first torn record. A
+        file that is not a checkpoint is ignored, as the first checkpoint
+        of the run rewrites it.
+        """
+        with open(self.path, "rb") as fp:
+            data = fp.read()
+        if not data.startswith(self.MAGIC):
+            print(
+                f"[bold red][*] {self.path} is not a checkpoint file, "
+                f"starting afresh[/bold red]"
+            )
+            return {}
+        latest = {}
+        offset = len(self.MAGIC)
+        while offset + self.RECORD.size <= len(data):
+            kind, key_length, length, crc = self.RECORD.unpack_from(data, offset)
+            start = offset + self.RECORD.size
+            end = start + key_length + length
+            key = data[start : start + key_length]
+            payload = data[start + key_length : end]
+            if end > len(data) or zlib.crc32(payload, zlib.crc32(key)) != crc:
+                break
+            latest[(kind, key.decode())] = payload
+            offset = end
+        if offset < len(data):
+            print(f"[bold red][*] Checkpoint {self.path} is truncated[/bold red]")
+        return latest
+
+    def restore(self):
+        """
+        Restores the last checkpoint, if any. Meant to be called once the
+        Automations are built and before the Entities receive updates.
+        Returns the names of the restored Entities and Automations.
+        """
+        if not os.path.exists(self.path):
+            return [], []
+        started = time.perf_counter()
+        entities = []
+        automations = []
+        for (kind, name), payload in self.read().items():
+            if kind == self.ENTITY and name in self.entities:
+                snapshot, saved = self.decode_entity(payload)
+                downtime = max(time.time() - saved, 0.0)
+                if self.max_age is not None and downtime > self.max_age:
+                    continue
+                self.entities[name].restore(snapshot, downtime)
+                entities.append(name)
+            elif kind == self.AUTOMATION and name in self.automations:
+                self.automations[name].restore(json.loads(payload))
+                automations.append(name)
+        print(
+            f"[bold yellow][*] Restored {len(entities)} Entities and "
+            f"{len(automations)} Automations from {self.path} in "
+            f"{(time.perf_counter() - started) * 1e3:.2f}ms[/bold yellow]"
+        )
+        return entities, automations
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.save()
+            except Exception as e:
+                print(f"[ERROR] Checkpoint failed: {e}")
+
+    def start(self):
+        """Checkpoints every interval seconds, on a daemon thread."""
+        self.stopped.clear()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops the periodic checkpoints and takes a last one."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.save()
@@ -1,6 +1,13 @@
-from textx import textx_isinstance, get_metamodel
-import statistics
-from smauto.lib.types import List, Dict, Time, Date
+from textx import (
+    textx_isinstance,
+    get_metamodel,
+    get_model,
+    get_location,
+    TextXSemanticError,
+)
+import ast
+from smauto.lib.types import List, Dict, Time
+from smauto.lib.entity import Attribute
 
 
 # List of primitive types that can be directly printed
@@ -38,18 +45,188 @@ OPERATORS = {
     "InRange": lambda attr, min, max: f"({attr} > {min} and {attr} < {max})",
 }
 
+# Lambdas used to fold constant arithmetic operations of math() expressions
+MATH_OPERATORS = {
+    "+": lambda left, right: left + right,
+    "-": lambda left, right: left - right,
+    "*": lambda left, right: left * right,
+    "/": lambda left, right: left / right,
+}
+
+# Logical operators whose operands can be swapped, and which short-circuit
+# through the and/or of their expressions
+COMMUTATIVE_OPERATORS = ("AND", "OR", "NAND", "NOR")
+
+# Operators testing containment in strings, lists and dicts
+CONTAINMENT_OPERATORS = ("~", "!~", "has", "has not", "in", "not in")
+
+# Relative evaluation cost of the kinds of primitive conditions
+CONDITION_COSTS = {"scalar": 1, "containment": 4, "aggregate": 8}
+
+# Attribute types and literal types accepted by each primitive condition
+OPERAND_TYPES = {
+    "NumericCondition": (("int", "float"), (int, float)),
+    "StringCondition": (("str",), (str,)),
+    "BoolCondition": (("bool",), (bool,)),
+    "ListCondition": (("list",), (List,)),
+    "DictCondition": (("dict",), (Dict,)),
+    "TimeCondition": (("time",), (Time,)),
+}
+
+# Minimum window size of each aggregate function
+MIN_WINDOW_SIZES = {"std": 2, "var": 2, "mean": 1, "min": 1, "max": 1}
+
+# Executions between samples of the true rates of a condition's operands
+SAMPLE_PERIOD = 16
+
+# Window aggregate functions by their grammar class
+AGGREGATE_FUNCTIONS = {
+    "StdAttr": "std",
+    "MeanAttr": "mean",
+    "VarAttr": "var",
+    "MinAttr": "min",
+    "MaxAttr": "max",
+}
+
+
+class EntityRefBinder(ast.NodeTransformer):
+    """
+    Rewrites the entities['<entity>'] and
+    entities['<entity>'].attributes_dict['<attr>'] lookups of a condition
+    expression into names bound directly to the Entity and Attribute objects,
+    so that evaluating the compiled expression skips the dictionary lookups.
+    """
+
+    def __init__(self, entities):
+        self.entities = entities
+        self.bindings = {}
+
+    @staticmethod
+    def subscript_key(node):
+        # Python < 3.9 wraps subscript keys in ast.Index
+        key = getattr(node.slice, "value", node.slice)
+        if isinstance(key, ast.Constant) and isinstance(key.value, str):
+            return key.value
+        return None
+
+    def entity_name(self, node):
+        if (
+            isinstance(node, ast.Subscript)
+            and isinstance(node.value, ast.Name)
+            and node.value.id == "entities"
+        ):
+            name = self.subscript_key(node)
+            if name in self.entities:
+                return name
+        return None
+
+    def bind(self, name, obj, node):
+        self.bindings[name] = obj
+        return ast.copy_location(ast.Name(id=name, ctx=ast.Load()), node)
+
+    def visit_Call(self, node):
+        # entities['<entity>'].aggregate(<index>) reads the aggregate value
+        func = node.func
+        if (
+            isinstance(func, ast.Attribute)
+            and func.attr == "aggregate"
+            and len(node.args) == 1
+            and isinstance(node.args[0], ast.Constant)
+        ):
+            entity_name = self.entity_name(func.value)
+            if entity_name is not None:
+                index = node.args[0].value
+                name = self.bind(
+                    f"_g_{entity_name}__{index}",
+                    self.entities[entity_name].aggregates[index],
+                    node,
+                )
+                return ast.copy_location(
+                    ast.Attribute(value=name, attr="value", ctx=ast.Load()), node
+                )
+        return self.generic_visit(node)
+
+    def visit_Subscript(self, node):
+        # entities['<entity>']
+        entity_name = self.entity_name(node)
+        if entity_name is not None:
+            return self.bind(f"_e_{entity_name}", self.entities[entity_name], node)
+        # entities['<entity>'].attributes_dict['<attr>']
+        if (
+            isinstance(node.value, ast.Attribute)
+            and node.value.attr == "attributes_dict"
+        ):
+            entity_name = self.entity_name(node.value.value)
+            attr_name = self.subscript_key(node)
+            entity = self.entities.get(entity_name)
+            if entity is not None and attr_name in entity.attributes_dict:
+                return self.bind(
+                    f"_a_{entity_name}__{attr_name}",
+                    entity.attributes_dict[attr_name],
+                    node,
+                )
+        return self.generic_visit(node)
+
+
+class AggregateRegistry(object):
+    """
+    Per-model registry of window aggregates, keyed by
+    (entity, sampled attribute, function, window). Conditions using the same
+    aggregate share a single node, updated once per new sample.
+    """
+
+    def __init__(self):
+        self.aggregates = {}
+
+    @staticmethod
+    def of(model):
+        if getattr(model, "aggregate_registry", None) is None:
+            model.aggregate_registry = AggregateRegistry()
+        return model.aggregate_registry
+
+    def get(self, entity, source, func, size, duration=None):
+        """
+        Returns the index of the aggregate on the Entity, creating it if it
+        does not exist yet.
+        """
+        key = (entity, source, func, size, duration)
+        if key not in self.aggregates:
+            self.aggregates[key] = entity.add_aggregate(source, func, size, duration)
+        return self.aggregates[key]
+
 
 class Condition(object):
     def __init__(self, parent):
         self.parent = parent
         self.cond_lambda = None
         self.cond_raw = None
+        self.cond_code = None
+        self.cond_globals = None
+        # Truth value of the previous evaluation, for edge triggering
+        self.last_truth = False
+        # Root node in the model's ConditionNetwork, if it is evaluated there
+        self.network_node = None
+        # Entities read by the condition, with their versions and the result
+        # of the last evaluation
+        self.read_entities = []
+        self.cached_versions = None
+        self.cached_result = None
+        # Estimated cost of evaluating the (sub)tree, see estimate_cost()
+        self.cost = CONDITION_COSTS["scalar"]
+        # Observed truth of the (sub)tree, sampled while executing the root
+        self.true_count = 0
+        self.sample_count = 0
+        self.node_code = None
+        self.executions = 0
+        # Whether evaluating may raise despite type_check(), e.g. on a
+        # division by an attribute
+        self.may_raise = False
 
     @staticmethod
     def transform_operand(node) -> str:
         # If node is a primitive type return as is (if string, add quotation marks)
         if type(node) in PRIMITIVES:
-            if type(node) is str:
+            if isinstance(node, str):
                 return f"'{node}'"
             else:
                 return node
@@ -83,28 +260,14 @@ class Condition(object):
 
     @staticmethod
     def transform_augmented_attr(aattr) -> str:
-        parent = aattr.parent
         val: str = ""
         if aattr.__class__.__name__ == "SimpleNumericAttr":
             attr_ref = aattr.attribute
             entity_ref = aattr.attribute.parent
-            if parent.__class__.__name__ in (
-                "StdAttr",
-                "MeanAttr",
-                "VarAttr",
-                "MinAttr",
-                "MaxAttr",
-            ):  # Have buffer
-                entity_ref.init_attr_buffer(attr_ref.name, parent.size)
-                entity_ref.attr_buffs.append((attr_ref.name, parent.size))
-                val = (
-                    f"entities['{entity_ref.name}']." + f"get_buffer('{attr_ref.name}')"
-                )
-            else:
-                val = (
-                    f"entities['{entity_ref.name}']."
-                    + f"attributes_dict['{attr_ref.name}'].value"
-                )
+            val = (
+                f"entities['{entity_ref.name}']."
+                + f"attributes_dict['{attr_ref.name}'].value"
+            )
         elif aattr.__class__.__name__ == "SimpleBoolAttr":
             attr_ref = aattr.attribute
             entity_ref = aattr.attribute.parent
@@ -133,22 +296,306 @@ class Condition(object):
                 f"entities['{entity_ref.name}']."
                 + f"attributes_dict['{attr_ref.name}'].value"
             )
-        elif aattr.__class__.__name__ in "StdAttr":
-            val = f"std({Condition.transform_augmented_attr(aattr.attribute)})"
-        elif aattr.__class__.__name__ == "MeanAttr":
-            val = f"mean({Condition.transform_augmented_attr(aattr.attribute)})"
-        elif aattr.__class__.__name__ == "VarAttr":
-            val = f"var({Condition.transform_augmented_attr(aattr.attribute)})"
-        elif aattr.__class__.__name__ == "MaxAttr":
-            val = f"max({Condition.transform_augmented_attr(aattr.attribute)})"
-        elif aattr.__class__.__name__ == "MinAttr":
-            val = f"min({Condition.transform_augmented_attr(aattr.attribute)})"
+        elif aattr.__class__.__name__ in AGGREGATE_FUNCTIONS:
+            entity_ref, index = Condition.build_aggregate(aattr)
+            val = f"entities['{entity_ref.name}'].aggregate({index})"
+        elif aattr.__class__.__name__ == "MultiplyAttr":
+            # Fused product of the referenced attributes
+            factors = [
+                Condition.transform_augmented_attr(factor) for factor in aattr.attribute
+            ]
+            val = f"({' * '.join(factors)})" if len(factors) > 0 else "1"
+        elif isinstance(aattr, MathExpression):
+            val = str(aattr.transform())
         return val
 
+    @staticmethod
+    def build_aggregate(aattr):
+        """
+        Returns the Entity sampled by an aggregate attribute (e.g. mean(x, 10))
+        and the index of its window aggregate, shared through the model's
+        AggregateRegistry.
+        """
+        func = AGGREGATE_FUNCTIONS[aattr.__class__.__name__]
+        inner = aattr.attribute
+        if inner.__class__.__name__ in AGGREGATE_FUNCTIONS:
+            # Nested aggregates sample the values of the inner one
+            entity_ref, source = Condition.build_aggregate(inner)
+        else:
+            entity_ref, source = inner.attribute.parent, inner.attribute.name
+        duration = None if aattr.duration is None else aattr.duration.to_seconds()
+        registry = AggregateRegistry.of(get_model(aattr))
+        return entity_ref, registry.get(entity_ref, source, func, aattr.size, duration)
+
+    @staticmethod
+    def collect_attributes(node) -> list:
+        """
+        Returns the Entity Attributes referenced by a condition (sub)tree.
+        """
+        if isinstance(node, Attribute):
+            return [node]
+        if isinstance(node, (list, tuple)):
+            return [a for item in node for a in Condition.collect_attributes(item)]
+        attrs = []
+        for ref in ("r1", "r2", "operand1", "operand2", "attribute", "op"):
+            child = getattr(node, ref, None)
+            if child is not None and type(child) not in PRIMITIVES:
+                attrs += Condition.collect_attributes(child)
+        return attrs
+
+    def leaves(self) -> list:
+        """Returns the conditions combined by a condition (sub)tree."""
+        if isinstance(self, ConditionGroup):
+            return self.r1.leaves() + self.r2.leaves()
+        return [self]
+
+    def time_conditions(self) -> list:
+        """Returns the conditions on the system_clock time."""
+        return [
+            cond
+            for cond in self.leaves()
+            if isinstance(cond, TimeCondition)
+            and cond.operand1.attribute.parent.name == "system_clock"
+        ]
+
+    def is_time_only(self) -> bool:
+        return len(self.time_conditions()) == len(self.leaves())
+
+    @staticmethod
+    def reads_aggregate(node) -> bool:
+        """Whether an operand (sub)tree reads a window aggregate."""
+        if node.__class__.__name__ in AGGREGATE_FUNCTIONS:
+            return True
+        if isinstance(node, (list, tuple)):
+            return any(Condition.reads_aggregate(item) for item in node)
+        for ref in ("operand1", "operand2", "attribute", "op"):
+            child = getattr(node, ref, None)
+            if (
+                child is not None
+                and type(child) not in PRIMITIVES
+                and not isinstance(child, Attribute)
+                and Condition.reads_aggregate(child)
+            ):
+                return True
+        return False
+
+    def estimate_cost(self):
+        """
+        Estimates the evaluation cost of every node of the (sub)tree.
+        Window aggregates cost more than containment tests, which cost more
+        than scalar comparisons.
+        """
+        if isinstance(self, ConditionGroup):
+            self.cost = self.r1.estimate_cost() + self.r2.estimate_cost()
+        elif self.reads_aggregate(self):
+            self.cost = CONDITION_COSTS["aggregate"]
+        elif isinstance(self, (ListCondition, DictCondition)) or (
+            getattr(self, "operator", None) in CONTAINMENT_OPERATORS
+        ):
+            self.cost = CONDITION_COSTS["containment"]
+        else:
+            self.cost = CONDITION_COSTS["scalar"]
+        return self.cost
+
+    @property
+    def true_rate(self) -> float:
+        """Observed true rate, starting from 0.5 before any sample."""
+        return (self.true_count + 1) / (self.sample_count + 2)
+
+    def expected_cost(self) -> float:
+        """
+        Expected cost of evaluating the (sub)tree in its current order,
+        taking into account the short-circuiting of and/or.
+        """
+        if not isinstance(self, ConditionGroup):
+            return self.cost
+        first, second = self.operands()
+        if self.operator in ("AND", "NAND"):
+            # The second operand is evaluated only if the first holds
+            skip = 1 - first.true_rate
+        elif self.operator in ("OR", "NOR"):
+            skip = first.true_rate
+        else:
+            skip = 0
+        return first.expected_cost() + (1 - skip) * second.expected_cost()
+
+    def order_operands(self) -> bool:
+        """
+        Orders the operands of the commutative groups of the (sub)tree to
+        minimize their expected cost. Returns True if any order changed.
+        """
+        if not isinstance(self, ConditionGroup):
+            return False
+        changed = self.r1.order_operands()
+        changed = self.r2.order_operands() or changed
+        if self.operator in COMMUTATIVE_OPERATORS:
+            current = self.expected_cost()
+            self.swapped = not self.swapped
+            if self.expected_cost() < current:
+                changed = True
+            else:
+                self.swapped = not self.swapped
+        return changed
+
+    def sample(self):
+        """
+        Evaluates every node of the tree on its own, recording its truth,
+        and reorders the operands if the observed rates call for it.
+        """
+        nodes = [node for node in self.nodes() if node.node_code is not None]
+        for node in nodes:
+            try:
+                truth = bool(eval(node.node_code, self.cond_globals))
+            except ArithmeticError:
+                continue
+            node.sample_count += 1
+            node.true_count += truth
+        if self.order_operands():
+            Condition.process_node_condition(self)
+            self.compile()
+
+    def nodes(self) -> list:
+        """Returns all nodes of a condition (sub)tree, in pre-order."""
+        if isinstance(self, ConditionGroup):
+            return [self] + self.r1.nodes() + self.r2.nodes()
+        return [self]
+
+    def describe_costs(self) -> list:
+        """Returns a line per node with its cost estimate and true rate."""
+        return [
+            f"{node.cond_lambda}: cost {node.cost}, "
+            + f"true rate {node.true_rate:.2f} ({node.sample_count} samples)"
+            for node in self.nodes()
+        ]
+
+    @staticmethod
+    def semantic_error(msg, node):
+        return TextXSemanticError(msg, **get_location(node))
+
+    @staticmethod
+    def check_numeric_operand(operand) -> bool:
+        """
+        Type-checks a numeric operand, returning True if evaluating it may
+        still raise, i.e. it divides by a non-constant value.
+        """
+        cls_name = operand.__class__.__name__
+        if type(operand) in (int, float):
+            return False
+        elif cls_name == "SimpleNumericAttr":
+            if operand.attribute.type not in ("int", "float"):
+                raise Condition.semantic_error(
+                    f"Attribute <{operand.attribute.name}> is not numeric", operand
+                )
+            return False
+        elif cls_name in AGGREGATE_FUNCTIONS:
+            func = AGGREGATE_FUNCTIONS[cls_name]
+            if operand.duration is not None:
+                if operand.duration.to_seconds() <= 0:
+                    raise Condition.semantic_error(
+                        f"Window duration of {func}() must be positive", operand
+                    )
+            elif operand.size < MIN_WINDOW_SIZES[func]:
+                raise Condition.semantic_error(
+                    f"Window size of {func}() must be at least "
+                    + f"{MIN_WINDOW_SIZES[func]}",
+                    operand,
+                )
+            inner = operand.attribute
+            if inner.__class__.__name__ not in AGGREGATE_FUNCTIONS and (
+                inner.__class__.__name__ != "SimpleNumericAttr"
+            ):
+                raise Condition.semantic_error(
+                    f"{func}() must be applied to a numeric attribute "
+                    + "or a window aggregate",
+                    operand,
+                )
+            return Condition.check_numeric_operand(inner)
+        elif cls_name == "MultiplyAttr":
+            if len(operand.attribute) == 0:
+                raise Condition.semantic_error(
+                    "mul() needs at least one attribute", operand
+                )
+            return any(
+                [
+                    Condition.check_numeric_operand(factor)
+                    for factor in operand.attribute
+                ]
+            )
+        elif isinstance(operand, MathOperation):
+            return operand.type_check()
+        raise Condition.semantic_error("Operand is not numeric", operand)
+
+    def type_check(self) -> bool:
+        """
+        Checks the condition (sub)tree against the types of the attributes it
+        reads, its window sizes and constant ranges, so that invalid
+        conditions are rejected at model load time instead of failing on
+        every evaluation. Returns True if evaluating it may still raise.
+        """
+        cls_name = self.__class__.__name__
+        if isinstance(self, ConditionGroup):
+            may_raise = self.r1.type_check()
+            return self.r2.type_check() or may_raise
+        elif isinstance(self, InRangeCondition):
+            if self.min >= self.max:
+                raise self.semantic_error(f"Empty range [{self.min}, {self.max}]", self)
+            return self.check_numeric_operand(self.attribute)
+        elif cls_name == "NumericCondition":
+            may_raise = self.check_numeric_operand(self.operand1)
+            return self.check_numeric_operand(self.operand2) or may_raise
+        attr_types, literal_types = OPERAND_TYPES[cls_name]
+        for operand in (self.operand1, self.operand2):
+            if type(operand) in literal_types:
+                continue
+            attribute = getattr(operand, "attribute", None)
+            if getattr(attribute, "type", None) not in attr_types:
+                raise self.semantic_error(
+                    f"Operand of {cls_name} must be of type "
+                    + f"{' or '.join(attr_types)}",
+                    self,
+                )
+        return False
+
     def build(self):
-        self.process_node_condition(self)
+        self.may_raise = self.type_check()
+        self.estimate_cost()
+        self.order_operands()
+        Condition.process_node_condition(self)
+        self.compile()
+        # Index the Automation under every (entity, attribute) it reads.
+        # Time-only conditions are woken up by the TimeScheduler instead.
+        if not self.is_time_only():
+            for attr in self.collect_attributes(self):
+                attr.parent.add_automation(self.parent, attr.name)
         return self.cond_lambda
 
+    def compile(self):
+        """
+        Compiles the condition expression once into a code object bound to
+        the Entities and Attributes it reads. evaluate() only executes it.
+        """
+        entities = {
+            attr.parent.name: attr.parent for attr in self.collect_attributes(self)
+        }
+        binder = EntityRefBinder(entities)
+        tree = binder.visit(ast.parse(self.cond_lambda, mode="eval"))
+        ast.fix_missing_locations(tree)
+        self.cond_globals = {"entities": entities}
+        self.cond_globals.update(binder.bindings)
+        self.cond_code = compile(tree, f"<condition {self.parent.name}>", "eval")
+        # The operands of commutative groups are compiled on their own, to
+        # sample their true rates
+        self.node_code = self.cond_code
+        for node in self.nodes()[1:]:
+            group = node.parent
+            if group.operator in COMMUTATIVE_OPERATORS:
+                node_tree = binder.visit(ast.parse(node.cond_lambda, mode="eval"))
+                ast.fix_missing_locations(node_tree)
+                node.node_code = compile(node_tree, "<operand>", "eval")
+        self.cond_globals.update(binder.bindings)
+        self.read_entities = list(entities.values())
+        self.cached_versions = None
+
     # Post-Order traversal of Condition tree, generating the condition for each node
     @staticmethod
     def process_node_condition(cond_node):
@@ -163,9 +610,10 @@ class Condition(object):
             Condition.process_node_condition(cond_node.r1)
             # Visit right node
             Condition.process_node_condition(cond_node.r2)
-            # Build lambda
+            # Build lambda, with the operands in evaluation order
+            first, second = cond_node.operands()
             cond_node.cond_lambda = (OPERATORS[cond_node.operator])(
-                cond_node.r1.cond_lambda, cond_node.r2.cond_lambda
+                first.cond_lambda, second.cond_lambda
             )
         elif textx_isinstance(
             cond_node, metamodel.namespaces["condition"]["InRangeCondition"]
@@ -176,28 +624,36 @@ class Condition(object):
             operand2 = Condition.transform_operand(cond_node.operand2)
             cond_node.cond_lambda = (OPERATORS[cond_node.operator])(operand1, operand2)
 
+    def execute(self):
+        """Executes the code object compiled by build()."""
+        self.executions += 1
+        if self.executions % SAMPLE_PERIOD == 0 and isinstance(self, ConditionGroup):
+            self.sample()
+        if not self.may_raise:
+            # Type-checked by build(), cannot raise
+            return bool(eval(self.cond_code, self.cond_globals))
+        try:
+            return bool(eval(self.cond_code, self.cond_globals))
+        except ArithmeticError as e:
+            self.parent.report_error(e)
+            return False
+
     def evaluate(self):
-        if self.cond_lambda not in (None, ""):
-            # Evaluate condition providing the textX model as global context for evaluation
-            try:
-                entities = self.parent.parent.entities_dict
-                # print(entities['system_clock'].attributes_dict['time'].value.to_int())
-                if eval(
-                    self.cond_lambda,
-                    {"entities": entities},
-                    {
-                        "std": statistics.stdev,
-                        "var": statistics.variance,
-                        "mean": statistics.mean,
-                        "min": min,
-                        "max": max,
-                    },
-                ):
-                    return True, f"{self.parent.name}: triggered."
-                else:
-                    return False, f"{self.parent.name}: not triggered."
-            except Exception as e:
-                print(e)
+        if self.network_node is not None:
+            # Truth value maintained by the ConditionNetwork on updates
+            if self.network_node.truth:
+                return True, f"{self.parent.name}: triggered."
+            else:
+                return False, f"{self.parent.name}: not triggered."
+        elif self.cond_code is not None:
+            # Reuse the last result if no Entity read has been updated since
+            versions = [entity.version for entity in self.read_entities]
+            if versions != self.cached_versions:
+                self.cached_result = self.execute()
+                self.cached_versions = versions
+            if self.cached_result:
+                return True, f"{self.parent.name}: triggered."
+            else:
                 return False, f"{self.parent.name}: not triggered."
         else:
             return False, f"{self.parent.name}: condition not built."
@@ -208,8 +664,14 @@ class ConditionGroup(Condition):
         self.r1 = r1
         self.r2 = r2
         self.operator = operator
+        # Whether r2 is evaluated before r1, see order_operands()
+        self.swapped = False
         super().__init__(parent)
 
+    def operands(self):
+        """Returns the operands in evaluation order."""
+        return (self.r2, self.r1) if self.swapped else (self.r1, self.r2)
+
 
 class PrimitiveCondition(Condition):
     def __init__(self, parent):
@@ -280,3 +742,113 @@ class TimeCondition(PrimitiveCondition):
         self.operand2 = operand2
         self.operator = operator
         super().__init__(parent)
+
+    def boundaries(self) -> list:
+        """
+        Returns the seconds of the day at which the truth value of the
+        condition may change: the compared time, the second after it and
+        midnight.
+        """
+        t = self.operand2
+        seconds = t.hour * 3600 + t.minute * 60 + t.second
+        return sorted({seconds % 86400, (seconds + 1) % 86400, 0})
+
+
+class MathOperation(object):
+    """
+    Base class of the arithmetic nodes of math() expressions. Its operands
+    are stored in op, interleaved with the operators applied to them.
+    """
+
+    def __init__(self, parent, op):
+        self.parent = parent
+        self.op = op
+
+    @staticmethod
+    def is_constant(val):
+        return type(val) in (int, float)
+
+    def transform(self):
+        """
+        Returns the value of the node if it folds to a constant,
+        else its expression string.
+        """
+        val = self.op[0].transform()
+        for operator, operand in zip(self.op[1::2], self.op[2::2]):
+            right = operand.transform()
+            if (
+                self.is_constant(val)
+                and self.is_constant(right)
+                and not (operator == "/" and right == 0)
+            ):
+                val = MATH_OPERATORS[operator](val, right)
+            else:
+                val = f"({val} {operator} {right})"
+        return val
+
+    def type_check(self) -> bool:
+        """
+        Type-checks the operands of the node, rejecting divisions by a
+        constant zero. Returns True if it divides by a non-constant value.
+        """
+        may_raise = False
+        for index, operand in enumerate(self.op):
+            if isinstance(operand, str):
+                continue
+            if index > 0 and self.op[index - 1] == "/":
+                divisor = operand.transform()
+                if self.is_constant(divisor) and divisor == 0:
+                    raise Condition.semantic_error("Division by zero", operand)
+                if not self.is_constant(divisor):
+                    may_raise = True
+            may_raise = operand.type_check() or may_raise
+        return may_raise
+
+
+class MathExpression(MathOperation):
+    def __init__(self, parent, op):
+        super().__init__(parent, op)
+
+
+class MathGroup(MathOperation):
+    def __init__(self, parent, op):
+        super().__init__(parent, op)
+
+
+class MathTerm(MathOperation):
+    def __init__(self, parent, op):
+        super().__init__(parent, op)
+
+
+class MathFactor(MathOperation):
+    def __init__(self, parent, sign, op):
+        self.sign = sign
+        super().__init__(parent, op)
+
+    def transform(self):
+        val = self.op.transform()
+        if self.sign == "-":
+            return -val if self.is_constant(val) else f"(-{val})"
+        return val
+
+    def type_check(self) -> bool:
+        return self.op.type_check()
+
+
+class MathOperand(MathOperation):
+    def __init__(self, parent, op):
+        super().__init__(parent, op)
+
+    def transform(self):
+        if self.is_constant(self.op):
+            return self.op
+        elif isinstance(self.op, MathOperation):
+            return self.op.transform()
+        return Condition.transform_augmented_attr(self.op)
+
+    def type_check(self) -> bool:
+        if self.is_constant(self.op):
+            return False
+        elif isinstance(self.op, MathOperation):
+            return self.op.type_check()
+        return Condition.check_numeric_operand(self.op)
@@ -1,11 +1,264 @@
-from collections import deque
+import time
+from threading import Lock
 
-from smauto.lib.broker import MQTTBroker, AMQPBroker, RedisBroker
-from smauto.lib.types import Time
+import numpy as np
+from rich import print
+
+from smauto.lib.aggregate import (
+    AGGREGATES,
+    DURATION_AGGREGATES,
+    DurationAggregate,
+    RingBuffer,
+    TimedRingBuffer,
+    to_sample,
+)
+from smauto.lib.types import Dict, List, Time
+
+
+class AttributeBuffers:
+    """
+    Sample buffers and window aggregates of the attributes of an Entity.
+    Shared by the Entity of the model and the Entity of the generated
+    executor, which call init_buffers() with their attribute names.
+    ...
+
+    Attributes
+    ----------
+        attributes_buff: dict
+            RingBuffer of each attribute with sample windows, or None
+        attributes_timed_buff: dict
+            TimedRingBuffer of each attribute with duration windows, or None
+        clock: callable
+            Clock timestamping the samples of duration windows, in seconds
+        aggregates: list
+            Window aggregates, in creation order
+        attr_aggregates: dict
+            Window aggregates sampling each attribute
+        attr_buffs: list
+            (source, func, size, duration) of each aggregate
+        skipped_samples: dict
+            Number of samples skipped per attribute, as they were not
+            finite numbers
+    """
+
+    def init_buffers(self, attr_names, clock=time.monotonic):
+        attr_names = list(attr_names)
+        self.attributes_buff = {attr_name: None for attr_name in attr_names}
+        self.attributes_timed_buff = {attr_name: None for attr_name in attr_names}
+        self.clock = clock
+        self.aggregates = []
+        self.attr_aggregates = {attr_name: [] for attr_name in attr_names}
+        self.attr_buffs = []
+        self.skipped_samples = {}
+        # Held while the windows change, by updates and expiries
+        self.buffers_lock = Lock()
+
+    def get_buffer(self, attr_name, size=None):
+        """
+        Returns a zero-copy view of the last size samples of an attribute,
+        or zeros until size samples have been received.
+        """
+        buff = self.attributes_buff[attr_name]
+        return buff.window(buff.capacity if size is None else size)
+
+    def init_attr_buffer(self, attr_name, size):
+        """
+        Creates the ring buffer of an attribute, or grows it so that it holds
+        at least size samples. A single buffer serves all window sizes.
+        """
+        if self.attributes_buff[attr_name] is None:
+            self.attributes_buff[attr_name] = RingBuffer(size)
+        else:
+            self.attributes_buff[attr_name].reserve(size)
+
+    def add_aggregate(self, source, func, size=None, duration=None):
+        """
+        Creates a window aggregate and returns its index in self.aggregates.
+        :param source: Name of the sampled attribute, or index of the aggregate
+            whose values are sampled (e.g. var(mean(x, 10), 10))
+        :param func: Aggregate function. e.g: 'mean'
+        :param size: Window size in samples
+        :param duration: Window length in seconds, instead of size
+        """
+        if isinstance(source, int):
+            node = self.aggregates[source].add_sink(func, size, duration)
+        elif duration is not None:
+            if self.attributes_timed_buff[source] is None:
+                self.attributes_timed_buff[source] = TimedRingBuffer()
+            node = DURATION_AGGREGATES[func](
+                duration, self.attributes_timed_buff[source]
+            )
+            self.attr_aggregates[source].append(node)
+        else:
+            # Keep one more sample than the window, the one it evicts
+            self.init_attr_buffer(source, size + 1)
+            node = AGGREGATES[func](size, self.attributes_buff[source])
+            self.attr_aggregates[source].append(node)
+        self.aggregates.append(node)
+        self.attr_buffs.append((source, func, size, duration))
+        return len(self.aggregates) - 1
+
+    def aggregate(self, index):
+        return self.aggregates[index].value
+
+    def clear_buffers(self):
+        """
+        Drops the window aggregates and attribute buffers. Returns the
+        dropped buffers, as {attribute: (RingBuffer, TimedRingBuffer)}, see
+        replay_buffers().
+        """
+        buffers = {
+            attr_name: (
+                self.attributes_buff[attr_name],
+                self.attributes_timed_buff[attr_name],
+            )
+            for attr_name in self.attr_aggregates.keys()
+        }
+        self.init_buffers(self.attr_aggregates.keys(), self.clock)
+        return buffers
+
+    def update_buffers(self, state_dict):
+        """
+        Function used by update_state() to append the new values to the
+            attribute buffers and window aggregates. Values that are not
+            finite numbers are skipped, leaving the windows unchanged.
+        """
+        now = self.clock()
+        for attribute, value in state_dict.items():
+            ring = self.attributes_buff.get(attribute)
+            timed = self.attributes_timed_buff.get(attribute)
+            if ring is None and timed is None:
+                continue
+            sample = to_sample(value)
+            if sample is None:
+                self.skip_sample(attribute, value)
+                continue
+            with self.buffers_lock:
+                if ring is not None:
+                    ring.append(sample)
+                if timed is not None:
+                    timed.append(now, sample)
+                for node in self.attr_aggregates[attribute]:
+                    node.push(sample, now)
+
+    def expire(self, now=None):
+        """
+        Evicts the samples that have left the duration windows by now, as
+        their aggregates change without new samples. Returns True and bumps
+        the Entity version if any aggregate value changed.
+        """
+        now = self.clock() if now is None else now
+        changed = False
+        with self.buffers_lock:
+            for node in self.aggregates:
+                if isinstance(node, DurationAggregate) and node.expire(now):
+                    changed = True
+        if changed:
+            self.version += 1
+        return changed
+
+    def next_expiry(self):
+        """
+        Returns the next time a sample leaves a duration window, or None if
+        the Entity has no samples in duration windows.
+        """
+        expiries = [
+            node.next_expiry()
+            for node in self.aggregates
+            if isinstance(node, DurationAggregate)
+        ]
+        expiries = [expiry for expiry in expiries if expiry is not None]
+        return min(expiries) if len(expiries) > 0 else None
+
+    def skip_sample(self, attr_name, value):
+        """Counts an invalid sample of an attribute, reporting the first one."""
+        if attr_name not in self.skipped_samples:
+            self.skipped_samples[attr_name] = 0
+            print(
+                f"[bold red][*] Skipping invalid samples of "
+                f"{getattr(self, 'name', '')}.{attr_name}, "
+                f"e.g. {value!r}[/bold red]"
+            )
+        self.skipped_samples[attr_name] += 1
+
+    def replay_buffers(self, buffers):
+        """
+        Feeds the samples of buffers dropped by clear_buffers() to the
+        new buffers and window aggregates, so that windows are not emptied
+        by a reload. Sample windows are replayed from the old RingBuffer
+        and duration windows, with their timestamps, from the old
+        TimedRingBuffer.
+        """
+        now = self.clock()
+        for attr_name, (ring, timed) in buffers.items():
+            if attr_name not in self.attr_aggregates:
+                continue
+            nodes = self.attr_aggregates[attr_name]
+            if ring is not None and self.attributes_buff[attr_name] is not None:
+                for sample in ring.last(min(ring.count, ring.capacity)).copy():
+                    self.attributes_buff[attr_name].append(sample)
+                    for node in nodes:
+                        if not isinstance(node, DurationAggregate):
+                            node.push(float(sample), now)
+            timed_buff = self.attributes_timed_buff[attr_name]
+            if timed is not None and timed_buff is not None:
+                for seq in range(timed.start, timed.end):
+                    timed_buff.append(timed.time(seq), timed.value(seq))
+                    for node in nodes:
+                        if isinstance(node, DurationAggregate):
+                            node.push(timed.value(seq), timed.time(seq))
+
+    def snapshot_buffers(self):
+        """
+        Returns the samples of the attribute buffers, as {"buffers",
+        "timed"}. Duration window samples are kept with their age in
+        seconds.
+        """
+        now = self.clock()
+        buffers = {}
+        timed = {}
+        # Updates and expiries change the buffers from other threads
+        with self.buffers_lock:
+            for attr_name in self.attr_aggregates.keys():
+                ring = self.attributes_buff[attr_name]
+                if ring is not None:
+                    buffers[attr_name] = ring.last(
+                        min(ring.count, ring.capacity)
+                    ).copy()
+                timed_buff = self.attributes_timed_buff[attr_name]
+                if timed_buff is not None:
+                    seqs = (
+                        np.arange(timed_buff.start, timed_buff.end)
+                        % timed_buff.capacity
+                    )
+                    timed[attr_name] = (
+                        now - timed_buff.times[seqs],
+                        timed_buff.values[seqs].copy(),
+                    )
+        return {"buffers": buffers, "timed": timed}
+
+    def restore_buffers(self, snapshot, downtime=0.0):
+        """
+        Replays the samples of a snapshot_buffers() taken downtime seconds
+        ago. Duration window samples older than the window are dropped.
+        """
+        now = self.clock() - downtime
+        buffers = {}
+        for attr_name, samples in snapshot["buffers"].items():
+            ring = RingBuffer(max(len(samples), 1))
+            for sample in samples:
+                ring.append(sample)
+            buffers[attr_name] = (ring, None)
+        for attr_name, (ages, samples) in snapshot["timed"].items():
+            timed = TimedRingBuffer(max(len(samples), 1))
+            for age, sample in zip(ages, samples):
+                timed.append(now - age, sample)
+            buffers[attr_name] = (buffers.get(attr_name, (None, None))[0], timed)
+        self.replay_buffers(buffers)
 
 
 # A class representing an entity communicating via an MQTT broker on a specific topic
-class Entity:
+class Entity(AttributeBuffers):
     """
     The Entity class represents an entity communicating via an MQTT broker on a specific topic.
     ...
@@ -60,12 +313,20 @@ class Entity:
         # Entity's Attributes
         self.attributes = attributes
         self.description = description
-        self.attr_buffs = []
         # Attributes Dictionary
         self.attributes_dict = {
             attribute.name: attribute for attribute in self.attributes
         }
-        self.attributes_buff = {attribute.name: None for attribute in self.attributes}
+        self.init_buffers(self.attributes_dict.keys())
+        # Threshold indexes of the ConditionNetwork, per attribute
+        self.attr_index = {}
+        # Index of the Automations whose condition reads each attribute
+        self.attr_automations = {attribute.name: [] for attribute in self.attributes}
+        # Bumped on every state update, so readers can tell if it changed
+        self.version = 0
+        # Held by update_state(), and by a reload while it rebuilds the
+        # conditions on the Entity
+        self.update_lock = Lock()
 
         # Inspect Attributes and if an attribute is a DictAttribute,
         # create its items dictionary for easy updating
@@ -73,18 +334,98 @@ class Entity:
             if type(attribute) is DictAttribute:
                 attribute.items_dict = {item.name: item for item in attribute.items}
 
-    def get_buffer(self, attr_name):
-        if (
-            len(self.attributes_buff[attr_name])
-            != self.attributes_buff[attr_name].maxlen
-        ):
-            return [0] * self.attributes_buff[attr_name].maxlen
-        else:
-            return self.attributes_buff[attr_name]
+    def add_automation(self, automation, attr_name):
+        """
+        Registers an Automation whose condition reads the given attribute.
+        Meant to be called while building the Automation's condition.
+        """
+        if automation not in self.attr_automations[attr_name]:
+            self.attr_automations[attr_name].append(automation)
 
-    def init_attr_buffer(self, attr_name, size):
-        self.attributes_buff[attr_name] = deque(maxlen=size)
-        # self.attributes_buff[attr_name].extend([0] * size)
+    def notify_automations(self, attr_names):
+        """
+        Wakes up the Automations depending on any of the given attributes.
+        """
+        automations = []
+        for attr_name in attr_names:
+            for automation in self.attr_automations.get(attr_name, []):
+                if automation not in automations:
+                    automations.append(automation)
+        for automation in automations:
+            automation.notify()
+
+    def clear_automations(self):
+        """
+        Drops the Automation indexes, window aggregates and attribute
+        buffers, so that the conditions of a reloaded model can be built
+        on the Entity. Returns the dropped buffers, see clear_buffers().
+        """
+        self.attr_index = {}
+        self.attr_automations = {attr_name: [] for attr_name in self.attributes_dict}
+        return self.clear_buffers()
+
+    def snapshot(self):
+        """
+        Returns the runtime state of the Entity, see Checkpointer: the last
+        state message, the attribute values as a state message and the
+        samples of the attribute buffers, see snapshot_buffers().
+        """
+        return {
+            "state": self.state,
+            "values": self.attribute_values(self.attributes_dict),
+            **self.snapshot_buffers(),
+        }
+
+    def restore(self, snapshot, downtime=0.0):
+        """
+        Restores a snapshot() taken downtime seconds ago. Meant to be called
+        once the conditions are built, before any state update. The
+        restored samples go through the window aggregates, the restored
+        values through the ConditionNetwork, and the Automations reading
+        the Entity are notified.
+        """
+        previous = {
+            attr_name: self.attributes_dict[attr_name].value
+            for attr_name in self.attr_index.keys()
+        }
+        self.state = snapshot["state"]
+        values = {
+            attr_name: value
+            for attr_name, value in snapshot["values"].items()
+            if attr_name in self.attributes_dict
+        }
+        self.update_attributes(self.attributes_dict, values)
+        self.restore_buffers(snapshot, downtime)
+        self.version += 1
+        for attr_name, value in previous.items():
+            self.attr_index[attr_name].update(
+                value, self.attributes_dict[attr_name].value
+            )
+        self.notify_automations(self.attributes_dict.keys())
+
+    @staticmethod
+    def attribute_values(root):
+        """
+        Returns the values of Attributes as a state message, the inverse of
+        update_attributes().
+        """
+        values = {}
+        for attr_name, attribute in root.items():
+            value = attribute.value
+            if attribute.__class__.__name__ == "TimeAttribute":
+                value = {
+                    "hour": value.hour,
+                    "minute": value.minute,
+                    "second": value.second,
+                }
+            elif isinstance(value, dict):
+                value = Entity.attribute_values(value)
+            elif type(value) is Dict:
+                value = value.to_dict()
+            elif type(value) is List:
+                value = value.print_item(value)
+            values[attr_name] = value
+        return values
 
     def to_camel_case(self, snake_str):
         return "".join(x.capitalize() for x in snake_str.lower().split("_"))
@@ -97,24 +438,35 @@ class Entity:
         :param new_state: Dictionary containing the Entity's state
         :return:
         """
-        # Update state
-        self.state = new_state
-        # print(new_state)
-        # Update attributes based on state
-        self.update_attributes(self.attributes_dict, new_state)
-        self.update_buffers(self.attributes_buff, new_state)
-
-    @staticmethod
-    def update_buffers(root, state_dict):
-        """
-        Recursive function used by update_state() mainly to updated
-            dictionaries/objects and normal Attributes.
-        """
-        # Update attributes
-        for attribute, value in state_dict.items():
-            # If value is a dictionary, also update the Dict's subattributes/items
-            if root[attribute] is not None:
-                root[attribute].append(value)
+        with self.update_lock:
+            # Attributes that changed value or feed a buffer
+            changed = [
+                attr_name
+                for attr_name, value in new_state.items()
+                if self.attributes_buff.get(attr_name) is not None
+                or self.attributes_timed_buff.get(attr_name) is not None
+                or self.state.get(attr_name) != value
+            ]
+            # Previous values of the attributes compared against thresholds
+            previous = {
+                attr_name: self.attributes_dict[attr_name].value
+                for attr_name in new_state.keys()
+                if attr_name in self.attr_index
+            }
+            # Update state
+            self.state = new_state
+            # print(new_state)
+            # Update attributes based on state
+            self.update_attributes(self.attributes_dict, new_state)
+            self.update_buffers(new_state)
+            self.version += 1
+            # Refresh the conditions whose thresholds were crossed
+            for attr_name, value in previous.items():
+                self.attr_index[attr_name].update(
+                    value, self.attributes_dict[attr_name].value
+                )
+            # Wake up only the Automations reading the changed attributes
+            self.notify_automations(changed)
 
     @staticmethod
     def update_attributes(root, state_dict):
@@ -129,7 +481,7 @@ class Entity:
                 setattr(root[attribute].value, "hour", value["hour"])
                 setattr(root[attribute].value, "minute", value["minute"])
                 setattr(root[attribute].value, "second", value["second"])
-            elif type(value) is dict:
+            elif isinstance(value, dict):
                 Entity.update_attributes(root[attribute].value, value)
             else:
                 root[attribute].value = value
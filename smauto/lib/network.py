@@ -0,0 +1,218 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+
+from smauto.lib.condition import OPERATORS
+
+
+def operator_function(operator):
+    """
+    Returns a function applying an operator of OPERATORS to Python values,
+    so that the network computes exactly what the compiled conditions do.
+    """
+    return eval(f"lambda left, right: {OPERATORS[operator]('left', 'right')}")
+
+
+# Functions of the comparison and logical operators, by operator
+OPERATOR_FUNCTIONS = {
+    operator: operator_function(operator)
+    for operator in OPERATORS.keys()
+    if operator != "InRange"
+}
+
+
+class NetworkNode(ABC):
+    """
+    A node of the condition network holding the current truth value of a
+    condition (sub)tree. When its truth value flips, the flip is propagated
+    to its successors.
+    """
+
+    def __init__(self):
+        self.truth = False
+        self.successors = []
+
+    @abstractmethod
+    def compute(self):
+        """Returns the truth value of the node from its inputs."""
+
+    def refresh(self):
+        truth = self.compute()
+        if truth != self.truth:
+            self.truth = truth
+            for node in self.successors:
+                node.refresh()
+
+
+class ThresholdNode(NetworkNode):
+    """Comparison of a numeric attribute against a constant."""
+
+    def __init__(self, attribute, operator, threshold):
+        super().__init__()
+        self.attribute = attribute
+        self.operator = operator
+        self.threshold = threshold
+        self.func = OPERATOR_FUNCTIONS[operator]
+        self.truth = self.compute()
+
+    def compute(self):
+        try:
+            return bool(self.func(self.attribute.value, self.threshold))
+        except TypeError:
+            # Not a number, e.g. None
+            return False
+
+
+class RangeNode(NetworkNode):
+    """Range check of a numeric attribute against two constants."""
+
+    def __init__(self, attribute, min, max):
+        super().__init__()
+        self.attribute = attribute
+        self.min = min
+        self.max = max
+        self.truth = self.compute()
+
+    def compute(self):
+        try:
+            return self.min < self.attribute.value < self.max
+        except TypeError:
+            return False
+
+
+class GroupNode(NetworkNode):
+    """Logical operation of a ConditionGroup over two network nodes."""
+
+    def __init__(self, operator, left, right):
+        super().__init__()
+        self.operator = operator
+        self.func = OPERATOR_FUNCTIONS[operator]
+        self.left = left
+        self.right = right
+        left.successors.append(self)
+        right.successors.append(self)
+        self.truth = self.compute()
+
+    def compute(self):
+        return bool(self.func(self.left.truth, self.right.truth))
+
+
+class ThresholdIndex(object):
+    """
+    Constants compared against one numeric attribute, kept sorted together
+    with the nodes comparing against them. When the attribute changes from
+    old to new, only nodes with a threshold in [old, new] can flip, and
+    they are found by bisection.
+    """
+
+    def __init__(self, attribute):
+        self.attribute = attribute
+        self.thresholds = []
+        self.nodes = []
+        # Nodes shared by all conditions using the same comparison
+        self.shared = {}
+
+    def insert(self, threshold, node):
+        index = bisect_right(self.thresholds, threshold)
+        self.thresholds.insert(index, threshold)
+        self.nodes.insert(index, node)
+
+    def threshold_node(self, operator, threshold):
+        key = (operator, threshold)
+        if key not in self.shared:
+            node = ThresholdNode(self.attribute, operator, threshold)
+            self.insert(threshold, node)
+            self.shared[key] = node
+        return self.shared[key]
+
+    def range_node(self, min, max):
+        key = ("InRange", min, max)
+        if key not in self.shared:
+            node = RangeNode(self.attribute, min, max)
+            self.insert(min, node)
+            self.insert(max, node)
+            self.shared[key] = node
+        return self.shared[key]
+
+    def update(self, old, new):
+        try:
+            low, high = (old, new) if old <= new else (new, old)
+        except TypeError:
+            # A value is not a number, any node may flip
+            for node in list(self.shared.values()):
+                node.refresh()
+            return
+        start = bisect_left(self.thresholds, low)
+        end = bisect_right(self.thresholds, high)
+        for node in self.nodes[start:end]:
+            node.refresh()
+
+
+class ConditionNetwork(object):
+    """
+    Per-model discrimination network of the conditions built only from
+    comparisons of numeric attributes against constants, combined with
+    logical operators. Their truth value is maintained on attribute updates
+    (see ThresholdIndex), so evaluating them only reads the root node.
+    """
+
+    def __init__(self):
+        self.roots = {}
+
+    @staticmethod
+    def of(model):
+        if getattr(model, "condition_network", None) is None:
+            model.condition_network = ConditionNetwork()
+        return model.condition_network
+
+    @staticmethod
+    def is_threshold(operand):
+        return operand.__class__.__name__ == "SimpleNumericAttr"
+
+    @staticmethod
+    def supports(cond):
+        """Whether a condition (sub)tree can be evaluated by the network."""
+        cls_name = cond.__class__.__name__
+        if cls_name == "ConditionGroup":
+            return ConditionNetwork.supports(cond.r1) and ConditionNetwork.supports(
+                cond.r2
+            )
+        elif cls_name == "InRangeCondition":
+            return ConditionNetwork.is_threshold(cond.attribute)
+        elif cls_name == "NumericCondition":
+            return ConditionNetwork.is_threshold(cond.operand1) and type(
+                cond.operand2
+            ) in (int, float)
+        return False
+
+    @staticmethod
+    def index(attribute):
+        entity = attribute.parent
+        if attribute.name not in entity.attr_index:
+            entity.attr_index[attribute.name] = ThresholdIndex(attribute)
+        return entity.attr_index[attribute.name]
+
+    def build_node(self, cond):
+        cls_name = cond.__class__.__name__
+        if cls_name == "ConditionGroup":
+            return GroupNode(
+                cond.operator, self.build_node(cond.r1), self.build_node(cond.r2)
+            )
+        elif cls_name == "InRangeCondition":
+            attribute = cond.attribute.attribute
+            return self.index(attribute).range_node(cond.min, cond.max)
+        attribute = cond.operand1.attribute
+        return self.index(attribute).threshold_node(cond.operator, cond.operand2)
+
+    def add(self, condition):
+        """
+        Adds the condition of an Automation to the network, if supported.
+        Returns the root node of the condition or None.
+        """
+        if condition.network_node is not None:
+            return condition.network_node
+        if not self.supports(condition):
+            return None
+        node = self.build_node(condition)
+        condition.network_node = node
+        self.roots[condition.parent.name] = node
+        return node
@@ -0,0 +1,352 @@
+import time
+from collections import deque
+from threading import Condition, Lock, Thread
+
+from rich import print
+
+from smauto.lib.profiler import Profiler, QueueMetrics
+
+
+class PublishQueue(object):
+    """
+    Bounded queue of the messages to publish via a Broker, drained in
+    batches by a worker thread, so that slow Brokers do not stall the
+    evaluation of the Automations.
+    ...
+
+    Attributes
+    ----------
+        publish: callable
+            Sends a message to an Entity, called as publish(entity, message)
+        capacity: int
+            Maximum number of queued messages
+        batch_size: int
+            Maximum number of messages the worker publishes per batch
+        interval: float
+            Seconds the worker waits for a full batch before publishing
+        overflow: str
+            What to do when the queue is full. 'block' waits for space,
+            'drop-oldest' drops the oldest message and 'coalesce-latest'
+            merges the message into the one queued for the same Entity,
+            waiting for space if there is none.
+        metrics: QueueMetrics
+            Depth, flush latency and drop statistics
+    """
+
+    OVERFLOW_POLICIES = ("block", "drop-oldest", "coalesce-latest")
+
+    def __init__(
+        self,
+        publish,
+        capacity=1024,
+        batch_size=32,
+        interval=0.0,
+        overflow="block",
+        metrics=None,
+    ):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy <{overflow}>")
+        self.publish = publish
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.interval = interval
+        self.overflow = overflow
+        self.metrics = metrics if metrics is not None else QueueMetrics("")
+        # Queued [entity, message, enqueued] items, and the latest item per
+        # Entity for the coalesce-latest policy
+        self.items = deque()
+        self.queued = {}
+        self.in_flight = 0
+        self.changed = Condition()
+        self.worker = None
+
+    def configure(self, capacity, batch_size, interval, overflow):
+        """
+        Changes the settings of the queue. Messages already queued are kept,
+        even past a lower capacity.
+        """
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy <{overflow}>")
+        with self.changed:
+            self.capacity = capacity
+            self.batch_size = batch_size
+            self.interval = interval
+            self.overflow = overflow
+            # Wake up the producers waiting for space and the worker
+            # waiting for a full batch
+            self.changed.notify_all()
+
+    def put(self, entity, message):
+        """Queues a message for an Entity, applying the overflow policy."""
+        with self.changed:
+            if self.overflow == "coalesce-latest" and entity in self.queued:
+                self.queued[entity][1].update(message)
+                self.metrics.coalesced += 1
+                return
+            while len(self.items) >= self.capacity:
+                if self.overflow == "drop-oldest":
+                    self.forget(self.items.popleft())
+                    self.metrics.dropped += 1
+                else:
+                    self.changed.wait()
+            item = [entity, dict(message), time.perf_counter_ns()]
+            self.items.append(item)
+            self.queued[entity] = item
+            self.metrics.record_depth(len(self.items))
+            self.changed.notify_all()
+            if self.worker is None:
+                self.worker = Thread(target=self.run, daemon=True)
+                self.worker.start()
+
+    def forget(self, item):
+        if self.queued.get(item[0]) is item:
+            del self.queued[item[0]]
+
+    def next_batch(self):
+        with self.changed:
+            while len(self.items) == 0:
+                self.changed.wait()
+            # Give the batch until the flush interval to fill up
+            deadline = time.monotonic() + self.interval
+            while len(self.items) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.changed.wait(remaining)
+            batch = []
+            while len(self.items) > 0 and len(batch) < self.batch_size:
+                item = self.items.popleft()
+                self.forget(item)
+                batch.append(item)
+            self.metrics.record_depth(len(self.items))
+            self.in_flight = len(batch)
+            self.changed.notify_all()
+            return batch
+
+    def run(self):
+        while True:
+            for entity, message, enqueued in self.next_batch():
+                try:
+                    self.publish(entity, message)
+                except Exception as e:
+                    print(f"[ERROR] Publishing to {entity.name} failed: {e}")
+                self.metrics.record_flush(enqueued)
+            with self.changed:
+                self.in_flight = 0
+                self.changed.notify_all()
+
+    def drain(self, timeout=None):
+        """
+        Waits until every queued message is published. Returns False if
+        the timeout expired first.
+        """
+        with self.changed:
+            return self.changed.wait_for(
+                lambda: len(self.items) == 0 and self.in_flight == 0, timeout
+            )
+
+
+class ActionOutbox(object):
+    """
+    Executor-level outbox of the messages sent by Automation actions.
+    Messages for the same Entity put within a coalescing window are merged
+    and handed as one message to the PublishQueue of the Entity's Broker
+    when the window closes. A window of 0 coalesces the actions of a single
+    scheduler iteration.
+    ...
+
+    Attributes
+    ----------
+        window: float
+            Coalescing window in seconds, opened by the first message for an
+            Entity
+        policy: str
+            Resolution of conflicting values for the same attribute within a
+            window. 'last' keeps the latest value, 'first' the earliest
+        pending: dict
+            Merged message per Entity, as {attribute: (value, automation)}
+        opened: dict
+            Time each Entity's window was opened
+        conflicts: int
+            Number of conflicting values resolved so far
+        attr_conflicts: dict
+            Number of conflicting values per 'entity.attribute'
+        queues: dict
+            PublishQueue per Broker, which the merged messages are handed to
+    """
+
+    POLICIES = ("last", "first")
+
+    def __init__(
+        self,
+        window=0.0,
+        policy="last",
+        capacity=1024,
+        batch_size=32,
+        interval=0.0,
+        overflow="block",
+        profiler=None,
+        clock=time.monotonic,
+    ):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown conflict policy <{policy}>")
+        if overflow not in PublishQueue.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy <{overflow}>")
+        self.window = window
+        self.policy = policy
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.interval = interval
+        self.overflow = overflow
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.clock = clock
+        self.pending = {}
+        self.opened = {}
+        self.conflicts = 0
+        self.attr_conflicts = {}
+        self.queues = {}
+        self.lock = Lock()
+
+    @staticmethod
+    def settings(model):
+        """Returns the ActionOutbox arguments configured by the model's Outbox."""
+        config = getattr(model, "outbox", None)
+        settings = {
+            "window": 0.0,
+            "policy": "last",
+            "capacity": 1024,
+            "batch_size": 32,
+            "interval": 0.0,
+            "overflow": "block",
+        }
+        if config is None:
+            return settings
+        if config.window is not None:
+            settings["window"] = config.window.to_seconds()
+        if config.interval is not None:
+            settings["interval"] = config.interval.to_seconds()
+        for name, attr in (
+            ("policy", "policy"),
+            ("capacity", "capacity"),
+            ("batch_size", "batch"),
+            ("overflow", "overflow"),
+        ):
+            if getattr(config, attr) is not None:
+                settings[name] = getattr(config, attr)
+        return settings
+
+    def configure(self, window, policy, capacity, batch_size, interval, overflow):
+        """
+        Changes the settings of the outbox and of its PublishQueues, e.g.
+        to those of a reloaded model, see settings().
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown conflict policy <{policy}>")
+        if overflow not in PublishQueue.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy <{overflow}>")
+        with self.lock:
+            self.window = window
+            self.policy = policy
+            self.capacity = capacity
+            self.batch_size = batch_size
+            self.interval = interval
+            self.overflow = overflow
+            queues = list(self.queues.values())
+        for queue in queues:
+            queue.configure(capacity, batch_size, interval, overflow)
+
+    @staticmethod
+    def of(model):
+        if getattr(model, "action_outbox", None) is None:
+            model.action_outbox = ActionOutbox(
+                profiler=Profiler.of(model), **ActionOutbox.settings(model)
+            )
+        return model.action_outbox
+
+    def put(self, entity, message, source=None):
+        """
+        Adds the message of an Automation (source) for an Entity to the
+        Entity's pending message.
+        """
+        with self.lock:
+            if entity not in self.pending:
+                self.pending[entity] = {}
+                self.opened[entity] = self.clock()
+            pending = self.pending[entity]
+            for attr_name, value in message.items():
+                if attr_name in pending and pending[attr_name][0] != value:
+                    self.conflict(entity, attr_name, pending[attr_name], value, source)
+                    if self.policy == "first":
+                        continue
+                pending[attr_name] = (value, source)
+
+    def conflict(self, entity, attr_name, pending, value, source):
+        """
+        Counts a conflicting value for an attribute. Only the first conflict
+        of each attribute is reported, as they may recur on every window.
+        """
+        self.conflicts += 1
+        key = f"{entity.name}.{attr_name}"
+        if key in self.attr_conflicts:
+            self.attr_conflicts[key] += 1
+            return
+        self.attr_conflicts[key] = 1
+        print(
+            f"[bold red][*] Conflicting actions on {key}: {pending[1]} sets "
+            f"{pending[0]}, {source} sets {value}. Keeping the {self.policy}. "
+            f"Further conflicts on {key} are only counted.[/bold red]"
+        )
+
+    def next_deadline(self):
+        """Returns the time the earliest window closes, or None."""
+        with self.lock:
+            if len(self.opened) == 0:
+                return None
+            return min(self.opened.values()) + self.window
+
+    def flush(self, now=None, force=False):
+        """
+        Publishes the merged messages of the Entities whose window has
+        closed, or of all Entities if force is set.
+        """
+        now = self.clock() if now is None else now
+        with self.lock:
+            entities = [
+                entity
+                for entity, opened in self.opened.items()
+                if force or opened + self.window <= now
+            ]
+            messages = []
+            for entity in entities:
+                pending = self.pending.pop(entity)
+                del self.opened[entity]
+                messages.append(
+                    (entity, {name: value for name, (value, _) in pending.items()})
+                )
+        for entity, message in messages:
+            self.publish(entity, message)
+
+    def publish(self, entity, message):
+        """Hands a merged message to the PublishQueue of the Entity's Broker."""
+        broker = self.broker_name(entity)
+        if broker not in self.queues:
+            self.queues[broker] = PublishQueue(
+                self.send,
+                capacity=self.capacity,
+                batch_size=self.batch_size,
+                interval=self.interval,
+                overflow=self.overflow,
+                metrics=self.profiler.queue(broker),
+            )
+        self.queues[broker].put(entity, message)
+
+    def broker_name(self, entity):
+        """Returns the name of the Broker an Entity is connected to."""
+        return entity.broker.name
+
+    def send(self, entity, message):
+        entity.publisher.publish(message)
+
+    def drain(self, timeout=None):
+        """Waits until the messages of every PublishQueue are published."""
+        return all(queue.drain(timeout) for queue in list(self.queues.values()))
@@ -0,0 +1,372 @@
+import json
+import time
+from threading import Lock
+
+from rich import print
+from rich.table import Table
+
+# Linear sub-buckets per power of two of the histograms, bounding the
+# relative error of the recorded values to 1 / SUB_BUCKETS
+SUB_BUCKETS = 16
+
+
+class LatencyHistogram(object):
+    """
+    HDR-style histogram of latencies in nanoseconds. Values are counted in
+    logarithmic buckets, each power of two split into SUB_BUCKETS linear
+    sub-buckets, so recording is O(1) and memory does not depend on the
+    number of samples, while percentiles keep a bounded relative error.
+    ...
+
+    Attributes
+    ----------
+        counts: dict
+            Number of values recorded per bucket index
+        count: int
+            Number of values recorded
+        total: int
+            Sum of the values recorded
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def bucket_index(value):
+        if value < SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - SUB_BUCKETS.bit_length()
+        return SUB_BUCKETS * (shift + 1) + (value >> shift) - SUB_BUCKETS
+
+    @staticmethod
+    def bucket_bounds(index):
+        """Returns the [low, high) range of values of a bucket."""
+        if index < SUB_BUCKETS:
+            return index, index + 1
+        shift = index // SUB_BUCKETS - 1
+        low = (SUB_BUCKETS + index % SUB_BUCKETS) << shift
+        return low, low + (1 << shift)
+
+    def record(self, value):
+        value = max(int(value), 0)
+        index = self.bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count > 0 else 0
+
+    def percentile(self, p):
+        """Returns the value below which p percent of the values fall."""
+        if self.count == 0:
+            return 0
+        rank = p / 100 * self.count
+        seen = 0
+        for index in sorted(self.counts.keys()):
+            seen += self.counts[index]
+            if seen >= rank:
+                low, high = self.bucket_bounds(index)
+                return min((low + high - 1) // 2, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "counts": self.counts,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @staticmethod
+    def from_dict(data):
+        hist = LatencyHistogram()
+        hist.counts = {int(index): n for index, n in data["counts"].items()}
+        hist.count = data["count"]
+        hist.total = data["total"]
+        hist.min = data["min"]
+        hist.max = data["max"]
+        return hist
+
+
+class AutomationProfile(object):
+    """
+    Evaluation and action statistics of an Automation.
+    ...
+
+    Attributes
+    ----------
+        evaluation: LatencyHistogram
+            Condition evaluation times
+        publish: LatencyHistogram
+            Times to publish the messages of the actions
+        evaluations: int
+            Number of condition evaluations
+        true_count: int
+            Number of evaluations the condition held
+        triggers: int
+            Number of times the actions ran
+        overruns: int
+            Number of polls that ended after the next poll was due
+        skipped: int
+            Number of polls dropped after overruns
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.evaluation = LatencyHistogram()
+        self.publish = LatencyHistogram()
+        self.evaluations = 0
+        self.true_count = 0
+        self.triggers = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.lock = Lock()
+
+    @property
+    def true_ratio(self):
+        return self.true_count / self.evaluations if self.evaluations > 0 else 0
+
+    def record_evaluation(self, started, result):
+        """Records an evaluation started at perf_counter_ns() started."""
+        elapsed = time.perf_counter_ns() - started
+        with self.lock:
+            self.evaluation.record(elapsed)
+            self.evaluations += 1
+            self.true_count += bool(result)
+
+    def record_trigger(self, started):
+        """Records the actions run started at perf_counter_ns() started."""
+        elapsed = time.perf_counter_ns() - started
+        with self.lock:
+            self.publish.record(elapsed)
+            self.triggers += 1
+
+    def record_timer(self, timer):
+        """Records the overrun statistics of a PeriodicTimer."""
+        with self.lock:
+            self.overruns = timer.overruns
+            self.skipped = timer.skipped
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "name": self.name,
+                "evaluation": self.evaluation.to_dict(),
+                "publish": self.publish.to_dict(),
+                "evaluations": self.evaluations,
+                "true_count": self.true_count,
+                "triggers": self.triggers,
+                "overruns": self.overruns,
+                "skipped": self.skipped,
+            }
+
+    @staticmethod
+    def from_dict(data):
+        profile = AutomationProfile(data["name"])
+        profile.evaluation = LatencyHistogram.from_dict(data["evaluation"])
+        profile.publish = LatencyHistogram.from_dict(data["publish"])
+        profile.evaluations = data["evaluations"]
+        profile.true_count = data["true_count"]
+        profile.triggers = data["triggers"]
+        profile.overruns = data.get("overruns", 0)
+        profile.skipped = data.get("skipped", 0)
+        return profile
+
+
+class QueueMetrics(object):
+    """
+    Statistics of the publish queue of a Broker.
+    ...
+
+    Attributes
+    ----------
+        depth: int
+            Number of messages queued, as of the last enqueue or dequeue
+        max_depth: int
+            Highest number of messages queued
+        latency: LatencyHistogram
+            Times from enqueuing a message to having published it
+        published: int
+            Number of messages published
+        dropped: int
+            Number of messages dropped by the drop-oldest policy
+        coalesced: int
+            Number of messages merged into a queued one by the
+            coalesce-latest policy
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.depth = 0
+        self.max_depth = 0
+        self.latency = LatencyHistogram()
+        self.published = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.lock = Lock()
+
+    def record_depth(self, depth):
+        with self.lock:
+            self.depth = depth
+            self.max_depth = max(self.max_depth, depth)
+
+    def record_flush(self, enqueued):
+        """Records a message enqueued at perf_counter_ns() enqueued."""
+        elapsed = time.perf_counter_ns() - enqueued
+        with self.lock:
+            self.latency.record(elapsed)
+            self.published += 1
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "name": self.name,
+                "depth": self.depth,
+                "max_depth": self.max_depth,
+                "latency": self.latency.to_dict(),
+                "published": self.published,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+            }
+
+    @staticmethod
+    def from_dict(data):
+        metrics = QueueMetrics(data["name"])
+        metrics.depth = data["depth"]
+        metrics.max_depth = data["max_depth"]
+        metrics.latency = LatencyHistogram.from_dict(data["latency"])
+        metrics.published = data["published"]
+        metrics.dropped = data["dropped"]
+        metrics.coalesced = data["coalesced"]
+        return metrics
+
+
+class Profiler(object):
+    """
+    Per-model collection of the AutomationProfiles and of the QueueMetrics
+    of the publish queues, which can be dumped to a JSON file and
+    summarized, e.g. with `smauto profile <file>`.
+    """
+
+    def __init__(self):
+        self.profiles = {}
+        self.queues = {}
+
+    @staticmethod
+    def of(model):
+        if getattr(model, "profiler", None) is None:
+            model.profiler = Profiler()
+        return model.profiler
+
+    def profile(self, name):
+        """Returns the AutomationProfile of an Automation, by name."""
+        if name not in self.profiles:
+            self.profiles[name] = AutomationProfile(name)
+        return self.profiles[name]
+
+    def queue(self, name):
+        """Returns the QueueMetrics of a Broker's publish queue, by name."""
+        if name not in self.queues:
+            self.queues[name] = QueueMetrics(name)
+        return self.queues[name]
+
+    def summary(self):
+        """
+        Returns a row of statistics per Automation, the ones spending the
+        most time evaluating their condition first. Times are in
+        microseconds.
+        """
+        rows = []
+        for profile in self.profiles.values():
+            evaluation = profile.evaluation
+            rows.append(
+                {
+                    "name": profile.name,
+                    "evaluations": profile.evaluations,
+                    "triggers": profile.triggers,
+                    "true_ratio": profile.true_ratio,
+                    "eval_total": evaluation.total / 1e3,
+                    "eval_mean": evaluation.mean / 1e3,
+                    "eval_p50": evaluation.percentile(50) / 1e3,
+                    "eval_p99": evaluation.percentile(99) / 1e3,
+                    "eval_max": (evaluation.max or 0) / 1e3,
+                    "publish_mean": profile.publish.mean / 1e3,
+                    "publish_p99": profile.publish.percentile(99) / 1e3,
+                    "overruns": profile.overruns,
+                    "skipped": profile.skipped,
+                }
+            )
+        return sorted(rows, key=lambda row: row["eval_total"], reverse=True)
+
+    def queue_summary(self):
+        """Returns a row of statistics per publish queue, in microseconds."""
+        rows = []
+        for metrics in self.queues.values():
+            rows.append(
+                {
+                    "broker": metrics.name,
+                    "published": metrics.published,
+                    "dropped": metrics.dropped,
+                    "coalesced": metrics.coalesced,
+                    "depth": metrics.depth,
+                    "max_depth": metrics.max_depth,
+                    "flush_mean": metrics.latency.mean / 1e3,
+                    "flush_p99": metrics.latency.percentile(99) / 1e3,
+                    "flush_max": (metrics.latency.max or 0) / 1e3,
+                }
+            )
+        return rows
+
+    def print_summary(self):
+        if len(self.profiles) > 0:
+            self.print_table("Automation profile (times in us)", self.summary())
+        if len(self.queues) > 0:
+            self.print_table("Publish queues (times in us)", self.queue_summary())
+
+    @staticmethod
+    def print_table(title, rows):
+        table = Table(title=title)
+        columns = list(rows[0].keys())
+        for column in columns:
+            table.add_column(
+                column, justify="left" if column == columns[0] else "right"
+            )
+        for row in rows:
+            cells = []
+            for column in columns:
+                value = row[column]
+                cells.append(f"{value:.2f}" if isinstance(value, float) else str(value))
+            table.add_row(*cells)
+        print(table)
+
+    def dump(self, path):
+        with open(path, "w") as fp:
+            json.dump(
+                {
+                    "automations": [
+                        profile.to_dict() for profile in self.profiles.values()
+                    ],
+                    "queues": [metrics.to_dict() for metrics in self.queues.values()],
+                },
+                fp,
+            )
+
+    @staticmethod
+    def load(path):
+        profiler = Profiler()
+        with open(path, "r") as fp:
+            data = json.load(fp)
+        for profile in data["automations"]:
+            profiler.profiles[profile["name"]] = AutomationProfile.from_dict(profile)
+        for metrics in data["queues"]:
+            profiler.queues[metrics["name"]] = QueueMetrics.from_dict(metrics)
+        return profiler
@@ -0,0 +1,312 @@
+import os
+import threading
+import time
+from contextlib import ExitStack
+
+from rich import print
+from textx import get_model
+
+from smauto.lib.condition import PRIMITIVES, Condition
+from smauto.lib.entity import Attribute
+from smauto.lib.outbox import ActionOutbox
+from smauto.lib.profiler import Profiler
+from smauto.lib.scheduler import AutomationScheduler
+from smauto.lib.timer import TimeScheduler
+
+
+def source_text(obj):
+    """Returns the model source of a textX object, whitespace normalized."""
+    model = get_model(obj)
+    text = model._tx_parser.input[obj._tx_position : obj._tx_position_end]
+    return " ".join(text.split())
+
+
+def entity_signature(entity):
+    """
+    Returns what an Entity's connections and state depend on. Entities
+    with the same signature are kept by a reload.
+    """
+    return (
+        entity.etype,
+        entity.topic,
+        entity.freq,
+        source_text(entity.broker),
+        tuple(
+            (
+                attr.__class__.__name__,
+                attr.name,
+                tuple(item.name for item in getattr(attr, "items", None) or []),
+            )
+            for attr in entity.attributes
+        ),
+    )
+
+
+def automation_signature(automation):
+    return source_text(automation)
+
+
+def model_entities(model):
+    """
+    Returns the Entities of a model, including those of imported models
+    that its Automations reference, e.g. the system_clock.
+    """
+    entities = list(model.entities)
+    for automation in model.automations:
+        attrs = Condition.collect_attributes(automation.condition)
+        attrs += [action.attribute for action in automation.actions]
+        for attr in attrs:
+            if attr.parent not in entities:
+                entities.append(attr.parent)
+    return entities
+
+
+class ModelDiff(object):
+    """
+    Differences between two versions of a model, by Entity and Automation
+    name.
+    ...
+
+    Attributes
+    ----------
+        entities: dict
+            Names of the 'added', 'removed', 'changed' and 'unchanged'
+            Entities
+        automations: dict
+            Names of the 'added', 'removed', 'changed' and 'unchanged'
+            Automations
+    """
+
+    def __init__(self, old_model, new_model):
+        self.entities = self.compare(
+            model_entities(old_model), model_entities(new_model), entity_signature
+        )
+        self.automations = self.compare(
+            old_model.automations, new_model.automations, automation_signature
+        )
+
+    @staticmethod
+    def compare(old_items, new_items, signature):
+        old = {item.name: signature(item) for item in old_items}
+        new = {item.name: signature(item) for item in new_items}
+        return {
+            "added": [name for name in new.keys() if name not in old],
+            "removed": [name for name in old.keys() if name not in new],
+            "changed": [
+                name for name in new.keys() if name in old and old[name] != new[name]
+            ],
+            "unchanged": [
+                name for name in new.keys() if name in old and old[name] == new[name]
+            ],
+        }
+
+    def print(self):
+        for kind, diff in (
+            ("Entities", self.entities),
+            ("Automations", self.automations),
+        ):
+            for change in ("added", "removed", "changed"):
+                if len(diff[change]) > 0:
+                    print(
+                        f"[bold yellow][*] {kind} {change}: "
+                        f"{', '.join(diff[change])}[/bold yellow]"
+                    )
+
+
+class ModelReloader(object):
+    """
+    Swaps the model run by an AutomationScheduler for a new version of it,
+    without restarting the executor. Unchanged Entities are kept, with
+    their state, connections and attribute buffers, and the new model is
+    bound to them. The conditions of all Automations are rebuilt on the
+    kept Entities and the window aggregates are refilled from the kept
+    buffers. Unchanged Automations keep their runtime state and statistics,
+    changed and added ones start afresh.
+
+    Added and changed Entities are new objects. If given the owner of the
+    Broker connections, see ModelRunner, the reloader connects them before
+    swapping the model in and disconnects the removed and replaced ones
+    after. Updates of the kept Entities wait while their conditions are
+    rebuilt, see apply().
+    ...
+
+    Attributes
+    ----------
+        model: textX model
+            The model currently run
+        scheduler: AutomationScheduler
+            Scheduler running the model's Automations
+        model_path: str
+            Path of the model file, watched by watch()
+        connections: object
+            Connects and disconnects Entities to their Brokers, with
+            connect(entity) and disconnect(entity), and is told the model
+            swapped in with bind(model). None if the caller manages the
+            connections.
+    """
+
+    # Runtime state carried over to the unchanged Automations
+    KEPT_STATE = ("enabled", "state", "fired_at", "profile")
+
+    def __init__(self, model, scheduler=None, connections=None):
+        self.model = model
+        self.scheduler = (
+            scheduler if scheduler is not None else AutomationScheduler.of(model)
+        )
+        self.model_path = model._tx_filename
+        self.connections = connections
+        self.watcher = None
+
+    def reload(self, model_path=None):
+        """
+        Parses the model file, by default the current one, and swaps it in.
+        Returns the ModelDiff. If the new model is invalid, the running one
+        is kept and the error raised.
+        """
+        # Imported here, as the language module imports the lib classes
+        from smauto.language import build_model
+
+        model_path = self.model_path if model_path is None else model_path
+        new_model = build_model(model_path)
+        if self.connections is None:
+            diff = self.scheduler.call(lambda: self.apply(new_model))
+            self.model_path = model_path
+            return diff
+        old_entities = {entity.name: entity for entity in model_entities(self.model)}
+        new_entities = {entity.name: entity for entity in model_entities(new_model)}
+        diff = ModelDiff(self.model, new_model)
+        # Connect the new Entities first, so that they receive updates as
+        # soon as their Automations run
+        connected = []
+        try:
+            for name in diff.entities["added"] + diff.entities["changed"]:
+                self.connections.connect(new_entities[name])
+                connected.append(new_entities[name])
+            diff = self.scheduler.call(lambda: self.apply(new_model))
+        except Exception:
+            for entity in connected:
+                self.connections.disconnect(entity)
+            raise
+        self.connections.bind(new_model)
+        for name in diff.entities["removed"] + diff.entities["changed"]:
+            self.connections.disconnect(old_entities[name])
+        self.model_path = model_path
+        return diff
+
+    def apply(self, new_model):
+        """
+        Swaps in a parsed model. Meant to run on the scheduler's loop. The
+        update locks of the kept Entities are held until their windows are
+        refilled, so that no update is lost or reaches a half-built
+        condition.
+        """
+        old_model = self.model
+        diff = ModelDiff(old_model, new_model)
+        old_entities = model_entities(old_model)
+        kept = {
+            entity.name: entity
+            for entity in old_entities
+            if entity.name in diff.entities["unchanged"]
+        }
+        with ExitStack() as stack:
+            for name in sorted(kept):
+                stack.enter_context(kept[name].update_lock)
+            self.swap(new_model, diff, old_entities, kept)
+        self.model = new_model
+        diff.print()
+        return diff
+
+    def swap(self, new_model, diff, old_entities, kept):
+        """
+        Rebuilds the Automations of new_model on the kept Entities and
+        refills their windows, see apply().
+        """
+        old_model = self.model
+        for entity in model_entities(new_model):
+            if entity.name not in kept:
+                entity.clock = self.scheduler.clock
+        # Bind the new model to the kept Entities
+        new_model.entities = [
+            kept.get(entity.name, entity) for entity in new_model.entities
+        ]
+        for automation in new_model.automations:
+            self.rebind(automation.condition, kept)
+            for action in automation.actions:
+                self.rebind(action, kept)
+        buffers = {entity.name: entity.clear_automations() for entity in old_entities}
+        # Keep the executor-wide singletons, reset the per-condition ones
+        time_scheduler = TimeScheduler.of(old_model)
+        time_scheduler.clear()
+        new_model.time_scheduler = time_scheduler
+        new_model.automation_scheduler = self.scheduler
+        new_model.action_outbox = self.scheduler.outbox
+        new_model.profiler = Profiler.of(old_model)
+        self.scheduler.outbox.configure(**ActionOutbox.settings(new_model))
+
+        old_automations = {a.name: a for a in old_model.automations}
+        for automation in list(self.scheduler.automations):
+            self.scheduler.remove(automation)
+        for automation in new_model.automations:
+            old = old_automations.get(automation.name)
+            if automation.name in diff.automations["unchanged"]:
+                for name in self.KEPT_STATE:
+                    setattr(automation, name, getattr(old, name))
+                automation.condition.last_truth = old.condition.last_truth
+            new_model.profiler.profiles[automation.name] = automation.profile
+        for automation in new_model.automations:
+            unchanged = automation.name in diff.automations["unchanged"]
+            # Unchanged event-driven Automations wait for the next update,
+            # instead of running their actions again
+            delay = None if unchanged and automation.mode != "poll" else 0
+            self.scheduler.add(automation, delay)
+        for name, entity_buffers in buffers.items():
+            if name in kept:
+                kept[name].replay_buffers(entity_buffers)
+        for name in diff.automations["removed"]:
+            new_model.profiler.profiles.pop(name, None)
+
+    @staticmethod
+    def rebind(node, entities):
+        """
+        Points the Attribute references of a condition (sub)tree or an
+        Action to the Attributes of the kept Entities.
+        """
+        if isinstance(node, (list, tuple)):
+            for item in node:
+                ModelReloader.rebind(item, entities)
+            return
+        for ref in ("r1", "r2", "operand1", "operand2", "attribute", "op"):
+            child = getattr(node, ref, None)
+            if isinstance(child, Attribute):
+                entity = entities.get(child.parent.name)
+                if entity is not None:
+                    setattr(node, ref, entity.attributes_dict[child.name])
+            elif child is not None and type(child) not in PRIMITIVES:
+                ModelReloader.rebind(child, entities)
+
+    def watch(self, interval=1.0):
+        """
+        Reloads the model whenever its file is modified, checking every
+        interval seconds on a daemon thread. Invalid versions are reported
+        and skipped.
+        """
+
+        def run():
+            mtime = os.path.getmtime(self.model_path)
+            while True:
+                time.sleep(interval)
+                try:
+                    modified = os.path.getmtime(self.model_path)
+                except OSError:
+                    continue
+                if modified == mtime:
+                    continue
+                mtime = modified
+                try:
+                    self.reload()
+                except Exception as e:
+                    print(f"[ERROR] Reloading {self.model_path} failed: {e}")
+
+        self.watcher = threading.Thread(target=run, daemon=True)
+        self.watcher.start()
+        return self.watcher
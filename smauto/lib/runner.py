@@ -0,0 +1,203 @@
+import importlib
+import signal
+import threading
+
+from rich import print
+
+from smauto.lib.checkpoint import Checkpointer
+from smauto.lib.reload import ModelReloader, model_entities
+from smauto.lib.scheduler import AutomationScheduler
+
+# commlib transport of each Broker type
+BROKER_TRANSPORTS = {
+    "MQTTBroker": "mqtt",
+    "AMQPBroker": "amqp",
+    "RedisBroker": "redis",
+}
+
+
+def connection_params(broker):
+    """
+    Returns the commlib ConnectionParameters of a Broker. The transport is
+    imported on use, as its client library is only needed to connect.
+    """
+    broker_type = broker.__class__.__name__
+    if broker_type not in BROKER_TRANSPORTS:
+        raise ValueError(f"Unsupported Broker type <{broker_type}>")
+    transport = importlib.import_module(
+        f"commlib.transports.{BROKER_TRANSPORTS[broker_type]}"
+    )
+    params = {
+        "host": broker.host,
+        "port": broker.port,
+        "ssl": broker.ssl,
+        "username": broker.auth.username if broker.auth is not None else "",
+        "password": broker.auth.password if broker.auth is not None else "",
+    }
+    if broker_type == "AMQPBroker":
+        params["vhost"] = broker.vhost
+    elif broker_type == "RedisBroker":
+        params["db"] = broker.db
+    return transport.ConnectionParameters(**params)
+
+
+class ModelRunner(object):
+    """
+    Runs a model with the Python runtime. The runner owns the Broker
+    connections of the Entities: each Entity gets a commlib Node, with a
+    subscriber updating its state and a publisher for its actions. The
+    Automations run on the model's AutomationScheduler. If reloading is
+    enabled, a ModelReloader swaps in new versions of the model file and
+    the runner connects and disconnects the Entities they add, change and
+    remove. Built-in Entities, e.g. the system_clock, have no Broker
+    connection, as the executor drives them.
+
+    A runner can also run a single shard of the model, see partition().
+    Only the shard's Automations and the Entities they use are run and
+    connected, and the profile and checkpoint files are suffixed with the
+    name of its first Automation.
+    ...
+
+    Attributes
+    ----------
+        model: textX model
+            The model currently run
+        scheduler: AutomationScheduler
+            Scheduler running the model's Automations
+        reloader: ModelReloader
+            Reloads the model, with the runner managing the connections
+        nodes: dict
+            commlib Node of each connected Entity
+        checkpointer: Checkpointer
+            Checkpoints the runtime state, if the model configures it
+        connection_params: callable
+            Returns the commlib ConnectionParameters of a Broker
+        shard: dict
+            Partition of the model run, or None to run all of it
+    """
+
+    def __init__(
+        self,
+        model,
+        profile_path=None,
+        connection_params=connection_params,
+        shard=None,
+    ):
+        self.model = model
+        self.connection_params = connection_params
+        self.shard = shard
+        self.scheduler = AutomationScheduler.of(model)
+        self.scheduler.profile_path = self.shard_path(profile_path)
+        self.reloader = ModelReloader(model, self.scheduler, connections=self)
+        self.nodes = {}
+        self.checkpointer = None
+        self.lock = threading.Lock()
+
+    def shard_path(self, path):
+        """Returns the path of a file of the shard, e.g. its profile."""
+        if path is None or self.shard is None:
+            return path
+        return f"{path}.{self.shard['automations'][0]}"
+
+    def in_shard(self, kind, name):
+        return self.shard is None or name in self.shard[kind]
+
+    def automations(self, model=None):
+        """Returns the Automations of a model the runner runs."""
+        model = self.model if model is None else model
+        return [a for a in model.automations if self.in_shard("automations", a.name)]
+
+    def entities(self, model=None):
+        """Returns the Entities of a model that have Broker connections."""
+        model = self.model if model is None else model
+        return [
+            entity
+            for entity in model_entities(model)
+            if entity.parent is not None and self.in_shard("entities", entity.name)
+        ]
+
+    def connect(self, entity):
+        """Connects an Entity to its Broker, unless it is built-in."""
+        if entity.parent is None:
+            return
+        # Imported here, as only the runner needs commlib
+        from commlib.node import Node
+
+        node = Node(
+            node_name=entity.camel_name,
+            connection_params=self.connection_params(entity.broker),
+            heartbeats=False,
+        )
+        entity.subscriber = node.create_subscriber(
+            topic=entity.topic, on_message=entity.update_state
+        )
+        entity.publisher = node.create_publisher(topic=entity.topic)
+        entity.subscriber.run()
+        entity.publisher.run()
+        with self.lock:
+            self.nodes[entity] = node
+        print(f"[bold yellow][*] Connected Entity: {entity.name}[/bold yellow]")
+
+    def disconnect(self, entity):
+        """Closes the connections of an Entity."""
+        with self.lock:
+            node = self.nodes.pop(entity, None)
+        if node is None:
+            return
+        node.stop()
+        print(f"[bold yellow][*] Disconnected Entity: {entity.name}[/bold yellow]")
+
+    def bind(self, model):
+        """Runs a model swapped in by the reloader from now on."""
+        self.model = model
+        if self.checkpointer is not None:
+            with self.checkpointer.lock:
+                self.checkpointer.entities = {e.name: e for e in self.entities(model)}
+                self.checkpointer.automations = {
+                    a.name: a for a in self.automations(model)
+                }
+
+    def start_checkpoints(self):
+        settings = Checkpointer.settings(self.model)
+        if settings is None:
+            return
+        self.checkpointer = Checkpointer(
+            self.shard_path(settings.pop("path")),
+            self.entities(),
+            self.automations(),
+            **settings,
+        )
+        # Restore the runtime state before the Entities receive updates
+        self.checkpointer.restore()
+        self.checkpointer.start()
+
+    def run(self, reload=False, reload_interval=1.0):
+        """
+        Runs the model until the scheduler is stopped, e.g. by SIGINT or
+        SIGTERM, then closes the connections.
+        """
+        for automation in self.automations():
+            self.scheduler.add(automation)
+        self.start_checkpoints()
+        if reload:
+            self.reloader.watch(reload_interval)
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: self.scheduler.stop())
+        try:
+            for entity in self.entities():
+                self.connect(entity)
+            self.scheduler.run()
+        except KeyboardInterrupt:
+            print(
+                "[bold yellow][*] Keyboard interrupt detected. Exiting...[/bold yellow]"
+            )
+        finally:
+            if self.checkpointer is not None:
+                self.checkpointer.stop()
+            for entity in list(self.nodes.keys()):
+                self.disconnect(entity)
+        print("[bold magenta][*] All automations completed!![/bold magenta]")
+
+    def stop(self):
+        """Stops the runner. Safe to call from any thread."""
+        self.scheduler.stop()
@@ -0,0 +1,287 @@
+import asyncio
+import heapq
+import itertools
+import time
+from concurrent.futures import Future
+from threading import Lock, get_ident
+
+from rich import print
+
+from smauto.lib.outbox import ActionOutbox
+from smauto.lib.timer import PeriodicTimer
+from smauto.lib.vectorized import VectorizedEvaluator
+
+# Seconds to wait on stop for the queued action messages to be published
+DRAIN_TIMEOUT = 5
+
+
+class AutomationScheduler(object):
+    """
+    Runs the Automations of a model on a single asyncio event loop, instead
+    of a thread per Automation. Polled Automations are kept in a heap by
+    their next deadline. Event-driven Automations run when notified by the
+    Entities they read, which may happen from any thread, and Automations
+    waiting for their after dependencies when these finish. Errors raised
+    by a step are counted by the Automation and summarized on stop.
+    ...
+
+    Attributes
+    ----------
+        automations: list
+            Automations run by the scheduler
+        deadlines: list
+            Heap of (deadline, sequence number, Automation) entries. Entries
+            whose sequence number is no longer the Automation's
+            schedule_seq are stale and skipped.
+        ready: list
+            Automations notified since the last iteration of the loop
+        outbox: ActionOutbox
+            Coalesces the messages of the Automations' actions, flushed at
+            the end of each iteration of the loop
+        evaluator: VectorizedEvaluator
+            Evaluates the numeric conditions of the polled Automations due
+            in an iteration in one batch, see evaluate_batch()
+        profile_path: str
+            File the profile of the Automations and publish queues is
+            dumped to when the scheduler stops, see Profiler. None does not
+            dump it.
+    """
+
+    def __init__(self, clock=time.monotonic, outbox=None, profile_path=None):
+        self.clock = clock
+        self.outbox = outbox if outbox is not None else ActionOutbox(clock=clock)
+        self.profile_path = profile_path
+        self.automations = []
+        self.deadlines = []
+        self.counter = itertools.count()
+        self.ready = []
+        self.evaluator = VectorizedEvaluator()
+        self.lock = Lock()
+        self.loop = None
+        self.loop_thread = None
+        self.wakeup = None
+        self.stopped = False
+
+    @staticmethod
+    def of(model):
+        if getattr(model, "automation_scheduler", None) is None:
+            model.automation_scheduler = AutomationScheduler(
+                outbox=ActionOutbox.of(model)
+            )
+        return model.automation_scheduler
+
+    def add(self, automation, delay=0):
+        """
+        Builds an Automation and schedules its first evaluation after delay
+        seconds. If delay is None, it first runs when notified.
+        """
+        automation.scheduler = self
+        automation.clock = self.clock
+        automation.timer = PeriodicTimer(
+            1 / automation.freq, policy=automation.overrun, clock=self.clock
+        )
+        automation.build_condition()
+        if automation.mode == "poll":
+            self.evaluator.add(automation)
+        automation.print()
+        print(f"[bold yellow][*] Executing Automation: {automation.name}[/bold yellow]")
+        self.automations.append(automation)
+        if delay is not None:
+            self.schedule(automation, delay)
+
+    def remove(self, automation):
+        """Stops running an Automation. Its pending deadline becomes stale."""
+        with self.lock:
+            if automation in self.ready:
+                self.ready.remove(automation)
+            automation.notified = False
+        if automation in self.automations:
+            self.automations.remove(automation)
+        self.evaluator.remove(automation)
+        automation.schedule_seq = None
+        automation.scheduler = None
+        print(f"[bold yellow][*] Removed Automation: {automation.name}[/bold yellow]")
+
+    def call(self, func):
+        """
+        Calls func between two iterations of the loop and returns its
+        result, so that it can change the scheduled Automations. Safe to
+        call from any thread.
+        """
+        if self.loop is None or self.stopped or get_ident() == self.loop_thread:
+            return func()
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(func())
+            except Exception as e:
+                future.set_exception(e)
+
+        self.loop.call_soon_threadsafe(run)
+        return future.result()
+
+    def schedule(self, automation, delay):
+        seq = next(self.counter)
+        automation.schedule_seq = seq
+        automation.deadline = self.clock() + delay
+        heapq.heappush(self.deadlines, (automation.deadline, seq, automation))
+
+    def wake(self, automation):
+        """
+        Runs an event-driven Automation one poll period from now, unless it
+        is due sooner. Polled Automations already run every period.
+        """
+        if automation.mode == "poll":
+            return
+        delay = 1 / automation.freq
+        if (
+            automation.schedule_seq is not None
+            and automation.deadline <= self.clock() + delay
+        ):
+            return
+        self.schedule(automation, delay)
+
+    def notify(self, automation):
+        """
+        Marks an event-driven Automation ready to run. Safe to call from any
+        thread.
+        """
+        # Polled Automations are only notified when their after
+        # dependencies finish
+        if automation.mode == "poll" and not automation.waiting:
+            return
+        with self.lock:
+            if automation.notified:
+                return
+            automation.notified = True
+            self.ready.append(automation)
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def due(self):
+        """Pops the Automations whose deadline has passed or were notified."""
+        now = self.clock()
+        automations = []
+        while len(self.deadlines) > 0 and self.deadlines[0][0] <= now:
+            _, seq, automation = heapq.heappop(self.deadlines)
+            if seq == automation.schedule_seq:
+                automation.schedule_seq = None
+                automations.append(automation)
+        with self.lock:
+            for automation in self.ready:
+                automation.notified = False
+                if automation not in automations:
+                    automations.append(automation)
+            self.ready = []
+        return automations
+
+    def run_step(self, automation):
+        # Drop the pending deadline, if the Automation was notified earlier
+        automation.schedule_seq = None
+        try:
+            delay = automation.step()
+        except Exception as e:
+            # E.g. a message with a None value. Polled Automations keep
+            # running, event-driven ones wait for the next update.
+            self.report(automation, e)
+            delay = automation.timer.next_delay() if automation.mode == "poll" else None
+        if delay is not None:
+            self.schedule(automation, delay)
+
+    def report(self, automation, error):
+        """Reports an error raised by a step of an Automation."""
+        automation.report_error(error)
+
+    def report_errors(self):
+        """Prints the number of errors of each Automation per error type."""
+        for automation in self.automations:
+            for key, count in automation.errors.items():
+                print(
+                    f"[bold red][*] Automation {automation.name}: "
+                    f"{count} {key}[/bold red]"
+                )
+
+    def evaluate_batch(self, automations):
+        """
+        Evaluates the conditions of the given Automations supported by the
+        VectorizedEvaluator in one vectorized pass. Their next step() uses
+        the result instead of evaluating the condition on its own, and
+        profiles its share of the cost of the pass.
+        """
+        batch = [
+            automation
+            for automation in automations
+            if automation in self.evaluator.index
+        ]
+        if len(batch) == 0:
+            return
+        started = time.perf_counter_ns()
+        results = self.evaluator.evaluate(batch)
+        cost = (time.perf_counter_ns() - started) // len(batch)
+        for automation, result in zip(batch, results):
+            automation.batch_result = bool(result)
+            automation.batch_cost = cost
+
+    def run_once(self):
+        """Runs the due Automations and flushes the outbox."""
+        automations = self.due()
+        self.evaluate_batch(automations)
+        for automation in automations:
+            self.run_step(automation)
+        self.outbox.flush(self.clock())
+
+    def next_deadline(self):
+        """Returns the next time the scheduler has work to do, or None."""
+        if len(self.ready) > 0:
+            return self.clock()
+        deadlines = [self.outbox.next_deadline()]
+        if len(self.deadlines) > 0:
+            deadlines.append(self.deadlines[0][0])
+        deadlines = [d for d in deadlines if d is not None]
+        return min(deadlines) if len(deadlines) > 0 else None
+
+    def next_timeout(self):
+        deadline = self.next_deadline()
+        if deadline is None:
+            return None
+        return max(deadline - self.clock(), 0)
+
+    async def run_loop(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = get_ident()
+        self.wakeup = asyncio.Event()
+        while not self.stopped:
+            self.wakeup.clear()
+            self.run_once()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.next_timeout())
+            except asyncio.TimeoutError:
+                pass
+        # Publish the messages still pending on stop
+        self.outbox.flush(force=True)
+        self.outbox.drain(DRAIN_TIMEOUT)
+
+    def run(self):
+        """
+        Runs the Automations until stop() is called or the run is
+        interrupted, then dumps the profile.
+        """
+        try:
+            asyncio.run(self.run_loop())
+        finally:
+            self.report_errors()
+            self.dump_profile()
+
+    def dump_profile(self):
+        """Dumps the profile to profile_path, if set."""
+        if self.profile_path is None:
+            return
+        self.outbox.profiler.dump(self.profile_path)
+        print(f"[bold yellow][*] Profile: {self.profile_path}[/bold yellow]")
+
+    def stop(self):
+        """Stops the scheduler. Safe to call from any thread."""
+        self.stopped = True
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
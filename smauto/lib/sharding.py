@@ -0,0 +1,207 @@
+import heapq
+import multiprocessing
+import threading
+
+from rich import print
+
+from smauto.lib.runner import ModelRunner, connection_params
+
+SHARDING_MODES = ("components", "balanced")
+
+
+class UnionFind(object):
+    """Disjoint sets of hashable items, with path halving and union by size."""
+
+    def __init__(self):
+        self.parents = {}
+        self.sizes = {}
+
+    def find(self, item):
+        if item not in self.parents:
+            self.parents[item] = item
+            self.sizes[item] = 1
+        while self.parents[item] != item:
+            self.parents[item] = self.parents[self.parents[item]]
+            item = self.parents[item]
+        return item
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.sizes[a] < self.sizes[b]:
+            a, b = b, a
+        self.parents[b] = a
+        self.sizes[a] += self.sizes[b]
+
+
+def partition(graph, shards, mode="balanced"):
+    """
+    Splits the Automations of an automation-entity graph into at most
+    shards partitions. The graph maps each Automation name to a dict of the
+    Entities it reads and writes, the Automations it references with
+    after/starts/stops (peers) and its weight.
+
+    Automations referencing each other are always kept together, as are
+    the Automations writing the same Entity, so that the outbox can merge
+    their actions. In 'components' mode Automations reading the same
+    Entity are kept together too, so the partitions are the connected
+    components of the graph. In 'balanced' mode Entities that are only read
+    are fanned out to every partition reading them, which splits large
+    components. The groups are then assigned to the partitions largest
+    first, each to the least loaded one.
+
+    Returns a list of {"automations", "entities", "weight"} dicts, where
+    entities are all the Entities the partition's Automations read or
+    write.
+    """
+    if mode not in SHARDING_MODES:
+        raise ValueError(f"Unknown sharding mode <{mode}>")
+    sets = UnionFind()
+    for name, node in graph.items():
+        sets.find(("automation", name))
+        linked = list(node["writes"])
+        if mode == "components":
+            linked += node["reads"]
+        for entity in linked:
+            sets.union(("automation", name), ("entity", entity))
+        for peer in node["peers"]:
+            sets.union(("automation", name), ("automation", peer))
+    groups = {}
+    for name in graph.keys():
+        groups.setdefault(sets.find(("automation", name)), []).append(name)
+    groups = sorted(
+        groups.values(),
+        key=lambda names: sum(graph[name]["weight"] for name in names),
+        reverse=True,
+    )
+    # Min-heap of (load, index) of the partitions
+    loads = [(0, index) for index in range(max(min(shards, len(groups)), 1))]
+    partitions = [{"automations": [], "entities": [], "weight": 0} for _ in loads]
+    for names in groups:
+        load, index = heapq.heappop(loads)
+        part = partitions[index]
+        for name in names:
+            part["automations"].append(name)
+            part["weight"] += graph[name]["weight"]
+            for entity in graph[name]["reads"] + graph[name]["writes"]:
+                if entity not in part["entities"]:
+                    part["entities"].append(entity)
+        heapq.heappush(loads, (part["weight"], index))
+    return [part for part in partitions if len(part["automations"]) > 0]
+
+
+class ShardedExecutor(object):
+    """
+    Runs the Automations of a model in several worker processes, one per
+    partition of the automation-entity graph, to scale past the single
+    core a process is limited to by the GIL. Each worker runs its shard
+    with a ModelRunner, which connects the Entities the shard uses to their
+    Brokers, so the Brokers fan out the state updates of shared Entities.
+
+    Workers are forked, so that they inherit the model, which cannot be
+    pickled. They open their own connections after the fork, as sockets
+    inherited from the parent would be shared by the workers. The fork
+    start method is not available on Windows.
+    ...
+
+    Attributes
+    ----------
+        shards: list
+            Partitions, as returned by partition()
+        profile_path: str
+            File the workers dump their profile to, suffixed per shard
+        connection_params: callable
+            Returns the commlib ConnectionParameters of a Broker
+        stopped: Event
+            Set to stop the workers
+    """
+
+    def __init__(
+        self,
+        model,
+        shards,
+        mode="balanced",
+        profile_path=None,
+        connection_params=connection_params,
+    ):
+        self.model = model
+        self.shards = partition(self.graph(model), shards, mode)
+        self.profile_path = profile_path
+        self.connection_params = connection_params
+        self.context = multiprocessing.get_context("fork")
+        self.stopped = self.context.Event()
+        self.workers = []
+
+    @staticmethod
+    def graph(model):
+        """Builds the automation-entity graph of a model, see partition()."""
+        graph = {}
+        for automation in model.automations:
+            reads = []
+            for attr in automation.condition.collect_attributes(automation.condition):
+                if attr.parent.name not in reads:
+                    reads.append(attr.parent.name)
+            writes = []
+            for action in automation.actions:
+                if action.attribute.parent.name not in writes:
+                    writes.append(action.attribute.parent.name)
+            graph[automation.name] = {
+                "reads": reads,
+                "writes": writes,
+                "peers": [
+                    dep.name
+                    for dep in automation.after + automation.starts + automation.stops
+                ],
+                "weight": automation.condition.estimate_cost(),
+            }
+        return graph
+
+    def start(self):
+        """Starts a worker process per shard."""
+        self.stopped.clear()
+        for index, shard in enumerate(self.shards):
+            worker = self.context.Process(
+                target=self.run_shard, args=(shard,), daemon=True
+            )
+            self.workers.append(worker)
+            worker.start()
+            print(
+                f"[bold yellow][*] Started shard {index} with "
+                f"{len(shard['automations'])} Automations and "
+                f"{len(shard['entities'])} Entities[/bold yellow]"
+            )
+
+    def run_shard(self, shard):
+        """Runs the Automations of a shard, in its worker process."""
+        runner = ModelRunner(
+            self.model,
+            profile_path=self.profile_path,
+            connection_params=self.connection_params,
+            shard=shard,
+        )
+
+        def stop():
+            self.stopped.wait()
+            runner.stop()
+
+        threading.Thread(target=stop, daemon=True).start()
+        runner.run()
+
+    def run(self):
+        """Runs the workers until they exit, e.g. on Ctrl+C."""
+        self.start()
+        try:
+            self.join()
+        except KeyboardInterrupt:
+            # The workers are interrupted too, let them shut down
+            self.join()
+
+    def join(self, timeout=None):
+        for worker in self.workers:
+            worker.join(timeout)
+
+    def stop(self, timeout=None):
+        """Stops the workers, letting them publish their pending actions."""
+        self.stopped.set()
+        self.join(timeout)
@@ -0,0 +1,190 @@
+import heapq
+import itertools
+import json
+from datetime import datetime
+
+from smauto.lib.outbox import ActionOutbox
+from smauto.lib.scheduler import AutomationScheduler
+from smauto.lib.timer import TimeScheduler, wall_clock_seconds
+
+
+class VirtualClock(object):
+    """
+    Clock of a Simulation, which only moves when the Simulation advances
+    it. Its time is in wall-clock seconds from day 1, like
+    wall_clock_seconds(), so that it also drives the system_clock.
+    """
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class SimulatedOutbox(ActionOutbox):
+    """
+    ActionOutbox of a Simulation, which records the merged messages instead
+    of publishing them and delivers them back to their Entity, as the
+    Broker would.
+    """
+
+    def __init__(self, simulation, **kwargs):
+        super().__init__(**kwargs)
+        self.simulation = simulation
+
+    def publish(self, entity, message):
+        self.simulation.record(entity, message)
+
+
+class Simulation(object):
+    """
+    Runs the Automations of a model in virtual time, deterministically and
+    as fast as the CPU allows. Recorded or generated Entity messages are
+    fed through Entity.update_state() at their time, polled Automations
+    are evaluated at their logical frequency and the system_clock follows
+    the virtual clock. The messages sent by actions are recorded, so that
+    the runs of two versions of a model can be compared.
+    ...
+
+    Attributes
+    ----------
+        clock: VirtualClock
+            Virtual time, shared by the scheduler, the Entities and the
+            system_clock
+        start: float
+            Virtual time the simulation starts at
+        latency: float
+            Seconds it takes for an action message to reach its Entity
+        events: list
+            Heap of (time, sequence number, callback) entries
+        published: list
+            (seconds from start, Entity name, message) of each action message
+    """
+
+    def __init__(self, model, start=None, latency=0.001):
+        """
+        :param model: The SmAuto model
+        :param start: datetime the simulation starts at. Defaults to today's
+            midnight.
+        :param latency: Delay of the action messages delivered back to their
+            Entity. It keeps feedback loops between Automations from running
+            without advancing time.
+        """
+        if start is None:
+            start = datetime.combine(datetime.now().date(), datetime.min.time())
+        self.model = model
+        self.start = wall_clock_seconds(start)
+        self.clock = VirtualClock(self.start)
+        self.latency = latency
+        self.events = []
+        self.counter = itertools.count()
+        self.published = []
+        self.entities = {entity.name: entity for entity in model.entities}
+        for entity in model.entities:
+            entity.clock = self.clock
+        # Replace the model's time scheduler before the Automations register
+        # their time conditions
+        model.time_scheduler = TimeScheduler(clock=self.clock, threaded=False)
+        self.time_scheduler = model.time_scheduler
+        outbox = SimulatedOutbox(self, clock=self.clock, **ActionOutbox.settings(model))
+        self.scheduler = AutomationScheduler(clock=self.clock, outbox=outbox)
+        for automation in model.automations:
+            self.scheduler.add(automation)
+        for attr in self.time_scheduler.clock_attrs:
+            attr.parent.clock = self.clock
+
+    @property
+    def elapsed(self):
+        """Seconds of virtual time since the start."""
+        return self.clock() - self.start
+
+    def schedule(self, offset, callback):
+        """Calls callback() offset seconds after the start."""
+        heapq.heappush(self.events, (self.start + offset, next(self.counter), callback))
+
+    def add_message(self, offset, entity_name, message):
+        """Feeds a message to an Entity offset seconds after the start."""
+        entity = self.entities[entity_name]
+        self.schedule(offset, lambda: entity.update_state(message))
+
+    def add_messages(self, messages):
+        """Feeds (offset, Entity name, message) entries, see add_message()."""
+        for offset, entity_name, message in messages:
+            self.add_message(offset, entity_name, message)
+
+    def add_generator(self, entity_name, freq, generate, until=None):
+        """
+        Feeds generate(offset) to an Entity freq times per second, from the
+        start until offset until, if set.
+        """
+        entity = self.entities[entity_name]
+        period = 1 / freq
+
+        def tick(offset):
+            entity.update_state(generate(offset))
+            if until is None or offset + period <= until:
+                self.schedule(offset + period, lambda: tick(offset + period))
+
+        self.schedule(0, lambda: tick(0))
+
+    def load(self, path):
+        """
+        Feeds the messages of a JSON lines recording, with one
+        {"time", "entity", "message"} object per line. Times are seconds
+        from the start.
+        """
+        with open(path, "r") as fp:
+            for line in fp:
+                if line.strip() == "":
+                    continue
+                data = json.loads(line)
+                self.add_message(data["time"], data["entity"], data["message"])
+
+    def record(self, entity, message):
+        self.published.append((self.elapsed, entity.name, message))
+        self.schedule(self.elapsed + self.latency, lambda: entity.update_state(message))
+
+    def dump(self, path):
+        """Writes the action messages, in the format read by load()."""
+        with open(path, "w") as fp:
+            for offset, entity_name, message in self.published:
+                fp.write(
+                    json.dumps(
+                        {"time": offset, "entity": entity_name, "message": message}
+                    )
+                    + "\n"
+                )
+
+    def next_time(self):
+        times = [
+            self.scheduler.next_deadline(),
+            self.time_scheduler.next_expiry(),
+        ]
+        if len(self.events) > 0:
+            times.append(self.events[0][0])
+        times = [t for t in times if t is not None]
+        return min(times) if len(times) > 0 else None
+
+    def run(self, duration):
+        """
+        Runs the simulation until duration seconds after the start, jumping
+        from one event or deadline to the next. Returns the action messages
+        published so far.
+        """
+        end = self.start + duration
+        while True:
+            now = self.next_time()
+            if now is None or now > end:
+                break
+            self.clock.now = max(now, self.clock.now)
+            while len(self.events) > 0 and self.events[0][0] <= self.clock.now:
+                _, _, callback = heapq.heappop(self.events)
+                callback()
+            self.time_scheduler.advance()
+            self.scheduler.run_once()
+        self.clock.now = max(end, self.clock.now)
+        self.time_scheduler.advance()
+        self.scheduler.run_once()
+        self.scheduler.outbox.flush(force=True)
+        return self.published
@@ -0,0 +1,330 @@
+import time
+from datetime import datetime
+from threading import Event, Lock, Thread
+
+# Seconds in a day
+DAY = 86400
+
+
+def wall_clock_seconds(now=None):
+    """
+    Returns the local wall-clock time, or the time of a datetime, in
+    seconds counted from day 1.
+    """
+    now = datetime.now() if now is None else now
+    return (
+        now.toordinal() * DAY
+        + now.hour * 3600
+        + now.minute * 60
+        + now.second
+        + now.microsecond / 1e6
+    )
+
+
+class PeriodicTimer(object):
+    """
+    Paces a periodic loop on deadlines of a monotonic clock, so that the
+    period does not drift by the time the loop body takes and is not
+    affected by wall-clock jumps. Deadlines are k * period after the start.
+    When the body overruns a deadline, the 'skip' policy drops the missed
+    ticks and waits for the next deadline, while 'catch-up' runs the
+    missed ticks back to back.
+    ...
+
+    Attributes
+    ----------
+        period: float
+            Seconds between ticks
+        deadline: float
+            Time of the next tick
+        ticks: int
+            Number of ticks run
+        overruns: int
+            Number of ticks that ended after the next deadline
+        skipped: int
+            Number of ticks dropped by the skip policy
+        max_lag: float
+            Longest time a tick ended after the next deadline
+    """
+
+    POLICIES = ("skip", "catch-up")
+
+    def __init__(self, period, policy="skip", clock=time.monotonic):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown overrun policy <{policy}>")
+        self.period = period
+        self.policy = policy
+        self.clock = clock
+        self.deadline = None
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.max_lag = 0.0
+
+    def next_delay(self):
+        """
+        Ends the current tick and returns the seconds until the next one.
+        The first call starts the timer.
+        """
+        now = self.clock()
+        if self.deadline is None:
+            self.deadline = now
+        self.ticks += 1
+        self.deadline += self.period
+        lag = now - self.deadline
+        if lag > 0:
+            self.overruns += 1
+            self.max_lag = max(self.max_lag, lag)
+            if self.policy == "skip":
+                missed = int(lag // self.period) + 1
+                self.skipped += missed
+                self.deadline += missed * self.period
+        return max(self.deadline - now, 0)
+
+    def reset(self):
+        """Restarts the timer at the next call of next_delay()."""
+        self.deadline = None
+
+    def sleep(self):
+        """Ends the current tick and sleeps until the next one."""
+        time.sleep(self.next_delay())
+
+    def stats(self):
+        return {
+            "period": self.period,
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "max_lag": self.max_lag,
+        }
+
+    def summary(self):
+        """Returns the overrun statistics as a line for shutdown reports."""
+        return (
+            f"{self.ticks} ticks, {self.overruns} overruns, "
+            f"{self.skipped} skipped, max lag {self.max_lag * 1e3:.2f}ms"
+        )
+
+
+class Timer(object):
+    def __init__(self, deadline, callback, period=None):
+        """
+        Creates and returns a Timer object
+        :param deadline: Absolute expiration time in seconds
+        :param callback: Called with the Timer when it expires
+        :param period: If set, the Timer is re-armed period seconds after
+            each expiration
+        """
+        self.deadline = deadline
+        self.callback = callback
+        self.period = period
+
+
+class TimerWheel(object):
+    """
+    Hierarchical timing wheel with a resolution of one second. Timers due
+    within a minute are kept in per-second slots, within an hour in
+    per-minute slots and within a day in per-hour slots. Higher level slots
+    are cascaded to the lower levels as time advances, and later timers wait
+    in an overflow list until the next day starts.
+    ...
+
+    Attributes
+    ----------
+        now: int
+            Current time of the wheel, in seconds
+        levels: list
+            The seconds, minutes and hours wheels
+    """
+
+    # (number of slots, seconds per slot) of each level
+    LEVELS = ((60, 1), (60, 60), (24, 3600))
+
+    def __init__(self, now):
+        self.now = now
+        self.levels = [[[] for _ in range(slots)] for slots, _ in self.LEVELS]
+        self.overflow = []
+
+    def add(self, timer):
+        delta = timer.deadline - self.now
+        for level, (slots, span) in enumerate(self.LEVELS):
+            if delta < slots * span:
+                slot = (timer.deadline // span) % slots
+                self.levels[level][slot].append(timer)
+                return
+        self.overflow.append(timer)
+
+    def cascade(self, level):
+        slots, span = self.LEVELS[level]
+        slot = (self.now // span) % slots
+        timers = self.levels[level][slot]
+        self.levels[level][slot] = []
+        for timer in timers:
+            self.add(timer)
+
+    def tick(self):
+        """Advances the wheel by one second and fires the expired timers."""
+        self.now += 1
+        if self.now % DAY == 0:
+            timers, self.overflow = self.overflow, []
+            for timer in timers:
+                self.add(timer)
+        if self.now % 3600 == 0:
+            self.cascade(2)
+        if self.now % 60 == 0:
+            self.cascade(1)
+        slot = self.now % 60
+        expired = self.levels[0][slot]
+        self.levels[0][slot] = []
+        for timer in expired:
+            if timer.period:
+                timer.deadline += timer.period
+                self.add(timer)
+            timer.callback(timer)
+
+    def next_expiry(self):
+        """
+        Returns the next time at which the wheel has work to do, either
+        firing timers or cascading a slot, or None if it is empty.
+        """
+        candidates = []
+        for level, (slots, span) in enumerate(self.LEVELS):
+            start = self.now // span + 1
+            for step in range(start, start + slots):
+                if self.levels[level][step % slots]:
+                    candidates.append(step * span)
+                    break
+        if self.overflow:
+            candidates.append((self.now // DAY + 1) * DAY)
+        return min(candidates) if len(candidates) > 0 else None
+
+    def advance(self, now):
+        """
+        Advances the wheel to now. Idle periods are skipped at once, since
+        nothing happens before next_expiry().
+        """
+        while self.now < now:
+            expiry = self.next_expiry()
+            if expiry is None or expiry > now:
+                self.now = now
+                return
+            self.now = expiry - 1
+            self.tick()
+
+
+class TimeScheduler(object):
+    """
+    Per-model scheduler of the time-of-day conditions on the system_clock.
+    Their truth value can only change at a few instants per day (see
+    TimeCondition.boundaries()), which are registered as daily timers in a
+    TimerWheel. At each of them the system_clock time is updated, and the
+    Automations whose condition only reads the time are woken up. Between
+    deadlines the scheduler thread sleeps.
+    """
+
+    def __init__(self, clock=wall_clock_seconds, threaded=True):
+        """
+        :param clock: Returns the wall-clock time in seconds, from day 1
+        :param threaded: Whether timers fire on a thread of the scheduler.
+            Otherwise the owner calls advance() as its clock moves.
+        """
+        self.clock = clock
+        self.threaded = threaded
+        self.wheel = TimerWheel(int(clock()))
+        # Timers and the time-only Automations they wake up, per boundary
+        self.timers = {}
+        self.automations = {}
+        self.clock_attrs = []
+        self.lock = Lock()
+        self.changed = Event()
+        self.thread = None
+
+    @staticmethod
+    def of(model):
+        if getattr(model, "time_scheduler", None) is None:
+            model.time_scheduler = TimeScheduler()
+        return model.time_scheduler
+
+    def add(self, automation):
+        """
+        Registers the time boundaries of an Automation's condition.
+        Automations whose condition only reads the time are woken up at
+        these boundaries.
+        """
+        conditions = automation.condition.time_conditions()
+        if len(conditions) == 0:
+            return
+        with self.lock:
+            self.wheel.advance(int(self.clock()))
+            for cond in conditions:
+                if cond.operand1.attribute not in self.clock_attrs:
+                    self.clock_attrs.append(cond.operand1.attribute)
+                for boundary in cond.boundaries():
+                    if boundary not in self.timers:
+                        self.add_boundary(boundary)
+                    if automation.condition.is_time_only() and (
+                        automation not in self.automations[boundary]
+                    ):
+                        self.automations[boundary].append(automation)
+            self.set_clock(self.wheel.now)
+        self.changed.set()
+        self.start()
+
+    def clear(self):
+        """Unregisters all Automations, e.g. before reloading the model."""
+        with self.lock:
+            self.wheel = TimerWheel(self.wheel.now)
+            self.timers = {}
+            self.automations = {}
+            self.clock_attrs = []
+
+    def add_boundary(self, boundary):
+        now = self.wheel.now
+        deadline = (now // DAY) * DAY + boundary
+        if deadline <= now:
+            deadline += DAY
+        timer = Timer(deadline, self.fire, period=DAY)
+        self.timers[boundary] = timer
+        self.automations[boundary] = []
+        self.wheel.add(timer)
+
+    def set_clock(self, now):
+        seconds = now % DAY
+        for attr in self.clock_attrs:
+            attr.parent.update_state(
+                {
+                    attr.name: {
+                        "hour": seconds // 3600,
+                        "minute": (seconds // 60) % 60,
+                        "second": seconds % 60,
+                    }
+                }
+            )
+
+    def fire(self, timer):
+        self.set_clock(timer.deadline)
+        for automation in self.automations[timer.deadline % DAY]:
+            automation.notify()
+
+    def start(self):
+        if self.threaded and self.thread is None:
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def advance(self):
+        """Fires the timers expired by the time of the clock."""
+        with self.lock:
+            self.wheel.advance(int(self.clock()))
+
+    def next_expiry(self):
+        with self.lock:
+            return self.wheel.next_expiry()
+
+    def run(self):
+        while True:
+            self.advance()
+            expiry = self.next_expiry()
+            timeout = None if expiry is None else max(expiry - self.clock(), 0)
+            # Sleep until the next deadline or until timers are added
+            self.changed.wait(timeout)
+            self.changed.clear()
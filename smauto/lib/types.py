@@ -63,6 +63,19 @@ class Time:
         return val
 
 
+class Duration:
+    # Seconds per duration unit
+    UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+    def __init__(self, parent, value, unit):
+        self.parent = parent
+        self.value = float(value)
+        self.unit = unit
+
+    def to_seconds(self):
+        return self.value * self.UNITS[self.unit]
+
+
 class Date:
     def __init__(self, parent, month, day, year):
         self.parent = parent
@@ -0,0 +1,320 @@
+import numpy as np
+
+# Maximum number of cached plans, see VectorizedEvaluator.plan()
+MAX_PLANS = 64
+
+# Vectorized comparison operators, by operator
+COMPARISONS = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+}
+
+# Vectorized logical operators, following the expressions of OPERATORS
+LOGICAL = {
+    "AND": np.logical_and,
+    "OR": np.logical_or,
+    "NOT": np.not_equal,
+    "XOR": np.logical_xor,
+    "NOR": lambda left, right: np.logical_not(np.logical_or(left, right)),
+    "XNOR": lambda left, right: np.logical_and(
+        np.logical_or(left, right),
+        np.logical_or(np.logical_not(left), np.logical_not(right)),
+    ),
+    "NAND": lambda left, right: np.logical_not(np.logical_and(left, right)),
+}
+
+
+class VectorizedEvaluator(object):
+    """
+    Batch evaluation backend for the numeric conditions of polled
+    Automations, used by the AutomationScheduler.
+    All numeric attribute values read by the conditions are laid out in a
+    single NumPy array, followed by the constants they are compared against.
+    Every comparison compiles to (operator, left index, right index) arrays
+    and every ConditionGroup to (operator, left node, right node) arrays,
+    ordered by tree depth. Evaluating all Automations then takes one
+    vectorized pass over the comparisons and one pass per tree level.
+    Evaluating some of them only runs the parts of the passes their
+    conditions need, see plan().
+    ...
+
+    Attributes
+    ----------
+        automations: list
+            Automations evaluated by the backend, in the order of the
+            results of evaluate()
+        index: dict
+            Position of each Automation in the results of evaluate()
+        attributes: list
+            Attributes whose values occupy the first slots of values
+        valid: numpy.ndarray
+            Whether each slot of values holds a number. Comparisons
+            reading an invalid slot are false.
+        plans: dict
+            Passes evaluating a subset of the Automations, by the positions
+            of the Automations
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.automations = []
+        self.index = {}
+        self.attributes = []
+        self.constants = []
+        # Comparisons as (operator, left slot, right slot)
+        self.comparisons = []
+        # Logical operations as (depth, operator, left node, right node).
+        # Nodes are numbered after the comparisons.
+        self.groups = []
+        self.roots = []
+        self.plans = {}
+        self.compiled = False
+        # Whether Automations were removed since the last compile()
+        self.stale = False
+
+    @staticmethod
+    def is_numeric_attr(operand):
+        return operand.__class__.__name__ == "SimpleNumericAttr"
+
+    @staticmethod
+    def supports(cond):
+        """Whether a condition (sub)tree can be evaluated by the backend."""
+        cls_name = cond.__class__.__name__
+        if cls_name == "ConditionGroup":
+            return VectorizedEvaluator.supports(
+                cond.r1
+            ) and VectorizedEvaluator.supports(cond.r2)
+        elif cls_name == "InRangeCondition":
+            return VectorizedEvaluator.is_numeric_attr(cond.attribute)
+        elif cls_name == "NumericCondition":
+            return VectorizedEvaluator.is_numeric_attr(cond.operand1) and (
+                type(cond.operand2) in (int, float)
+                or VectorizedEvaluator.is_numeric_attr(cond.operand2)
+            )
+        return False
+
+    def attribute_slot(self, attribute):
+        if attribute not in self.attributes:
+            self.attributes.append(attribute)
+        return ("attr", self.attributes.index(attribute))
+
+    def constant_slot(self, value):
+        self.constants.append(value)
+        return ("const", len(self.constants) - 1)
+
+    def add_comparison(self, operator, left, right):
+        self.comparisons.append((operator, left, right))
+        return ("cmp", len(self.comparisons) - 1)
+
+    def add_group(self, operator, left, right):
+        depth = 1 + max(self.depth(left), self.depth(right))
+        self.groups.append((depth, operator, left, right))
+        return ("grp", len(self.groups) - 1)
+
+    def depth(self, node):
+        return 0 if node[0] == "cmp" else self.groups[node[1]][0]
+
+    def add_node(self, cond):
+        cls_name = cond.__class__.__name__
+        if cls_name == "ConditionGroup":
+            return self.add_group(
+                cond.operator, self.add_node(cond.r1), self.add_node(cond.r2)
+            )
+        elif cls_name == "InRangeCondition":
+            attr = self.attribute_slot(cond.attribute.attribute)
+            return self.add_group(
+                "AND",
+                self.add_comparison(">", attr, self.constant_slot(cond.min)),
+                self.add_comparison("<", attr, self.constant_slot(cond.max)),
+            )
+        left = self.attribute_slot(cond.operand1.attribute)
+        if type(cond.operand2) in (int, float):
+            right = self.constant_slot(cond.operand2)
+        else:
+            right = self.attribute_slot(cond.operand2.attribute)
+        return self.add_comparison(cond.operator, left, right)
+
+    def add(self, automation):
+        """
+        Adds an Automation to the backend, if its condition is supported.
+        Returns True if it was added.
+        """
+        if automation in self.index or not self.supports(automation.condition):
+            return automation in self.index
+        self.roots.append(self.add_node(automation.condition))
+        self.index[automation] = len(self.automations)
+        self.automations.append(automation)
+        self.compiled = False
+        return True
+
+    def remove(self, automation):
+        """
+        Removes an Automation from the backend. The arrays are rebuilt by
+        the next compile().
+        """
+        if automation not in self.index:
+            return
+        self.automations.remove(automation)
+        del self.index[automation]
+        self.stale = True
+        self.compiled = False
+
+    def rebuild(self):
+        automations = self.automations
+        self.clear()
+        for automation in automations:
+            self.add(automation)
+
+    def compile(self):
+        """Builds the index arrays of the two evaluation passes."""
+        if self.stale:
+            self.rebuild()
+        n_attrs = len(self.attributes)
+
+        def slot_index(slot):
+            return slot[1] if slot[0] == "attr" else n_attrs + slot[1]
+
+        n_cmps = len(self.comparisons)
+
+        def node_index(node):
+            return node[1] if node[0] == "cmp" else n_cmps + node[1]
+
+        self.values = np.zeros(n_attrs + len(self.constants))
+        self.values[n_attrs:] = self.constants
+        self.valid = np.ones(len(self.values), dtype=bool)
+        self.truth = np.zeros(n_cmps + len(self.groups), dtype=bool)
+        self.cmp_passes = []
+        for operator, func in COMPARISONS.items():
+            ids = [i for i, c in enumerate(self.comparisons) if c[0] == operator]
+            if len(ids) == 0:
+                continue
+            self.cmp_passes.append(
+                (
+                    func,
+                    np.array(ids),
+                    np.array([slot_index(self.comparisons[i][1]) for i in ids]),
+                    np.array([slot_index(self.comparisons[i][2]) for i in ids]),
+                )
+            )
+        self.group_passes = []
+        depths = sorted({group[0] for group in self.groups})
+        for depth in depths:
+            for operator, func in LOGICAL.items():
+                ids = [
+                    i
+                    for i, g in enumerate(self.groups)
+                    if g[0] == depth and g[1] == operator
+                ]
+                if len(ids) == 0:
+                    continue
+                self.group_passes.append(
+                    (
+                        func,
+                        np.array([n_cmps + i for i in ids]),
+                        np.array([node_index(self.groups[i][2]) for i in ids]),
+                        np.array([node_index(self.groups[i][3]) for i in ids]),
+                    )
+                )
+        self.root_index = np.array([node_index(root) for root in self.roots], dtype=int)
+        self.attr_index = np.arange(n_attrs)
+        self.plans = {}
+        self.compiled = True
+
+    def plan(self, positions):
+        """
+        Returns the (attribute slots, comparison passes, group passes, root
+        nodes) evaluating the conditions of the Automations at the given
+        positions only. Polled Automations with the same freq are due
+        together, so the plans are cached.
+        """
+        if positions in self.plans:
+            return self.plans[positions]
+        cmps = set()
+        groups = set()
+        nodes = [self.roots[i] for i in positions]
+        while len(nodes) > 0:
+            kind, i = nodes.pop()
+            if kind == "cmp":
+                cmps.add(i)
+            elif i not in groups:
+                groups.add(i)
+                nodes.extend(self.groups[i][2:])
+        n_cmps = len(self.comparisons)
+        needed = np.zeros(len(self.truth), dtype=bool)
+        needed[list(cmps)] = True
+        needed[[n_cmps + i for i in groups]] = True
+
+        def restrict(passes):
+            restricted = []
+            for func, ids, left, right in passes:
+                mask = needed[ids]
+                if mask.any():
+                    restricted.append((func, ids[mask], left[mask], right[mask]))
+            return restricted
+
+        attrs = {
+            slot[1]
+            for i in cmps
+            for slot in self.comparisons[i][1:]
+            if slot[0] == "attr"
+        }
+        plan = (
+            np.array(sorted(attrs), dtype=int),
+            restrict(self.cmp_passes),
+            restrict(self.group_passes),
+            self.root_index[list(positions)],
+        )
+        if len(self.plans) >= MAX_PLANS:
+            self.plans = {}
+        self.plans[positions] = plan
+        return plan
+
+    def load(self, attr_index):
+        """
+        Copies the values of the attributes at attr_index into values.
+        Values that are not numbers, e.g. None or a string, are marked
+        invalid, so that the comparisons reading them are false.
+        """
+        raw = [self.attributes[i].value for i in attr_index]
+        valid = [isinstance(value, (int, float)) for value in raw]
+        if all(valid):
+            self.values[attr_index] = raw
+            self.valid[attr_index] = True
+            return
+        self.values[attr_index] = [value if ok else 0 for value, ok in zip(raw, valid)]
+        self.valid[attr_index] = valid
+
+    def evaluate(self, automations=None):
+        """
+        Evaluates the conditions of the given Automations of the backend,
+        or of all of them. Returns a boolean array aligned with
+        automations, or with self.automations.
+        """
+        if not self.compiled:
+            self.compile()
+        if automations is None:
+            attr_index, cmp_passes, group_passes, root_index = (
+                self.attr_index,
+                self.cmp_passes,
+                self.group_passes,
+                self.root_index,
+            )
+        else:
+            attr_index, cmp_passes, group_passes, root_index = self.plan(
+                tuple(self.index[automation] for automation in automations)
+            )
+        self.load(attr_index)
+        values = self.values
+        valid = self.valid
+        truth = self.truth
+        for func, ids, left, right in cmp_passes:
+            truth[ids] = func(values[left], values[right]) & valid[left] & valid[right]
+        for func, ids, left, right in group_passes:
+            truth[ids] = func(truth[left], truth[right])
+        return truth[root_index]
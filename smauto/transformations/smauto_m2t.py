@@ -1,10 +1,11 @@
 import os
-from os.path import basename
 import jinja2
-from rich import print, pretty
 
 from smauto.language import build_model
 from smauto.definitions import TEMPLATES_PATH
+from smauto.lib.checkpoint import Checkpointer
+from smauto.lib.outbox import ActionOutbox
+from smauto.lib.sharding import ShardedExecutor
 from textx import get_children_of_type
 
 
@@ -32,6 +33,9 @@ def build_smauto_code(model):
         "automations": model.automations,
         "system_clock": model.system_clock,
         "rt_monitor": model.monitor,
+        "outbox": ActionOutbox.settings(model),
+        "checkpoint": Checkpointer.settings(model),
+        "automation_graph": ShardedExecutor.graph(model),
         "metadata": model.metadata,
     }
     return smauto_tpl.render(context)
@@ -0,0 +1,40 @@
+import pytest
+
+from smauto.language import build_model
+
+HEADER = """
+Metadata
+    name: Test
+    version: "0.1.0"
+end
+Broker<MQTT> home_broker
+    host: "localhost"
+    port: 1883
+    auth:
+        username: ""
+        password: ""
+end
+"""
+
+
+@pytest.fixture
+def build(tmp_path):
+    """
+    Returns a function building a model from its Entities and Automations,
+    with a Metadata and a Broker named home_broker.
+    """
+
+    def build(text, name="model.auto"):
+        path = tmp_path / name
+        path.write_text(HEADER + text)
+        return build_model(str(path))
+
+    return build
+
+
+def entities_of(model):
+    return {entity.name: entity for entity in model.entities}
+
+
+def automations_of(model):
+    return {automation.name: automation for automation in model.automations}
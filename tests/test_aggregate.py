@@ -0,0 +1,151 @@
+import math
+import random
+import statistics
+
+import numpy as np
+import pytest
+
+from smauto.lib.aggregate import (
+    AGGREGATES,
+    DURATION_AGGREGATES,
+    DurationAggregate,
+    RESUM_SAMPLES,
+    RingBuffer,
+    TimedRingBuffer,
+    WindowAggregate,
+    to_sample,
+)
+
+from conftest import entities_of
+
+FUNCTIONS = {
+    "mean": statistics.mean,
+    "var": statistics.variance,
+    "std": statistics.stdev,
+    "min": min,
+    "max": max,
+}
+
+
+@pytest.mark.parametrize("func", sorted(AGGREGATES.keys()))
+@pytest.mark.parametrize("size", [2, 5, 50])
+def test_window_aggregate_matches_statistics(func, size):
+    rng = random.Random(size)
+    buffer = RingBuffer(size + 1)
+    node = AGGREGATES[func](size, buffer)
+    samples = []
+    for _ in range(300):
+        sample = rng.uniform(-100, 100)
+        buffer.append(sample)
+        node.push(sample)
+        samples.append(sample)
+        expected = FUNCTIONS[func](samples[-size:]) if len(samples) >= size else 0
+        assert node.value == pytest.approx(expected, abs=1e-6)
+
+
+@pytest.mark.parametrize("func", sorted(DURATION_AGGREGATES.keys()))
+def test_duration_aggregate_matches_statistics(func):
+    rng = random.Random(1)
+    buffer = TimedRingBuffer()
+    node = DURATION_AGGREGATES[func](3.0, buffer)
+    samples = []
+    now = 0.0
+    # Long enough for the running sums to be recomputed
+    for _ in range(2 * RESUM_SAMPLES + 100):
+        now += rng.uniform(0.0, 1.0)
+        sample = rng.uniform(-100, 100)
+        buffer.append(now, sample)
+        node.push(sample, now)
+        samples = [(t, s) for t, s in samples if t > now - 3.0] + [(now, sample)]
+        window = [s for _, s in samples]
+        if len(window) >= node.min_count:
+            expected = FUNCTIONS[func](window)
+            assert node.value == pytest.approx(expected, abs=1e-6)
+
+
+def test_ring_buffer_views():
+    buffer = RingBuffer(3)
+    assert list(buffer.window(3)) == [0, 0, 0]
+    for sample in range(5):
+        buffer.append(sample)
+    assert list(buffer.last(3)) == [2, 3, 4]
+    assert buffer.evicted(2) == 2.0
+    # Growing keeps the most recent samples
+    buffer.reserve(5)
+    assert list(buffer.last(3)) == [2, 3, 4]
+    assert list(buffer.window(5)) == [0, 0, 0, 0, 0]
+
+
+@pytest.mark.parametrize("value", [None, "warm", float("nan"), float("inf")])
+def test_invalid_samples(value):
+    assert to_sample(value) is None
+
+
+def test_valid_samples():
+    assert to_sample(3) == 3.0
+    assert to_sample("2.5") == 2.5
+    assert to_sample(True) == 1.0
+
+
+def test_mean_resums_running_sums():
+    size = 4
+    buffer = RingBuffer(size + 1)
+    node = AGGREGATES["var"](size, buffer)
+    rng = random.Random(2)
+    for _ in range(RESUM_SAMPLES * 3):
+        sample = rng.uniform(-1e6, 1e6)
+        buffer.append(sample)
+        node.push(sample)
+    # Drift the sums, a recomputation brings them back
+    node.mean += 1.0
+    for _ in range(RESUM_SAMPLES):
+        sample = rng.uniform(-1e6, 1e6)
+        buffer.append(sample)
+        node.push(sample)
+    window = buffer.last(size)
+    assert node.mean == pytest.approx(float(np.mean(window)))
+    assert node.value == pytest.approx(statistics.variance(window))
+
+
+SENSOR = """
+Entity weather
+    type: sensor
+    topic: "weather"
+    broker: home_broker
+    attributes:
+        - temp: float
+end
+Automation hot
+    condition:
+        (mean(weather.temp, 2) > 40) AND (max(weather.temp, 3s) > 40)
+end
+"""
+
+
+def test_invalid_sample_is_skipped(build):
+    model = build(SENSOR)
+    for automation in model.automations:
+        automation.build_condition()
+    weather = entities_of(model)["weather"]
+    mean, maximum = weather.aggregates
+    weather.update_state({"temp": 30})
+    weather.update_state({"temp": None})
+    weather.update_state({"temp": "warm"})
+    assert weather.skipped_samples == {"temp": 2}
+    assert weather.attributes_buff["temp"].count == 1
+    weather.update_state({"temp": 50})
+    assert mean.value == 40.0
+    weather.update_state({"temp": 50})
+    assert mean.value == 50.0
+    assert maximum.value == 50.0
+    assert not any(math.isnan(value) for value in weather.get_buffer("temp"))
+
+
+def test_window_aggregate_is_abstract():
+    with pytest.raises(TypeError):
+        WindowAggregate(3, RingBuffer(4))
+
+
+def test_duration_aggregate_is_abstract():
+    with pytest.raises(TypeError):
+        DurationAggregate(5.0, TimedRingBuffer())
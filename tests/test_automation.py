@@ -0,0 +1,64 @@
+import pytest
+
+from conftest import automations_of
+
+MODEL = """
+Entity weather
+    type: sensor
+    topic: "weather"
+    broker: home_broker
+    attributes:
+        - temp: float
+end
+Entity fan
+    type: actuator
+    topic: "fan"
+    broker: home_broker
+    attributes:
+        - on: bool
+end
+Automation cool
+    condition:
+        weather.temp > 30
+    trigger: edge
+    {rearm}
+    actions:
+        - fan.on: true
+end
+"""
+
+
+@pytest.fixture
+def clock():
+    return [100.0]
+
+
+def edge_automation(build, clock, rearm=""):
+    model = build(MODEL.format(rearm=rearm))
+    automation = automations_of(model)["cool"]
+    automation.condition.build()
+    automation.clock = lambda: clock[0]
+    return automation
+
+
+def test_rising_edge(build, clock):
+    automation = edge_automation(build, clock)
+    assert automation.is_rising_edge(True)
+    clock[0] += 10
+    assert not automation.is_rising_edge(True)
+    assert not automation.is_rising_edge(False)
+    assert automation.is_rising_edge(True)
+
+
+def test_rearm_after_seconds(build, clock):
+    automation = edge_automation(build, clock, "rearm: 2")
+    assert automation.is_rising_edge(True)
+    clock[0] += 1
+    assert not automation.is_rising_edge(True)
+    clock[0] += 1
+    assert automation.is_rising_edge(True)
+    clock[0] += 1
+    assert not automation.is_rising_edge(True)
+    # Falling still re-arms at once
+    assert not automation.is_rising_edge(False)
+    assert automation.is_rising_edge(True)
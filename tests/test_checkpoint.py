@@ -0,0 +1,197 @@
+import os
+import threading
+
+import pytest
+
+from smauto.lib.checkpoint import Checkpointer
+from smauto.lib.simulation import Simulation
+
+from conftest import automations_of, entities_of
+
+MODEL = """
+Entity weather
+    type: sensor
+    topic: "weather"
+    broker: home_broker
+    attributes:
+        - temp: float
+        - humidity: int
+end
+Entity fan
+    type: actuator
+    topic: "fan"
+    broker: home_broker
+    attributes:
+        - on: bool
+end
+Automation cool
+    condition:
+        weather.temp > 30
+    actions:
+        - fan.on: true
+end
+Automation dry
+    condition:
+        (mean(weather.humidity, 3) > 60) AND (max(weather.temp, 10s) > 35)
+    continuous: false
+    actions:
+        - fan.on: true
+end
+"""
+
+
+def run(build, messages, duration):
+    model = build(MODEL)
+    simulation = Simulation(model)
+    simulation.add_messages(messages)
+    simulation.run(duration)
+    return model, simulation
+
+
+def test_restore_windows_and_flags(build, tmp_path):
+    path = str(tmp_path / "state.ckpt")
+    model, _ = run(
+        build,
+        [(t, "weather", {"temp": 36.0, "humidity": 50 + 10 * t}) for t in range(4)],
+        5,
+    )
+    automations = automations_of(model)
+    assert not automations["dry"].enabled
+    weather = entities_of(model)["weather"]
+    values = [node.value for node in weather.aggregates]
+    Checkpointer(path, model.entities, model.automations).save()
+
+    restored = build(MODEL)
+    Simulation(restored)
+    entities, names = Checkpointer(
+        path, restored.entities, restored.automations
+    ).restore()
+    assert sorted(entities) == ["fan", "weather"]
+    assert sorted(names) == ["cool", "dry"]
+    weather = entities_of(restored)["weather"]
+    assert [node.value for node in weather.aggregates] == pytest.approx(values)
+    assert weather.attributes_dict["temp"].value == 36.0
+    assert not automations_of(restored)["dry"].enabled
+
+
+def test_restore_refreshes_condition_network(build, tmp_path):
+    path = str(tmp_path / "state.ckpt")
+    model, _ = run(build, [(0, "weather", {"temp": 40.0, "humidity": 0})], 1)
+    Checkpointer(path, model.entities, model.automations).save()
+
+    restored = build(MODEL)
+    simulation = Simulation(restored)
+    Checkpointer(path, restored.entities, restored.automations).restore()
+    assert automations_of(restored)["cool"].condition.network_node.truth
+    simulation.add_messages([(1, "weather", {"temp": 41.0, "humidity": 0})])
+    published = simulation.run(2)
+    assert [offset for offset, name, _ in published if name == "fan"] == [
+        pytest.approx(0.0),
+        pytest.approx(1.0),
+    ]
+
+
+def test_incremental_records(build, tmp_path):
+    path = str(tmp_path / "state.ckpt")
+    model = build(MODEL)
+    Simulation(model)
+    weather = entities_of(model)["weather"]
+    checkpointer = Checkpointer(path, model.entities, model.automations)
+    checkpointer.save()
+    size = os.path.getsize(path)
+    checkpointer.save()
+    assert os.path.getsize(path) == size
+    weather.update_state({"temp": 20.0, "humidity": 40})
+    checkpointer.save()
+    grown = os.path.getsize(path)
+    assert grown > size
+    # Only the changed Entity is appended
+    assert grown - size < size
+    latest = checkpointer.read()
+    assert (Checkpointer.ENTITY, "weather") in latest
+
+
+def test_torn_record_is_ignored(build, tmp_path):
+    path = str(tmp_path / "state.ckpt")
+    model = build(MODEL)
+    Simulation(model)
+    weather = entities_of(model)["weather"]
+    checkpointer = Checkpointer(path, model.entities, model.automations)
+    weather.update_state({"temp": 20.0, "humidity": 40})
+    checkpointer.save()
+    weather.update_state({"temp": 25.0, "humidity": 40})
+    checkpointer.save()
+    with open(path, "rb+") as fp:
+        fp.truncate(os.path.getsize(path) - 3)
+
+    restored = build(MODEL)
+    Simulation(restored)
+    Checkpointer(path, restored.entities, restored.automations).restore()
+    # The last record is torn, the previous one is restored
+    assert entities_of(restored)["weather"].attributes_dict["temp"].value == 20.0
+
+
+def test_snapshot_waits_for_buffer_updates(build):
+    model = build(MODEL)
+    Simulation(model)
+    weather = entities_of(model)["weather"]
+    weather.update_state({"temp": 20.0, "humidity": 40})
+    snapshots = []
+    with weather.buffers_lock:
+        snapshot = threading.Thread(
+            target=lambda: snapshots.append(weather.snapshot_buffers())
+        )
+        snapshot.start()
+        snapshot.join(0.2)
+        assert snapshot.is_alive()
+    snapshot.join()
+    assert len(snapshots) == 1
+
+
+def test_not_a_checkpoint(build, tmp_path):
+    path = tmp_path / "state.ckpt"
+    path.write_bytes(b"garbage")
+    model = build(MODEL)
+    Simulation(model)
+    checkpointer = Checkpointer(str(path), model.entities, model.automations)
+    # Started afresh, the first checkpoint rewrites the file
+    assert checkpointer.restore() == ([], [])
+    checkpointer.save()
+    assert path.read_bytes().startswith(Checkpointer.MAGIC)
+
+
+def test_max_age_skips_stale_entities(build, tmp_path):
+    path = str(tmp_path / "state.ckpt")
+    model, _ = run(build, [(0, "weather", {"temp": 40.0, "humidity": 0})], 1)
+    checkpointer = Checkpointer(path, model.entities, model.automations)
+    checkpointer.save()
+
+    restored = build(MODEL)
+    Simulation(restored)
+    checkpointer = Checkpointer(
+        path, restored.entities, restored.automations, max_age=-1
+    )
+    entities, automations = checkpointer.restore()
+    assert entities == []
+    assert sorted(automations) == ["cool", "dry"]
+
+
+def test_compaction(build, tmp_path):
+    path = str(tmp_path / "state.ckpt")
+    model = build(MODEL)
+    Simulation(model)
+    weather = entities_of(model)["weather"]
+    checkpointer = Checkpointer(
+        path, model.entities, model.automations, compact_ratio=2
+    )
+    checkpointer.save()
+    for value in range(20):
+        weather.update_state({"temp": float(value), "humidity": value})
+        checkpointer.save()
+        assert os.path.getsize(path) <= 3 * checkpointer.compacted_size
+    assert set(checkpointer.read().keys()) == {
+        (Checkpointer.ENTITY, "weather"),
+        (Checkpointer.ENTITY, "fan"),
+        (Checkpointer.AUTOMATION, "cool"),
+        (Checkpointer.AUTOMATION, "dry"),
+    }
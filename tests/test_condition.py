@@ -0,0 +1,204 @@
+import types
+
+import pytest
+from textx.exceptions import TextXSemanticError
+
+from smauto.lib.scheduler import AutomationScheduler
+
+from conftest import automations_of, entities_of
+
+ENTITIES = """
+Entity weather
+    type: sensor
+    topic: "weather"
+    broker: home_broker
+    attributes:
+        - temp: float
+        - humidity: float
+        - wind: float
+end
+Entity fan
+    type: actuator
+    topic: "fan"
+    broker: home_broker
+    attributes:
+        - on: bool
+end
+"""
+
+AUTOMATION = """
+Automation {name}
+    condition:
+        {condition}
+    actions:
+        - fan.on: true
+end
+"""
+
+
+def build_conditions(build, *conditions):
+    """Builds a model with an Automation per condition, a1, a2, ..."""
+    text = ENTITIES + "".join(
+        AUTOMATION.format(name=f"a{index + 1}", condition=condition)
+        for index, condition in enumerate(conditions)
+    )
+    model = build(text)
+    for automation in model.automations:
+        automation.condition.build()
+    return model, entities_of(model)["weather"], automations_of(model)
+
+
+def truth(automation):
+    return automation.condition.evaluate()[0]
+
+
+def test_compiled_once(build):
+    model, weather, autos = build_conditions(
+        build, "(weather.temp > 30) OR (weather.humidity < 20)"
+    )
+    condition = autos["a1"].condition
+    assert isinstance(condition.cond_code, types.CodeType)
+    code = condition.cond_code
+    weather.update_state({"temp": 35, "humidity": 50})
+    assert truth(autos["a1"])
+    weather.update_state({"temp": 25, "humidity": 50})
+    assert not truth(autos["a1"])
+    weather.update_state({"temp": 25, "humidity": 10})
+    assert truth(autos["a1"])
+    assert condition.cond_code is code
+
+
+def test_cached_on_versions(build, monkeypatch):
+    model, weather, autos = build_conditions(build, "weather.temp > 30")
+    condition = autos["a1"].condition
+    # Threshold conditions are maintained by the ConditionNetwork instead
+    condition.network_node = None
+    executions = []
+    execute = condition.execute
+    monkeypatch.setattr(condition, "execute", lambda: executions.append(1) or execute())
+    weather.update_state({"temp": 35})
+    assert truth(autos["a1"])
+    assert truth(autos["a1"])
+    assert len(executions) == 1
+    weather.update_state({"temp": 25})
+    assert not truth(autos["a1"])
+    assert len(executions) == 2
+
+
+def test_cheap_operands_first(build):
+    model, weather, autos = build_conditions(
+        build, "(std(weather.temp, 10) > 1) AND (weather.humidity > 30)"
+    )
+    condition = autos["a1"].condition
+    first, second = condition.operands()
+    assert first.cost < second.cost
+    assert first.operand1.attribute.name == "humidity"
+
+
+def test_likely_false_operand_first(build):
+    model, weather, autos = build_conditions(
+        build, "(weather.temp > 30) AND (weather.humidity > 30)"
+    )
+    condition = autos["a1"].condition
+    condition.network_node = None
+    # temp > 30 holds and humidity > 30 never does, so humidity should be
+    # evaluated first
+    for index in range(64):
+        weather.update_state({"temp": 40 + index % 2, "humidity": 10})
+        assert not truth(autos["a1"])
+    first, _ = condition.operands()
+    assert first.operand1.attribute.name == "humidity"
+
+
+def test_event_index(build):
+    model, weather, autos = build_conditions(
+        build, "weather.temp > 30", "weather.humidity > 30"
+    )
+    assert weather.attr_automations["temp"] == [autos["a1"]]
+    assert weather.attr_automations["humidity"] == [autos["a2"]]
+    assert weather.attr_automations["wind"] == []
+
+
+def test_notified_on_change(build):
+    model, weather, autos = build_conditions(
+        build, "weather.temp > 30", "weather.humidity > 30"
+    )
+    scheduler = AutomationScheduler()
+    for automation in autos.values():
+        scheduler.add(automation)
+    weather.update_state({"temp": 35})
+    assert scheduler.ready == [autos["a1"]]
+    scheduler.due()
+    # Unchanged values do not wake the Automations reading them
+    weather.update_state({"temp": 35})
+    assert scheduler.ready == []
+
+
+@pytest.mark.parametrize(
+    "condition, state, expected",
+    [
+        ("math(weather.temp * 2 + 1) > 60", {"temp": 30}, True),
+        ("math(weather.temp * 2 + 1) > 61", {"temp": 30}, False),
+        (
+            "math((weather.temp - weather.humidity) / 2) < -5",
+            {"temp": 10, "humidity": 21},
+            True,
+        ),
+        ("math(-weather.temp) < 0", {"temp": 1}, True),
+    ],
+)
+def test_math(build, condition, state, expected):
+    model, weather, autos = build_conditions(build, condition)
+    weather.update_state(state)
+    assert truth(autos["a1"]) == expected
+
+
+def test_math_division_by_attribute(build):
+    model, weather, autos = build_conditions(
+        build, "math(weather.temp / weather.humidity) > 1"
+    )
+    assert autos["a1"].condition.may_raise
+    weather.update_state({"temp": 10, "humidity": 0})
+    assert not truth(autos["a1"])
+    weather.update_state({"temp": 20, "humidity": 0})
+    assert not truth(autos["a1"])
+    assert autos["a1"].errors == {"ZeroDivisionError": 2}
+    weather.update_state({"temp": 10, "humidity": 5})
+    assert truth(autos["a1"])
+
+
+def test_mul(build):
+    model, weather, autos = build_conditions(
+        build, "mul(weather.temp, weather.humidity, weather.wind) > 100"
+    )
+    weather.update_state({"temp": 2, "humidity": 5, "wind": 10})
+    assert not truth(autos["a1"])
+    weather.update_state({"temp": 2, "humidity": 5, "wind": 11})
+    assert truth(autos["a1"])
+
+
+def test_shared_aggregates(build):
+    model, weather, autos = build_conditions(
+        build,
+        "mean(weather.temp, 10) > 30",
+        "mean(weather.temp, 10) < 10",
+        "mean(weather.temp, 5) > 30",
+    )
+    assert len(weather.aggregates) == 2
+    for value in range(10):
+        weather.update_state({"temp": 40})
+    assert truth(autos["a1"])
+    assert not truth(autos["a2"])
+    assert truth(autos["a3"])
+
+
+@pytest.mark.parametrize(
+    "condition, message",
+    [
+        ("std(weather.temp, 1) > 1", "at least 2"),
+        ("weather.temp in range [5, 1]", "Empty range"),
+    ],
+)
+def test_type_checked_on_load(build, condition, message):
+    with pytest.raises(TextXSemanticError, match=message):
+        build(ENTITIES + AUTOMATION.format(name="a1", condition=condition))
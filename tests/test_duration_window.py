@@ -0,0 +1,104 @@
+import pytest
+
+from smauto.lib.scheduler import AutomationScheduler
+from smauto.lib.simulation import Simulation
+
+from conftest import automations_of, entities_of
+
+MODEL = """
+Entity weather
+    type: sensor
+    topic: "weather"
+    broker: home_broker
+    attributes:
+        - temp: float
+end
+Entity fan
+    type: actuator
+    topic: "fan"
+    broker: home_broker
+    attributes:
+        - on: bool
+end
+Automation cool
+    condition:
+        mean(weather.temp, 3s) > 40
+    trigger: edge
+    actions:
+        - fan.on: true
+end
+"""
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def build_window(build):
+    model = build(MODEL)
+    weather = entities_of(model)["weather"]
+    weather.clock = FakeClock()
+    cool = automations_of(model)["cool"]
+    AutomationScheduler(clock=weather.clock).add(cool)
+    return weather, cool
+
+
+def test_expiry_changes_condition(build):
+    weather, cool = build_window(build)
+    weather.update_state({"temp": 0})
+    weather.clock.now = 1
+    weather.update_state({"temp": 60})
+    weather.clock.now = 2
+    weather.update_state({"temp": 60})
+    assert not cool.evaluate_condition()[0]
+    # The 0 leaves the window at 3s and the mean becomes 60, without a new
+    # message
+    assert cool.expiry_delay() == pytest.approx(1)
+    weather.clock.now = 3
+    assert cool.expiry_delay() == 0
+    assert weather.expire()
+    assert cool.evaluate_condition()[0]
+
+
+MESSAGES = [
+    (0, "weather", {"temp": 0}),
+    (1, "weather", {"temp": 60}),
+    (2, "weather", {"temp": 60}),
+]
+
+
+@pytest.mark.parametrize("mode", ["event", "poll"])
+def test_expiry_wakes_automation(build, mode):
+    model = build(MODEL.replace("trigger: edge", f"trigger: edge\n    mode: {mode}"))
+    simulation = Simulation(model)
+    simulation.add_messages(MESSAGES)
+    published = simulation.run(10)
+    # Fires when the 0 leaves the window, without a new message
+    assert published == [(pytest.approx(3.0), "fan", {"on": True})]
+
+
+def test_unchanged_value_notifies_duration_window(build):
+    weather, cool = build_window(build)
+    weather.update_state({"temp": 60})
+    cool.scheduler.due()
+    weather.update_state({"temp": 60})
+    assert cool.notified
+
+
+def test_expire_empties_window(build):
+    weather, cool = build_window(build)
+    (mean,) = weather.aggregates
+    weather.update_state({"temp": 50})
+    assert mean.value == 50
+    assert weather.next_expiry() == pytest.approx(3)
+    version = weather.version
+    assert weather.expire(3)
+    assert mean.value == 0
+    assert weather.version == version + 1
+    assert weather.next_expiry() is None
+    assert cool.expiry_delay() is None
+    assert not weather.expire(4)
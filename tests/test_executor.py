@@ -0,0 +1,103 @@
+import importlib.util
+import threading
+import time
+
+from commlib.node import Node
+from commlib.transports.mock import ConnectionParameters
+
+from smauto.lib.automation import AutomationRuntime
+from smauto.lib.profiler import Profiler
+from smauto.transformations import smauto_m2t
+
+from conftest import HEADER
+
+MODEL = """
+Entity weather
+    type: sensor
+    topic: "weather"
+    broker: home_broker
+    attributes:
+        - temp: float
+end
+Entity fan
+    type: actuator
+    topic: "fan"
+    broker: home_broker
+    attributes:
+        - on: bool
+end
+Automation cool
+    condition:
+        weather.temp > 30
+    actions:
+        - fan.on: true
+end
+Automation warm
+    condition:
+        weather.temp < 10
+    actions:
+        - fan.on: false
+    after:
+        - cool
+end
+"""
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def generate(tmp_path):
+    """Compiles the model and imports the executor, on the mock transport."""
+    model_path = tmp_path / "model.auto"
+    model_path.write_text(HEADER + MODEL)
+    code = smauto_m2t(str(model_path)).replace(
+        "commlib.transports.mqtt", "commlib.transports.mock"
+    )
+    path = tmp_path / "executor.py"
+    path.write_text(code)
+    spec = importlib.util.spec_from_file_location("executor", str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_executor_runs_automations(tmp_path):
+    module = generate(tmp_path)
+    executor = module.Executor()
+    autos = executor.autos_map
+    assert isinstance(autos["warm"], AutomationRuntime)
+    assert autos["warm"].after == [autos["cool"]]
+    node = Node(connection_params=ConnectionParameters(), heartbeats=False)
+    received = []
+    node.create_subscriber(topic="fan", on_message=received.append).run()
+    executor.start_entities()
+    thread = threading.Thread(target=executor.start_automations, daemon=True)
+    thread.start()
+    wait_for(lambda: getattr(executor, "scheduler", None) is not None)
+    node.create_publisher(topic="weather").publish({"temp": 40.0})
+    wait_for(lambda: {"on": True} in received)
+    module.terminate_event.set()
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+def test_executor_dumps_profile(tmp_path):
+    module = generate(tmp_path)
+    path = str(tmp_path / "profile.json")
+    executor = module.Executor(profile_path=path)
+    executor.start_entities()
+    thread = threading.Thread(target=executor.start_automations, daemon=True)
+    thread.start()
+    wait_for(lambda: getattr(executor, "scheduler", None) is not None)
+    node = Node(connection_params=ConnectionParameters(), heartbeats=False)
+    node.create_publisher(topic="weather").publish({"temp": 40.0})
+    wait_for(lambda: executor.profiler.profile("cool").triggers == 1)
+    module.terminate_event.set()
+    thread.join(10)
+    profile = Profiler.load(path).profile("cool")
+    assert profile.triggers == 1
+    assert profile.evaluations >= 1
@@ -0,0 +1,125 @@
+import pytest
+
+from smauto.lib.network import ConditionNetwork, NetworkNode
+
+from conftest import automations_of, entities_of
+
+MODEL = """
+Entity weather
+    type: sensor
+    topic: "weather"
+    broker: home_broker
+    attributes:
+        - temp: float
+        - humidity: float
+end
+Entity fan
+    type: actuator
+    topic: "fan"
+    broker: home_broker
+    attributes:
+        - on: bool
+end
+Automation hot
+    condition:
+        weather.temp > 30
+    actions:
+        - fan.on: true
+end
+Automation also_hot
+    condition:
+        weather.temp > 30
+    actions:
+        - fan.on: true
+end
+Automation mild
+    condition:
+        (weather.temp in range [15, 25]) AND (weather.humidity < 60)
+    actions:
+        - fan.on: false
+end
+Automation windowed
+    condition:
+        mean(weather.temp, 3) > 30
+    actions:
+        - fan.on: true
+end
+"""
+
+
+@pytest.fixture
+def network(build):
+    model = build(MODEL)
+    network = ConditionNetwork.of(model)
+    for automation in model.automations:
+        automation.condition.build()
+        network.add(automation.condition)
+    return model, network
+
+
+def truths(model):
+    return {
+        name: automation.condition.evaluate()[0]
+        for name, automation in automations_of(model).items()
+    }
+
+
+def test_supported_conditions(network):
+    model, network = network
+    assert sorted(network.roots) == ["also_hot", "hot", "mild"]
+    autos = automations_of(model)
+    assert autos["windowed"].condition.network_node is None
+    # Identical comparisons share a node
+    assert (
+        autos["hot"].condition.network_node is autos["also_hot"].condition.network_node
+    )
+
+
+def test_truth_maintained_on_updates(network):
+    model, network = network
+    weather = entities_of(model)["weather"]
+    weather.update_state({"temp": 20, "humidity": 50})
+    assert truths(model) == {
+        "hot": False,
+        "also_hot": False,
+        "mild": True,
+        "windowed": False,
+    }
+    weather.update_state({"temp": 35, "humidity": 50})
+    assert truths(model)["hot"] and not truths(model)["mild"]
+    weather.update_state({"temp": 35, "humidity": 50})
+    weather.update_state({"temp": 35, "humidity": 50})
+    assert truths(model)["windowed"]
+    weather.update_state({"temp": 20, "humidity": 70})
+    assert not truths(model)["mild"]
+    weather.update_state({"temp": 22, "humidity": 10})
+    assert truths(model)["mild"]
+
+
+def test_only_crossed_thresholds_refresh(network):
+    model, network = network
+    weather = entities_of(model)["weather"]
+    weather.update_state({"temp": 10, "humidity": 50})
+    index = weather.attr_index["temp"]
+    refreshed = []
+    for node in index.nodes:
+        node.refresh = lambda node=node: refreshed.append(node)
+    weather.update_state({"temp": 12, "humidity": 50})
+    assert refreshed == []
+    weather.update_state({"temp": 20, "humidity": 50})
+    assert [node.__class__.__name__ for node in refreshed] == ["RangeNode"]
+
+
+def test_invalid_value_is_false(network):
+    model, network = network
+    weather = entities_of(model)["weather"]
+    weather.update_state({"temp": 35, "humidity": 50})
+    weather.update_state({"temp": None, "humidity": 50})
+    assert not truths(model)["hot"]
+    weather.update_state({"temp": 35, "humidity": 50})
+    assert truths(model)["hot"]
+
+
+def test_network_node_is_abstract():
+    with pytest.raises(TypeError):
+        NetworkNode()
@@ -0,0 +1,152 @@
+import threading
+import time
+
+import pytest
+
+from smauto.lib.outbox import ActionOutbox, PublishQueue
+from smauto.lib.profiler import QueueMetrics
+
+
+class Entity(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class Recorder(object):
+    """Publishes by recording, optionally blocking until released."""
+
+    def __init__(self, blocked=False):
+        self.sent = []
+        self.released = threading.Event()
+        if not blocked:
+            self.released.set()
+
+    def __call__(self, entity, message):
+        self.released.wait()
+        self.sent.append((entity.name, message))
+
+
+class RecordingOutbox(ActionOutbox):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.sent = []
+
+    def publish(self, entity, message):
+        self.sent.append((entity.name, message))
+
+
+def test_outbox_merges_messages_per_entity():
+    outbox = RecordingOutbox()
+    lamp = Entity("lamp")
+    outbox.put(lamp, {"power": True}, "a1")
+    outbox.put(lamp, {"color": "red"}, "a2")
+    outbox.flush()
+    assert outbox.sent == [("lamp", {"power": True, "color": "red"})]
+    assert outbox.conflicts == 0
+
+
+@pytest.mark.parametrize("policy,expected", [("last", False), ("first", True)])
+def test_outbox_conflict_policy(policy, expected):
+    outbox = RecordingOutbox(policy=policy)
+    lamp = Entity("lamp")
+    outbox.put(lamp, {"power": True}, "a1")
+    outbox.put(lamp, {"power": False}, "a2")
+    outbox.flush()
+    assert outbox.sent == [("lamp", {"power": expected})]
+
+
+def test_outbox_conflicts_are_counted_and_reported_once(capsys):
+    outbox = RecordingOutbox()
+    lamp = Entity("lamp")
+    for _ in range(100):
+        outbox.put(lamp, {"power": True, "color": "red"}, "a1")
+        outbox.put(lamp, {"power": False, "color": "blue"}, "a2")
+        outbox.flush()
+    assert outbox.conflicts == 200
+    assert outbox.attr_conflicts == {"lamp.power": 100, "lamp.color": 100}
+    assert capsys.readouterr().out.count("Conflicting actions") == 2
+
+
+def test_outbox_window():
+    now = [0.0]
+    outbox = RecordingOutbox(window=1.0, clock=lambda: now[0])
+    lamp = Entity("lamp")
+    outbox.put(lamp, {"power": True}, "a1")
+    assert outbox.next_deadline() == 1.0
+    outbox.flush()
+    assert outbox.sent == []
+    now[0] = 1.0
+    outbox.flush()
+    assert outbox.sent == [("lamp", {"power": True})]
+    assert outbox.next_deadline() is None
+
+
+def test_queue_drop_oldest():
+    recorder = Recorder(blocked=True)
+    queue = PublishQueue(recorder, capacity=2, batch_size=1, overflow="drop-oldest")
+    lamps = [Entity(f"lamp{i}") for i in range(5)]
+    queue.put(lamps[0], {"power": 0})
+    # Wait for the worker to take the first message
+    while queue.in_flight == 0:
+        time.sleep(0.001)
+    for lamp in lamps[1:]:
+        queue.put(lamp, {"power": 1})
+    assert queue.metrics.dropped == 2
+    recorder.released.set()
+    assert queue.drain(5)
+    assert [name for name, _ in recorder.sent] == ["lamp0", "lamp3", "lamp4"]
+
+
+def test_queue_coalesce_latest():
+    recorder = Recorder(blocked=True)
+    queue = PublishQueue(recorder, capacity=4, batch_size=1, overflow="coalesce-latest")
+    lamp, fan = Entity("lamp"), Entity("fan")
+    queue.put(fan, {"on": True})
+    while queue.in_flight == 0:
+        time.sleep(0.001)
+    queue.put(lamp, {"power": True})
+    queue.put(lamp, {"color": "red"})
+    queue.put(lamp, {"power": False})
+    assert queue.metrics.coalesced == 2
+    recorder.released.set()
+    assert queue.drain(5)
+    assert recorder.sent == [
+        ("fan", {"on": True}),
+        ("lamp", {"power": False, "color": "red"}),
+    ]
+
+
+def test_queue_block():
+    recorder = Recorder(blocked=True)
+    queue = PublishQueue(recorder, capacity=1, batch_size=1, overflow="block")
+    lamps = [Entity(f"lamp{i}") for i in range(3)]
+    queue.put(lamps[0], {"power": 0})
+    while queue.in_flight == 0:
+        time.sleep(0.001)
+    queue.put(lamps[1], {"power": 1})
+    blocked = threading.Thread(target=queue.put, args=(lamps[2], {"power": 2}))
+    blocked.start()
+    blocked.join(0.1)
+    assert blocked.is_alive()
+    recorder.released.set()
+    blocked.join(5)
+    assert queue.drain(5)
+    assert [name for name, _ in recorder.sent] == ["lamp0", "lamp1", "lamp2"]
+    assert queue.metrics.dropped == 0
+    assert queue.metrics.published == 3
+
+
+def test_unknown_policies():
+    with pytest.raises(ValueError):
+        PublishQueue(print, overflow="spill")
+    with pytest.raises(ValueError):
+        ActionOutbox(policy="random")
+
+
+def test_queue_metrics_round_trip():
+    metrics = QueueMetrics("home_broker")
+    metrics.dropped = 3
+    metrics.record_depth(5)
+    restored = QueueMetrics.from_dict(metrics.to_dict())
+    assert restored.dropped == 3
+    assert restored.max_depth == 5
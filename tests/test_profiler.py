@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from smauto.lib.outbox import ActionOutbox
+from smauto.lib.profiler import LatencyHistogram, Profiler
+from smauto.lib.scheduler import AutomationScheduler
+
+from conftest import automations_of, entities_of
+
+MODEL = """
+Entity weather
+    type: sensor
+    topic: "weather"
+    broker: home_broker
+    attributes:
+        - temp: float
+end
+Entity fan
+    type: actuator
+    topic: "fan"
+    broker: home_broker
+    attributes:
+        - on: bool
+end
+Automation cool
+    condition:
+        weather.temp > 30
+    actions:
+        - fan.on: true
+end
+"""
+
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram()
+    for value in range(1, 1001):
+        histogram.record(value)
+    assert histogram.percentile(50) == pytest.approx(500, rel=1 / 16)
+    assert histogram.percentile(99) == pytest.approx(990, rel=1 / 16)
+    assert histogram.mean == pytest.approx(500.5)
+
+
+def test_records_evaluations(build):
+    model = build(MODEL)
+    automation = automations_of(model)["cool"]
+    automation.build_condition()
+    weather = entities_of(model)["weather"]
+    for temp in (35, 20, 40):
+        weather.update_state({"temp": temp})
+        automation.evaluate_condition()
+    profile = Profiler.of(model).profile("cool")
+    assert profile.evaluations == 3
+    assert profile.true_ratio == pytest.approx(2 / 3)
+
+
+def scheduler_of(model, path):
+    scheduler = AutomationScheduler(
+        outbox=ActionOutbox.of(model), profile_path=str(path)
+    )
+    for automation in model.automations:
+        scheduler.add(automation)
+    return scheduler
+
+
+def test_dump_on_stop(build, tmp_path):
+    model = build(MODEL)
+    path = tmp_path / "profile.json"
+    scheduler = scheduler_of(model, path)
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while Profiler.of(model).profile("cool").evaluations == 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    scheduler.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+    profile = Profiler.load(str(path)).profiles["cool"]
+    assert profile.evaluations >= 1
+    assert profile.triggers == 0
+
+
+def test_dump_on_interrupt(build, tmp_path):
+    model = build(MODEL)
+    path = tmp_path / "profile.json"
+    scheduler = scheduler_of(model, path)
+
+    async def interrupted():
+        raise KeyboardInterrupt
+
+    scheduler.run_loop = interrupted
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.run()
+    assert "cool" in Profiler.load(str(path)).profiles
+
+
+def test_no_dump_without_path(build, tmp_path):
+    model = build(MODEL)
+    scheduler = AutomationScheduler(outbox=ActionOutbox.of(model))
+    scheduler.stop()
+    scheduler.run()
+    assert list(tmp_path.iterdir()) == [tmp_path / "model.auto"]
+
+
+def test_dump_round_trip(tmp_path):
+    profiler = Profiler()
+    profile = profiler.profile("cool")
+    for result in (True, False, False):
+        profile.evaluation.record(1000)
+        profile.evaluations += 1
+        profile.true_count += result
+    profiler.queue("home_broker").record_depth(3)
+    path = str(tmp_path / "profile.json")
+    profiler.dump(path)
+    loaded = Profiler.load(path)
+    assert loaded.summary() == profiler.summary()
+    assert loaded.queue_summary() == profiler.queue_summary()
@@ -0,0 +1,132 @@
+import threading
+
+import pytest
+from textx.exceptions import TextXSyntaxError
+
+from smauto.lib.reload import ModelDiff, ModelReloader
+from smauto.lib.scheduler import AutomationScheduler
+
+from conftest import HEADER, automations_of, entities_of
+
+ENTITIES = """
+Entity weather
+    type: sensor
+    topic: "weather"
+    broker: home_broker
+    attributes:
+        - temp: float
+end
+Entity fan
+    type: actuator
+    topic: "fan"
+    broker: home_broker
+    attributes:
+        - on: bool
+end
+"""
+
+AUTOMATIONS = """
+Automation cool
+    condition:
+        mean(weather.temp, 3) > {threshold}
+    actions:
+        - fan.on: true
+end
+Automation warm
+    condition:
+        weather.temp < 10
+    actions:
+        - fan.on: false
+end
+"""
+
+
+@pytest.fixture
+def reloader(build, tmp_path):
+    model = build(ENTITIES + AUTOMATIONS.format(threshold=30))
+    scheduler = AutomationScheduler.of(model)
+    for automation in model.automations:
+        scheduler.add(automation)
+    return ModelReloader(model, scheduler)
+
+
+def rewrite(reloader, text):
+    with open(reloader.model_path, "w") as fp:
+        fp.write(HEADER + text)
+
+
+def test_diff(reloader):
+    rewrite(reloader, ENTITIES + AUTOMATIONS.format(threshold=40))
+    diff = reloader.reload()
+    assert diff.automations["changed"] == ["cool"]
+    assert diff.automations["unchanged"] == ["warm"]
+    assert diff.entities["changed"] == []
+
+
+def test_keeps_entities_and_windows(reloader):
+    weather = entities_of(reloader.model)["weather"]
+    for temp in (30, 35, 40):
+        weather.update_state({"temp": temp})
+    warm = automations_of(reloader.model)["warm"]
+    warm.enabled = False
+    rewrite(reloader, ENTITIES + AUTOMATIONS.format(threshold=34))
+    reloader.reload()
+    autos = automations_of(reloader.model)
+    assert entities_of(reloader.model)["weather"] is weather
+    # The new window aggregate is refilled from the kept buffer
+    assert autos["cool"].condition.evaluate()[0]
+    # Unchanged Automations keep their runtime state
+    assert autos["warm"] is not warm
+    assert not autos["warm"].enabled
+    assert sorted(a.name for a in reloader.scheduler.automations) == ["cool", "warm"]
+
+
+def test_updates_wait_for_the_rebuild(reloader, monkeypatch):
+    weather = entities_of(reloader.model)["weather"]
+    for temp in (30, 35):
+        weather.update_state({"temp": temp})
+    swap = reloader.swap
+    updates = []
+
+    def swap_during_update(*args):
+        # An update from a subscriber thread while the conditions are rebuilt
+        update = threading.Thread(target=weather.update_state, args=({"temp": 40},))
+        update.start()
+        update.join(0.2)
+        updates.append(update)
+        assert update.is_alive()
+        swap(*args)
+
+    monkeypatch.setattr(reloader, "swap", swap_during_update)
+    rewrite(reloader, ENTITIES + AUTOMATIONS.format(threshold=34))
+    reloader.reload()
+    updates[0].join()
+    # The update reaches the new window aggregate after the replay
+    assert automations_of(reloader.model)["cool"].condition.evaluate()[0]
+
+
+def test_removed_automation(reloader):
+    rewrite(
+        reloader,
+        ENTITIES + AUTOMATIONS.format(threshold=30).split("Automation warm")[0],
+    )
+    diff = reloader.reload()
+    assert diff.automations["removed"] == ["warm"]
+    assert [a.name for a in reloader.scheduler.automations] == ["cool"]
+
+
+def test_invalid_model_is_not_applied(reloader):
+    model = reloader.model
+    rewrite(reloader, ENTITIES + "Automation broken")
+    with pytest.raises(TextXSyntaxError):
+        reloader.reload()
+    assert reloader.model is model
+    assert len(reloader.scheduler.automations) == 2
+
+
+def test_entity_signature(build):
+    old = build(ENTITIES, "old.auto")
+    new = build(ENTITIES.replace('topic: "fan"', 'topic: "fan2"'), "new.auto")
+    diff = ModelDiff(old, new)
+    assert diff.entities["changed"] == ["fan"]
+    assert diff.entities["unchanged"] == ["weather"]
@@ -0,0 +1,148 @@
+import threading
+import time
+
+from commlib.node import Node
+from commlib.transports.mock import ConnectionParameters
+
+from smauto.language import build_model
+from smauto.lib.runner import ModelRunner
+
+from conftest import HEADER, entities_of
+
+ENTITIES = """
+Entity weather
+    type: sensor
+    topic: "weather"
+    broker: home_broker
+    attributes:
+        - temp: float
+end
+Entity fan
+    type: actuator
+    topic: "fan"
+    broker: home_broker
+    attributes:
+        - on: bool
+end
+"""
+
+AUTOMATION = """
+Automation cool
+    condition:
+        weather.temp > {threshold}
+    actions:
+        - fan.on: true
+end
+"""
+
+OUTBOX = """
+Outbox
+    capacity: 8
+    batch: 4
+    overflow: drop-oldest
+end
+"""
+
+
+def mock_params(broker):
+    return ConnectionParameters()
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class Bus(object):
+    """Publishes Entity messages and records the action messages."""
+
+    def __init__(self, topics):
+        self.node = Node(connection_params=ConnectionParameters(), heartbeats=False)
+        self.received = []
+        self.publishers = {}
+        for topic in topics:
+            sub = self.node.create_subscriber(
+                topic=topic,
+                on_message=lambda msg, topic=topic: self.received.append((topic, msg)),
+            )
+            sub.run()
+
+    def publish(self, topic, message):
+        if topic not in self.publishers:
+            self.publishers[topic] = self.node.create_publisher(topic=topic)
+        self.publishers[topic].publish(message)
+
+
+def start(runner):
+    thread = threading.Thread(target=runner.run, daemon=True)
+    thread.start()
+    wait_for(lambda: runner.scheduler.loop is not None and len(runner.nodes) > 0)
+    return thread
+
+
+def test_run_connects_entities(tmp_path):
+    path = tmp_path / "model.auto"
+    path.write_text(HEADER + ENTITIES + AUTOMATION.format(threshold=30))
+    runner = ModelRunner(build_model(str(path)), connection_params=mock_params)
+    bus = Bus(["fan"])
+    thread = start(runner)
+    assert sorted(entity.name for entity in runner.nodes) == ["fan", "weather"]
+    bus.publish("weather", {"temp": 40})
+    wait_for(lambda: ("fan", {"on": True}) in bus.received)
+    assert entities_of(runner.model)["weather"].attributes_dict["temp"].value == 40
+    runner.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert runner.nodes == {}
+
+
+def test_reload_reconnects_entities(tmp_path):
+    path = tmp_path / "model.auto"
+    path.write_text(HEADER + ENTITIES + AUTOMATION.format(threshold=30))
+    runner = ModelRunner(build_model(str(path)), connection_params=mock_params)
+    thread = start(runner)
+    kept = entities_of(runner.model)["weather"]
+    old_fan = entities_of(runner.model)["fan"]
+    # Change the fan's topic and add a lamp
+    changed = ENTITIES.replace('topic: "fan"', 'topic: "fan2"')
+    lamp = ENTITIES.split("Entity fan")[0].replace("weather", "lamp")
+    path.write_text(HEADER + changed + lamp + AUTOMATION.format(threshold=50))
+    diff = runner.reloader.reload()
+    assert diff.entities["changed"] == ["fan"]
+    assert diff.entities["added"] == ["lamp"]
+    assert runner.model is runner.reloader.model
+    names = {entity.name: entity for entity in runner.nodes}
+    assert sorted(names) == ["fan", "lamp", "weather"]
+    assert names["weather"] is kept
+    assert names["fan"] is not old_fan
+    assert names["fan"].topic == "fan2"
+    bus = Bus(["fan2"])
+    bus.publish("weather", {"temp": 40})
+    time.sleep(0.2)
+    assert bus.received == []
+    bus.publish("weather", {"temp": 60})
+    wait_for(lambda: ("fan2", {"on": True}) in bus.received)
+    runner.stop()
+    thread.join(5)
+
+
+def test_reload_configures_outbox(tmp_path):
+    path = tmp_path / "model.auto"
+    path.write_text(HEADER + ENTITIES + AUTOMATION.format(threshold=30))
+    runner = ModelRunner(build_model(str(path)), connection_params=mock_params)
+    thread = start(runner)
+    Bus([]).publish("weather", {"temp": 40})
+    outbox = runner.scheduler.outbox
+    wait_for(lambda: len(outbox.queues) == 1)
+    path.write_text(HEADER + OUTBOX + ENTITIES + AUTOMATION.format(threshold=30))
+    runner.reloader.reload()
+    for target in [outbox] + list(outbox.queues.values()):
+        assert (target.capacity, target.batch_size, target.overflow) == (
+            8,
+            4,
+            "drop-oldest",
+        )
+    runner.stop()
+    thread.join(5)
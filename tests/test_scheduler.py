@@ -0,0 +1,258 @@
+from pathlib import Path
+
+import pytest
+
+from smauto.language import build_model
+from smauto.lib.automation import AutomationState
+from smauto.lib.scheduler import AutomationScheduler
+from smauto.lib.simulation import Simulation
+
+from conftest import automations_of, entities_of
+
+MODEL = """
+Entity weather
+    type: sensor
+    topic: "weather"
+    broker: home_broker
+    attributes:
+        - temp: float
+end
+Entity fan
+    type: actuator
+    topic: "fan"
+    broker: home_broker
+    attributes:
+        - on: bool
+end
+Automation cool
+    condition:
+        {condition}
+    mode: {mode}
+    actions:
+        - fan.on: true
+end
+"""
+
+
+class FakeClock(object):
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def schedule(build, condition, mode):
+    model = build(MODEL.format(condition=condition, mode=mode))
+    clock = FakeClock()
+    scheduler = AutomationScheduler(clock=clock)
+    cool = automations_of(model)["cool"]
+    triggers = []
+    cool.trigger_actions = lambda: triggers.append(clock())
+    scheduler.add(cool)
+    return scheduler, entities_of(model)["weather"], triggers
+
+
+def run_due(scheduler):
+    for automation in scheduler.due():
+        scheduler.run_step(automation)
+
+
+def test_poll_deadlines(build):
+    scheduler, weather, triggers = schedule(build, "weather.temp > 30", "poll")
+    weather.update_state({"temp": 40})
+    for _ in range(3):
+        run_due(scheduler)
+        scheduler.clock.now += 1
+    assert triggers == [0, 1, 2]
+    assert scheduler.next_timeout() == 0
+
+
+@pytest.mark.parametrize("overrun, deadline", [("skip", 4), ("catch-up", 3.5)])
+def test_overrun_policy(build, overrun, deadline):
+    scheduler, weather, triggers = schedule(
+        build, "weather.temp > 30", f"poll\n    overrun: {overrun}"
+    )
+    cool = scheduler.automations[0]
+
+    def overrun_actions():
+        # The actions take 2.5 periods
+        triggers.append(scheduler.clock())
+        scheduler.clock.now += 2.5
+
+    cool.trigger_actions = overrun_actions
+    weather.update_state({"temp": 20})
+    run_due(scheduler)
+    scheduler.clock.now = 1
+    weather.update_state({"temp": 40})
+    run_due(scheduler)
+    assert cool.timer.policy == overrun
+    assert cool.timer.overruns == 1
+    # Skipping the missed tick waits for the next one, catching up runs it
+    assert scheduler.deadlines[0][0] == deadline
+
+
+def test_event_automation_runs_when_notified(build):
+    scheduler, weather, triggers = schedule(build, "weather.temp > 30", "event")
+    run_due(scheduler)
+    assert scheduler.deadlines == []
+    assert scheduler.next_timeout() is None
+    weather.update_state({"temp": 40})
+    assert scheduler.next_timeout() == 0
+    run_due(scheduler)
+    assert triggers == [0]
+
+
+@pytest.mark.parametrize("mode", ["poll", "event"])
+def test_error_keeps_automation_scheduled(build, mode):
+    # The None value makes the condition raise a TypeError
+    scheduler, weather, triggers = schedule(build, "math(weather.temp * 2) > 60", mode)
+    weather.update_state({"temp": None})
+    run_due(scheduler)
+    assert (len(scheduler.deadlines) == 1) == (mode == "poll")
+    scheduler.clock.now += 1
+    weather.update_state({"temp": 40})
+    run_due(scheduler)
+    assert triggers == [1]
+    assert scheduler.automations[0].state == AutomationState.EXITED_SUCCESS
+
+
+def test_errors_are_reported_once_per_type(build, capsys):
+    scheduler, weather, triggers = schedule(
+        build, "math(weather.temp * 2) > 60", "poll"
+    )
+    weather.update_state({"temp": None})
+    for _ in range(3):
+        run_due(scheduler)
+        scheduler.clock.now += 1
+    assert scheduler.automations[0].errors == {"TypeError": 3}
+    assert capsys.readouterr().out.count("[ERROR]") == 1
+    scheduler.report_errors()
+    assert "cool: 3 TypeError" in capsys.readouterr().out
+
+
+def simulate(model, messages, duration):
+    simulation = Simulation(model)
+    simulation.add_messages(messages)
+    return simulation.run(duration)
+
+
+def test_network_condition_with_invalid_value(build):
+    model = build(
+        MODEL.format(condition="weather.temp > 30", mode="poll\n    trigger: edge")
+    )
+    messages = [(0.5, "weather", {"temp": None}), (2.5, "weather", {"temp": 40})]
+    published = simulate(model, messages, 5)
+    assert [(name, message) for _, name, message in published] == [
+        ("fan", {"on": True})
+    ]
+
+
+def test_poll_frequency(build):
+    model = build(MODEL.format(condition="weather.temp > 30", mode="poll\n    freq: 4"))
+    published = simulate(model, [(0, "weather", {"temp": 40})], 2)
+    # Level triggered, polled at 4 Hz from 0s to 2s
+    assert len(published) == 9
+    assert published[1][0] == pytest.approx(0.25)
+
+
+def test_event_automation_runs_on_updates_only(build):
+    model = build(MODEL.format(condition="weather.temp > 30", mode="event"))
+    messages = [
+        (1, "weather", {"temp": 40}),
+        (2, "weather", {"temp": 20}),
+        (3, "weather", {"temp": 35}),
+    ]
+    published = simulate(model, messages, 10)
+    assert [offset for offset, _, _ in published] == [
+        pytest.approx(1.0),
+        pytest.approx(3.0),
+    ]
+
+
+def test_edge_trigger(build):
+    model = build(
+        MODEL.format(condition="weather.temp > 30", mode="event\n    trigger: edge")
+    )
+    messages = [
+        (1, "weather", {"temp": 40}),
+        (2, "weather", {"temp": 45}),
+        (3, "weather", {"temp": 20}),
+        (4, "weather", {"temp": 35}),
+    ]
+    published = simulate(model, messages, 10)
+    assert [round(offset, 3) for offset, _, _ in published] == [1, 4]
+
+
+@pytest.mark.parametrize("mode", ["poll", "event"])
+def test_edge_trigger_rearm(build, mode):
+    # Event-driven Automations are woken up to re-arm, without updates
+    model = build(
+        MODEL.format(
+            condition="weather.temp > 30",
+            mode=f"{mode}\n    trigger: edge\n    rearm: 2",
+        )
+    )
+    published = simulate(model, [(0, "weather", {"temp": 40})], 6.5)
+    assert [round(offset, 3) for offset, _, _ in published] == [0, 2, 4, 6]
+
+
+AFTER_MODEL = """
+Entity weather
+    type: sensor
+    topic: "weather"
+    broker: home_broker
+    attributes:
+        - temp: float
+end
+Entity lamp
+    type: actuator
+    topic: "lamp"
+    broker: home_broker
+    attributes:
+        - on: bool
+end
+Automation first
+    condition:
+        weather.temp > 50
+    actions:
+        - lamp.on: false
+end
+Automation second
+    condition:
+        weather.temp > 30
+    actions:
+        - lamp.on: true
+    after:
+        - first
+end
+"""
+
+
+def test_after_waits_for_dependency(build):
+    model = build(AFTER_MODEL)
+    autos = automations_of(model)
+    scheduler = AutomationScheduler(clock=FakeClock())
+    triggers = []
+    autos["second"].trigger_actions = lambda: triggers.append("second")
+    scheduler.add(autos["second"])
+    autos["first"].set_state(AutomationState.RUNNING)
+    entities_of(model)["weather"].update_state({"temp": 40})
+    run_due(scheduler)
+    # second waits until first stops running, without polling
+    assert autos["second"].waiting
+    assert scheduler.next_timeout() is None
+    autos["first"].set_state(AutomationState.IDLE)
+    run_due(scheduler)
+    assert triggers == ["second"]
+
+
+def test_self_start_is_paced_by_freq():
+    # A continuous: false Automation enabling itself through starts
+    path = Path(__file__).parents[1] / "examples" / "self_start" / "model.auto"
+    simulation = Simulation(build_model(str(path)))
+    simulation.add_messages(
+        [(0.5, "motion_detector", {"detected": True, "posX": 6, "posY": 0})]
+    )
+    published = simulation.run(5)
+    assert [round(offset, 3) for offset, _, _ in published] == [0.5, 1.5, 2.5, 3.5, 4.5]
@@ -0,0 +1,146 @@
+import os
+import time
+
+import pytest
+from commlib.transports.mock import ConnectionParameters
+
+from smauto.lib.runner import ModelRunner
+from smauto.lib.sharding import ShardedExecutor, partition
+
+MODEL = """
+Entity sensor_a
+    type: sensor
+    topic: "sensor.a"
+    broker: home_broker
+    attributes:
+        - x: float
+end
+Entity sensor_b
+    type: sensor
+    topic: "sensor.b"
+    broker: home_broker
+    attributes:
+        - x: float
+end
+Entity shared
+    type: sensor
+    topic: "shared"
+    broker: home_broker
+    attributes:
+        - on: bool
+end
+Entity lamp
+    type: actuator
+    topic: "lamp"
+    broker: home_broker
+    attributes:
+        - on: bool
+end
+Entity fan
+    type: actuator
+    topic: "fan"
+    broker: home_broker
+    attributes:
+        - on: bool
+end
+Automation lamp_on
+    condition:
+        (sensor_a.x > 1) AND (shared.on is true)
+    actions:
+        - lamp.on: true
+end
+Automation lamp_off
+    condition:
+        sensor_a.x < 0
+    actions:
+        - lamp.on: false
+end
+Automation fan_on
+    condition:
+        (sensor_b.x > 1) AND (shared.on is true)
+    actions:
+        - fan.on: true
+end
+"""
+
+
+def mock_params(broker):
+    return ConnectionParameters()
+
+
+def names(shards):
+    return sorted(sorted(shard["automations"]) for shard in shards)
+
+
+def test_writers_stay_together(build):
+    graph = ShardedExecutor.graph(build(MODEL))
+    shards = partition(graph, 3, "balanced")
+    assert names(shards) == [["fan_on"], ["lamp_off", "lamp_on"]]
+    fan = [shard for shard in shards if shard["automations"] == ["fan_on"]][0]
+    assert sorted(fan["entities"]) == ["fan", "sensor_b", "shared"]
+
+
+def test_components_keep_readers_together(build):
+    graph = ShardedExecutor.graph(build(MODEL))
+    assert names(partition(graph, 3, "components")) == [
+        ["fan_on", "lamp_off", "lamp_on"]
+    ]
+
+
+def test_peers_stay_together():
+    graph = {
+        name: {"reads": [name], "writes": [], "peers": peers, "weight": 1}
+        for name, peers in (("a", ["b"]), ("b", []), ("c", []))
+    }
+    assert names(partition(graph, 3)) == [["a", "b"], ["c"]]
+
+
+def test_balanced_by_weight():
+    graph = {
+        name: {"reads": ["s"], "writes": [name], "peers": [], "weight": weight}
+        for name, weight in (("a", 5), ("b", 3), ("c", 2), ("d", 1))
+    }
+    shards = partition(graph, 2)
+    assert sorted(shard["weight"] for shard in shards) == [5, 6]
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        partition({}, 2, "random")
+
+
+def test_runner_builds_only_its_shard(build):
+    model = build(MODEL)
+    shard = [
+        shard
+        for shard in partition(ShardedExecutor.graph(model), 2)
+        if "fan_on" in shard["automations"]
+    ][0]
+    runner = ModelRunner(model, connection_params=mock_params, shard=shard)
+    assert [a.name for a in runner.automations()] == ["fan_on"]
+    for entity in runner.entities():
+        runner.connect(entity)
+    assert sorted(entity.name for entity in runner.nodes) == [
+        "fan",
+        "sensor_b",
+        "shared",
+    ]
+    for entity in list(runner.nodes):
+        runner.disconnect(entity)
+
+
+def test_workers_connect_after_fork(build, tmp_path):
+    model = build(MODEL)
+    path = str(tmp_path / "profile.json")
+    executor = ShardedExecutor(
+        model, 2, profile_path=path, connection_params=mock_params
+    )
+    executor.start()
+    time.sleep(1.0)
+    # Nothing was connected in the parent process
+    assert not any(hasattr(entity, "publisher") for entity in model.entities)
+    executor.stop(10)
+    assert [worker.exitcode for worker in executor.workers] == [0, 0]
+    # Each worker dumps the profile of its shard
+    for shard in executor.shards:
+        assert os.path.exists(f"{path}.{shard['automations'][0]}")
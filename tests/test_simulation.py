@@ -0,0 +1,88 @@
+import json
+from datetime import datetime
+
+from smauto.lib.simulation import Simulation
+
+MODEL = """
+Entity weather
+    type: sensor
+    topic: "weather"
+    broker: home_broker
+    attributes:
+        - temp: float
+end
+Entity lamp
+    type: actuator
+    topic: "lamp"
+    broker: home_broker
+    attributes:
+        - on: bool
+end
+Automation night
+    condition:
+        system_clock.time >= 22:00
+    trigger: edge
+    actions:
+        - lamp.on: true
+end
+Automation hot
+    condition:
+        mean(weather.temp, 4) > 30
+    trigger: edge
+    actions:
+        - lamp.on: false
+end
+"""
+
+START = datetime(2024, 1, 1)
+
+
+def run(build, messages=(), duration=86400):
+    simulation = Simulation(build(MODEL), start=START)
+    simulation.add_messages(messages)
+    return simulation.run(duration)
+
+
+def test_time_condition(build):
+    published = run(build)
+    assert published == [(22 * 3600, "lamp", {"on": True})]
+
+
+def test_window_on_generated_messages(build):
+    simulation = Simulation(build(MODEL), start=START)
+    simulation.add_generator(
+        "weather", 1, lambda offset: {"temp": 20 if offset < 10 else 40}, until=20
+    )
+    published = simulation.run(60)
+    # The mean of the last 4 samples exceeds 30 with the third sample of 40
+    assert [(round(offset, 3), message) for offset, _, message in published] == [
+        (12, {"on": False})
+    ]
+
+
+def test_deterministic(build):
+    messages = [(offset, "weather", {"temp": offset % 50}) for offset in range(100)]
+    first = run(build, messages)
+    assert first == run(build, messages)
+    assert len(first) > 1
+
+
+def test_recording_round_trip(build, tmp_path):
+    recording = tmp_path / "recording.jsonl"
+    recording.write_text(
+        "\n".join(
+            json.dumps({"time": offset, "entity": "weather", "message": {"temp": 40}})
+            for offset in range(4)
+        )
+    )
+    simulation = Simulation(build(MODEL), start=START)
+    simulation.load(str(recording))
+    published = simulation.run(10)
+    output = tmp_path / "actions.jsonl"
+    simulation.dump(str(output))
+    lines = [json.loads(line) for line in output.read_text().splitlines()]
+    assert lines == [
+        {"time": offset, "entity": name, "message": message}
+        for offset, name, message in published
+    ]
+    assert len(lines) == 1
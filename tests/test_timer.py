@@ -0,0 +1,123 @@
+import pytest
+
+from smauto.lib.scheduler import AutomationScheduler
+from smauto.lib.timer import DAY, PeriodicTimer, Timer, TimerWheel, TimeScheduler
+
+from conftest import automations_of
+
+
+class FakeClock(object):
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_periodic_timer_does_not_drift():
+    clock = FakeClock()
+    timer = PeriodicTimer(1.0, clock=clock)
+    assert timer.next_delay() == 1.0
+    for tick in range(1, 100):
+        # The loop body takes 0.3s
+        clock.now = tick + 0.3
+        assert timer.next_delay() == pytest.approx(0.7)
+    assert timer.deadline == 100.0
+    assert timer.overruns == 0
+
+
+def test_periodic_timer_skips_missed_ticks():
+    clock = FakeClock()
+    timer = PeriodicTimer(1.0, clock=clock)
+    timer.next_delay()
+    clock.now = 3.5
+    assert timer.next_delay() == pytest.approx(0.5)
+    assert (timer.overruns, timer.skipped) == (1, 2)
+    assert timer.max_lag == pytest.approx(1.5)
+    assert timer.summary() == "2 ticks, 1 overruns, 2 skipped, max lag 1500.00ms"
+
+
+def test_periodic_timer_catches_up():
+    clock = FakeClock()
+    timer = PeriodicTimer(1.0, policy="catch-up", clock=clock)
+    timer.next_delay()
+    clock.now = 3.5
+    assert [timer.next_delay() for _ in range(3)] == [0, 0, pytest.approx(0.5)]
+    assert (timer.overruns, timer.skipped) == (2, 0)
+
+
+def test_periodic_timer_reset():
+    clock = FakeClock()
+    timer = PeriodicTimer(2.0, clock=clock)
+    timer.next_delay()
+    timer.reset()
+    clock.now = 10.0
+    assert timer.next_delay() == 2.0
+    assert timer.overruns == 0
+
+
+def test_periodic_timer_policy():
+    with pytest.raises(ValueError):
+        PeriodicTimer(1.0, policy="drop")
+
+
+@pytest.mark.parametrize("delta", [1, 59, 60, 61, 3599, 3600, 7261, DAY - 1, DAY + 5])
+def test_wheel_fires_on_deadline(delta):
+    start = 10 * DAY + 123
+    wheel = TimerWheel(start)
+    fired = []
+    wheel.add(Timer(start + delta, lambda timer: fired.append(wheel.now)))
+    wheel.advance(start + delta - 1)
+    assert fired == []
+    wheel.advance(start + delta + 1000)
+    assert fired == [start + delta]
+
+
+def test_wheel_rearms_periodic_timers():
+    start = 10 * DAY
+    wheel = TimerWheel(start)
+    fired = []
+    wheel.add(Timer(start + 3600, lambda timer: fired.append(wheel.now), period=DAY))
+    wheel.advance(start + 3 * DAY)
+    assert fired == [start + 3600 + day * DAY for day in range(3)]
+
+
+def test_wheel_next_expiry():
+    wheel = TimerWheel(100)
+    assert wheel.next_expiry() is None
+    wheel.add(Timer(130, lambda timer: None))
+    assert wheel.next_expiry() == 130
+
+
+NIGHT = """
+Entity lamp
+    type: actuator
+    topic: "lamp"
+    broker: home_broker
+    attributes:
+        - on: bool
+end
+Automation night
+    condition:
+        system_clock.time >= 22:00
+    actions:
+        - lamp.on: true
+end
+"""
+
+
+def test_time_scheduler_wakes_on_boundaries(build):
+    automation = automations_of(build(NIGHT))["night"]
+    automation.condition.build()
+    clock = FakeClock(10 * DAY + 21 * 3600)
+    AutomationScheduler().add(automation)
+    scheduler = TimeScheduler(clock=clock)
+    scheduler.add(automation)
+    time_attr = automation.condition.time_conditions()[0].operand1.attribute
+    assert time_attr.value.hour == 21
+    assert not automation.notified
+    clock.now += 3600
+    with scheduler.lock:
+        scheduler.wheel.advance(int(clock()))
+    assert automation.notified
+    assert (time_attr.value.hour, time_attr.value.minute) == (22, 0)
@@ -0,0 +1,180 @@
+import random
+
+import pytest
+
+from smauto.lib.scheduler import AutomationScheduler
+from smauto.lib.simulation import Simulation
+from smauto.lib.vectorized import VectorizedEvaluator
+
+from conftest import automations_of, entities_of
+
+MODEL = """
+Entity s
+    type: sensor
+    topic: "s"
+    broker: home_broker
+    attributes:
+        - x: float
+        - y: int
+end
+Entity fan
+    type: actuator
+    topic: "fan"
+    broker: home_broker
+    attributes:
+        - on: bool
+end
+Automation n1
+    condition:
+        ((s.x > 5) AND (s.y <= 2)) OR (s.x in range [-3, 0])
+    mode: poll
+    actions:
+        - fan.on: true
+end
+Automation n2
+    condition:
+        ((s.x >= 5) XNOR (s.y == 2)) NAND ((s.x != 10) NOT (s.x < -3))
+    mode: poll
+    actions:
+        - fan.on: true
+end
+Automation n3
+    condition:
+        (s.x > 5) NOR (s.y < s.x)
+    mode: poll
+    actions:
+        - fan.on: true
+end
+Automation n4
+    condition:
+        mean(s.x, 2) > 5
+    mode: poll
+    actions:
+        - fan.on: true
+end
+"""
+
+
+def scheduler_of(model):
+    scheduler = AutomationScheduler()
+    for automation in model.automations:
+        scheduler.add(automation)
+    return scheduler
+
+
+def evaluator_of(model):
+    return scheduler_of(model).evaluator
+
+
+def test_matches_compiled_conditions(build):
+    model = build(MODEL)
+    evaluator = evaluator_of(model)
+    assert [a.name for a in evaluator.automations] == ["n1", "n2", "n3"]
+    s = entities_of(model)["s"]
+    rng = random.Random(0)
+    for _ in range(500):
+        s.update_state(
+            {
+                "x": rng.choice([rng.uniform(-20, 20), 5, 10, -3, 0]),
+                "y": rng.randint(-5, 5),
+            }
+        )
+        results = evaluator.evaluate()
+        for automation in evaluator.automations:
+            # Evaluate the compiled code, not the ConditionNetwork
+            condition = automation.condition
+            expected = bool(eval(condition.cond_code, condition.cond_globals))
+            assert bool(results[evaluator.index[automation]]) == expected
+
+
+def test_invalid_values_compare_false(build):
+    model = build(MODEL)
+    evaluator = evaluator_of(model)
+    s = entities_of(model)["s"]
+    s.update_state({"x": None, "y": 0})
+    results = evaluator.evaluate()
+    assert not results[evaluator.index[automations_of(model)["n1"]]]
+
+
+@pytest.mark.parametrize("value", [None, "abc"])
+def test_invalid_values_are_masked(build, value):
+    model = build(MODEL.replace("(s.x > 5) NOR (s.y < s.x)", "s.x != 10"))
+    evaluator = evaluator_of(model)
+    n3 = automations_of(model)["n3"]
+    entities_of(model)["s"].update_state({"x": value, "y": 0})
+    # NaN != 10 would hold
+    assert not evaluator.evaluate([n3])[0]
+
+
+def test_evaluates_due_automations_only(build):
+    model = build(MODEL)
+    evaluator = evaluator_of(model)
+    automations = automations_of(model)
+    entities_of(model)["s"].update_state({"x": 7.0, "y": 1})
+    everything = evaluator.evaluate()
+    results = evaluator.evaluate([automations["n3"], automations["n1"]])
+    assert list(results) == [
+        everything[evaluator.index[automations["n3"]]],
+        everything[evaluator.index[automations["n1"]]],
+    ]
+    _, cmp_passes, group_passes, _ = evaluator.plan(
+        (evaluator.index[automations["n3"]],)
+    )
+    # (s.x > 5) NOR (s.y < s.x)
+    assert sum(len(ids) for _, ids, _, _ in cmp_passes) == 2
+    assert sum(len(ids) for _, ids, _, _ in group_passes) == 1
+
+
+def test_scheduler_uses_batch_results(build, monkeypatch):
+    model = build(MODEL)
+    scheduler = scheduler_of(model)
+    automations = automations_of(model)
+    for name in ("n1", "n2", "n3"):
+        # The batch pass replaces the per-Automation evaluation
+        monkeypatch.setattr(
+            automations[name].condition,
+            "evaluate",
+            lambda: pytest.fail("evaluated on its own"),
+        )
+    entities_of(model)["s"].update_state({"x": 7.0, "y": 1})
+    due = scheduler.due()
+    scheduler.evaluate_batch(due)
+    assert automations["n1"].batch_result
+    assert automations["n1"].batch_cost > 0
+    assert automations["n1"].evaluate_condition()[0]
+    assert automations["n1"].batch_result is None
+    # Profiled at its share of the batch
+    evaluation = automations["n1"].profile.evaluation
+    assert evaluation.total >= automations["n1"].batch_cost
+
+
+def test_simulation_runs_on_batch_results(build, monkeypatch):
+    model = build(MODEL)
+    simulation = Simulation(model)
+    automations = automations_of(model)
+    for name in ("n1", "n2", "n3"):
+        monkeypatch.setattr(
+            automations[name].condition,
+            "evaluate",
+            lambda: pytest.fail("evaluated on its own"),
+        )
+    simulation.add_messages([(0.5, "s", {"x": 7.0, "y": 1})])
+    published = simulation.run(2)
+    assert sorted({round(offset, 6) for offset, _, _ in published}) == [0, 1, 2]
+
+
+def test_removed_automations_are_dropped(build):
+    model = build(MODEL)
+    evaluator = evaluator_of(model)
+    automations = automations_of(model)
+    evaluator.remove(automations["n2"])
+    assert len(evaluator.evaluate()) == 2
+    assert set(evaluator.index) == {automations["n1"], automations["n3"]}
+    assert evaluator.index[automations["n3"]] == 1
+
+
+def test_event_automations_are_not_batched(build):
+    model = build(MODEL.replace("mode: poll", "mode: event"))
+    evaluator = evaluator_of(model)
+    assert evaluator.automations == []
+    assert isinstance(evaluator, VectorizedEvaluator)